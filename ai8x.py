@@ -13,7 +13,11 @@ Contains the limits of the MAX78000/MAX78002 implementations and custom PyTorch
 the limits into account.
 """
 
+import copy
+from collections import OrderedDict
+
 import torch
+import torch.utils.checkpoint
 from torch import nn
 from torch.autograd import Function
 
@@ -49,16 +53,25 @@ class fold:
         if self.fold_ratio == 1:
             return img
 
-        img_folded = None
-        for i in range(self.fold_ratio):
-            for j in range(self.fold_ratio):
-                img_subsample = img[:, i::self.fold_ratio, j::self.fold_ratio]
-                if img_folded is not None:
-                    img_folded = torch.cat((img_folded, img_subsample), dim=0)
-                else:
-                    img_folded = img_subsample
+        return fold_batch(img.unsqueeze(0), self.fold_ratio).squeeze(0)
 
-        return img_folded
+
+def fold_batch(img_batch, fold_ratio):
+    """
+    Fold a batch of data to increase the number of channels (see ai8x.fold). This can be used
+    on the device or in a collate function, instead of folding each sample in the dataset.
+    Channel (i*fold_ratio + j)*C + c of the result holds img_batch[:, c, i::fold_ratio,
+    j::fold_ratio].
+    """
+    if fold_ratio == 1:
+        return img_batch
+
+    n, c, h, w = img_batch.shape
+    assert h % fold_ratio == 0 and w % fold_ratio == 0, \
+        f'Data shape {tuple(img_batch.shape)} cannot be folded by {fold_ratio}'
+    return img_batch.reshape(n, c, h // fold_ratio, fold_ratio, w // fold_ratio, fold_ratio) \
+        .permute(0, 3, 5, 1, 2, 4) \
+        .reshape(n, c * fold_ratio * fold_ratio, h // fold_ratio, w // fold_ratio)
 
 
 def unfold_batch(img_batch, fold_ratio):
@@ -72,20 +85,27 @@ def unfold_batch(img_batch, fold_ratio):
     if fold_ratio == 1:
         return img_batch
 
-    num_out_channels = img_batch.shape[1] // (fold_ratio*fold_ratio)
+    n, c, h, w = img_batch.shape
+    num_out_channels = c // (fold_ratio*fold_ratio)
+    return img_batch.reshape(n, fold_ratio, fold_ratio, num_out_channels, h, w) \
+        .permute(0, 3, 4, 1, 5, 2) \
+        .reshape(n, num_out_channels, h * fold_ratio, w * fold_ratio)
 
-    img_batch_uf = torch.zeros((img_batch.shape[0], num_out_channels,
-                                img_batch.shape[2]*fold_ratio, img_batch.shape[3]*fold_ratio),
-                               dtype=img_batch.dtype, device=img_batch.device, requires_grad=False)
 
-    for i in range(fold_ratio):
-        for j in range(fold_ratio):
-            ch_index_start = num_out_channels*(i*fold_ratio + j)
-            ch_index_end = num_out_channels * (i*fold_ratio + j + 1)
-            img_batch_uf[:, :, i::fold_ratio, j::fold_ratio] = \
-                img_batch[:, ch_index_start:ch_index_end, :, :]
+def quantize_(x, bits=8, extra_bit_shift=0):
+    """
+    Quantize `x` in-place and return it (see QuantizationFunction).
+    """
+    if dev.simulate:
+        if bits > 1:
+            return x.div_(2**(bits+extra_bit_shift-1)).add_(.5).floor_()
+        if bits < 1:
+            return x.mul_(2**(1-bits-extra_bit_shift)).add_(.5).floor_()
+        return x.add_(.5).floor_()
 
-    return img_batch_uf
+    factor1 = 2**(bits-extra_bit_shift-1)
+    factor2 = 2**(bits-1)
+    return x.mul_(factor1).add_(.5).floor_().div_(factor2)
 
 
 class QuantizationFunction(Function):
@@ -98,16 +118,7 @@ class QuantizationFunction(Function):
     @staticmethod
     def forward(_, x, bits=8, extra_bit_shift=0):  # pylint: disable=arguments-differ
         """Forward prop"""
-        if dev.simulate:
-            if bits > 1:
-                return x.div(2**(bits+extra_bit_shift-1)).add(.5).floor()
-            if bits < 1:
-                return x.mul(2**(1-bits-extra_bit_shift)).add(.5).floor()
-            return x.add(.5).floor()
-
-        factor1 = 2**(bits-extra_bit_shift-1)
-        factor2 = 2**(bits-1)
-        return x.mul(factor1).add(.5).floor().div(factor2)
+        return quantize_(x.clone(), bits, extra_bit_shift)
 
     @staticmethod
     def backward(_, x):  # pylint: disable=arguments-differ
@@ -117,6 +128,74 @@ class QuantizationFunction(Function):
         return x, None, None
 
 
+def scale_activate_quantize_clamp(x, s, activation, bits, extra_bit_shift, min_val, max_val,
+                                  grad_mask=False):
+    """
+    Scale `x` by `s` (None: no scaling), apply the `activation` ('ReLU', 'Abs', None), quantize
+    to `bits` (None: no quantization) and clamp to [`min_val`, `max_val`], using in-place
+    operations on a single new tensor. The result is identical to running the Scaler,
+    activation, Quantize and Clamp modules in sequence.
+    Returns the result and, when `grad_mask` is set, the one-byte-per-element mask that
+    the gradient is multiplied with (0 where clamped or where ReLU is inactive, and the sign of
+    the input for Abs).
+    """
+    mask = None
+    if s is not None:
+        y = x.mul(s)
+        if dev.simulate:
+            y.floor_()
+    else:
+        y = x.clone()
+
+    if activation == 'ReLU':
+        y.relu_()
+        if grad_mask:
+            mask = y > 0.
+    elif activation == 'Abs':
+        if grad_mask:
+            mask = y.sign().to(torch.int8)
+        y.abs_()
+
+    if bits is not None:
+        quantize_(y, bits, extra_bit_shift)
+
+    if grad_mask:
+        in_range = (y >= min_val) & (y <= max_val)
+        mask = in_range if mask is None else mask * in_range
+    y.clamp_(min=min_val, max=max_val)
+
+    return y, mask
+
+
+class ActivationQuantizationFunction(Function):
+    """
+    Custom autograd function
+    The forward pass fuses the output scale, activation, quantization and clamp of a layer.
+    The backward pass is straight through for the rounding operations, and applies the
+    gradients of the scale, activation and clamp using a saved one-byte mask instead of
+    full-size intermediate tensors.
+    """
+    @staticmethod
+    def forward(ctx, x, s, activation, bits,  # pylint: disable=arguments-differ
+                extra_bit_shift, min_val, max_val):
+        """Forward prop"""
+        y, mask = scale_activate_quantize_clamp(x, s, activation, bits, extra_bit_shift,
+                                                min_val, max_val, grad_mask=True)
+        ctx.save_for_backward(mask, s)
+        return y
+
+    @staticmethod
+    def backward(ctx, x):  # pylint: disable=arguments-differ
+        """Backprop"""
+        mask, s = ctx.saved_tensors
+        x = x.mul(mask)
+        if s is not None:
+            x = x.mul(s)
+        # Return as many input gradients as there were arguments;
+        # gradients of non-Tensor arguments to forward must be None.
+        return x, None, None, None, None, None, None
+
+
 class Quantize(nn.Module):
     """
     Post-activation integer quantization module
@@ -132,6 +211,30 @@ class Quantize(nn.Module):
         return QuantizationFunction.apply(x, self.num_bits, self.num_extra_bit_shift)
 
 
+class StraightThroughFunction(Function):
+    """
+    Custom autograd function
+    The forward pass returns `y`, the quantized replacement for the parameter `x`.
+    The backward pass is straight through to `x`.
+    """
+    @staticmethod
+    def forward(_, x, y):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        return y
+
+    @staticmethod
+    def backward(_, x):  # pylint: disable=arguments-differ
+        """Backprop"""
+        # Straight through - return as many input gradients as there were arguments;
+        # gradients of non-Tensor arguments to forward must be None.
+        return x, None
+
+    @staticmethod
+    def symbolic(_, x, y):  # pylint: disable=unused-argument
+        """ONNX export"""
+        return y
+
+
 class FloorFunction(Function):
     """
     Custom MAX78000/MAX78002 autograd function
@@ -310,38 +413,75 @@ class FloorQatONNX(nn.Module):
         return x.mul(factor).floor().div(factor)
 
 
+operator_registry = {}
+share_operators = False
+
+
+def set_operator_sharing(enabled):
+    """
+    Enable or disable sharing of the stateless operator modules between layers (see
+    shared_operator()). Sharing is off by default: since named_modules() lists a shared
+    module only once, activation statistics collectors, forward hooks and per-layer summaries
+    would report one merged entry instead of one entry per layer.
+    """
+    global share_operators  # pylint: disable=global-statement
+    share_operators = enabled
+    if not enabled:
+        operator_registry.clear()
+
+
+def shared_operator(cls, **kwargs):
+    """
+    Return an instance of the stateless operator module `cls(**kwargs)` (for example, Quantize
+    or Clamp) for the current device configuration. When enabled with set_operator_sharing(),
+    instances are created once per device, simulation and rounding mode and arguments, and
+    are shared by all layers that use them; otherwise, each call returns a new instance.
+    """
+    if not share_operators:
+        return cls(**kwargs)
+    key = (dev.device, dev.simulate, dev.round_avg, cls, tuple(sorted(kwargs.items())))
+    op = operator_registry.get(key)
+    if op is None:
+        op = operator_registry[key] = cls(**kwargs)
+    return op
+
+
 def quantize_clamp(wide, quantize_activation=False, weight_bits=8):
     """
-    Return new Quantization and Clamp objects.
+    Return the (shared) Quantization and Clamp objects.
     """
     if dev.simulate:
         if not wide:
-            quantize = Quantize(num_bits=dev.DATA_BITS)
-            clamp = Clamp(
+            quantize = shared_operator(Quantize, num_bits=dev.DATA_BITS)
+            clamp = shared_operator(
+                Clamp,
                 min_val=-(2**(dev.ACTIVATION_BITS-1)),
                 max_val=2**(dev.ACTIVATION_BITS-1)-1,
             )
         else:
-            quantize = Quantize(num_bits=dev.DATA_BITS - weight_bits + 1)
-            clamp = Clamp(
+            quantize = shared_operator(Quantize, num_bits=dev.DATA_BITS - weight_bits + 1)
+            clamp = shared_operator(
+                Clamp,
                 min_val=-(2**(dev.FULL_ACC_BITS-1)),
                 max_val=2**(dev.FULL_ACC_BITS-1)-1,
             )
     else:
         if quantize_activation:
             if not wide:
-                quantize = Quantize(num_bits=dev.ACTIVATION_BITS)
+                quantize = shared_operator(Quantize, num_bits=dev.ACTIVATION_BITS)
             else:
-                quantize = Quantize(num_bits=dev.WIDE_LAYER_RESOLUTION_BITS)
+                quantize = shared_operator(Quantize, num_bits=dev.WIDE_LAYER_RESOLUTION_BITS)
         else:
-            quantize = Empty()
+            quantize = shared_operator(Empty)
         if not wide:
-            clamp = Clamp(  # Do not combine with ReLU
+            clamp = shared_operator(  # Do not combine with ReLU
+                Clamp,
                 min_val=-1.,
                 max_val=(2.**(dev.ACTIVATION_BITS-1)-1)/(2.**(dev.ACTIVATION_BITS-1)),
             )
         else:
-            clamp = Clamp(
+            clamp = shared_operator(
+                Clamp,
                 min_val=-(2.**((dev.FULL_ACC_BITS-2*(dev.DATA_BITS-1))-1)),
                 max_val=2.**((dev.FULL_ACC_BITS-2*(dev.DATA_BITS-1))-1),
             )
@@ -351,51 +491,53 @@ def quantize_clamp(wide, quantize_activation=False, weight_bits=8):
 
 def quantize_clamp_pool(pooling, quantize_activation=False):
     """
-    Return new Quantization and Clamp objects for pooling.
+    Return the (shared) Quantization and Clamp objects for pooling.
     """
     if dev.simulate:
         if pooling == 'Avg':
-            quantize = Round() if dev.round_avg else AvgPoolFloor()
-            clamp = Clamp(
+            quantize = shared_operator(Round if dev.round_avg else AvgPoolFloor)
+            clamp = shared_operator(
+                Clamp,
                 min_val=-(2**(dev.DATA_BITS-1)),
                 max_val=2**(dev.DATA_BITS-1)-1,
             )
         else:  # Max, None
-            quantize = Empty()
-            clamp = Empty()
+            quantize = shared_operator(Empty)
+            clamp = shared_operator(Empty)
     else:
-        quantize = Empty()
+        quantize = shared_operator(Empty)
         if pooling == 'Avg':
             if quantize_activation:
-                quantize = RoundQat() if dev.round_avg else FloorQat()
-            clamp = Clamp(min_val=-1., max_val=127./128.)
+                quantize = shared_operator(RoundQat if dev.round_avg else FloorQat)
+            clamp = shared_operator(Clamp, min_val=-1., max_val=127./128.)
         else:  # Max, None
-            clamp = Empty()
+            clamp = shared_operator(Empty)
 
     return quantize, clamp
 
 
 def quantize_clamp_parameters(weight_bits, bias_bits):
     """
-    Return new Quantization and Clamp objects for weight and bias parameters
+    Return the (shared) Quantization and Clamp objects for weight and bias parameters
     """
     if dev.simulate:
-        quantize_weight = Quantize(num_bits=weight_bits-dev.DATA_BITS+1)
-        quantize_bias = Quantize(num_bits=2*(weight_bits-dev.DATA_BITS)+1)
-        clamp_weight = Empty()
-        clamp_bias = Empty()
+        quantize_weight = shared_operator(Quantize, num_bits=weight_bits-dev.DATA_BITS+1)
+        quantize_bias = shared_operator(Quantize, num_bits=2*(weight_bits-dev.DATA_BITS)+1)
+        clamp_weight = shared_operator(Empty)
+        clamp_bias = shared_operator(Empty)
     else:
         if weight_bits == 0 and bias_bits == 0:
-            quantize_weight = Empty()
-            quantize_bias = Empty()
-            clamp_weight = Empty()
-            clamp_bias = Empty()
+            quantize_weight = shared_operator(Empty)
+            quantize_bias = shared_operator(Empty)
+            clamp_weight = shared_operator(Empty)
+            clamp_bias = shared_operator(Empty)
         else:
-            quantize_weight = Quantize(num_bits=weight_bits)
-            quantize_bias = Quantize(num_bits=bias_bits)
-            clamp_weight = Clamp(min_val=-1.,
-                                 max_val=(2.**(weight_bits-1)-1)/(2.**(weight_bits-1)))
-            clamp_bias = Clamp(min_val=-1., max_val=(2.**(bias_bits-1)-1)/(2.**(bias_bits-1)))
+            quantize_weight = shared_operator(Quantize, num_bits=weight_bits)
+            quantize_bias = shared_operator(Quantize, num_bits=bias_bits)
+            clamp_weight = shared_operator(Clamp, min_val=-1.,
+                                           max_val=(2.**(weight_bits-1)-1)/(2.**(weight_bits-1)))
+            clamp_bias = shared_operator(Clamp, min_val=-1.,
+                                         max_val=(2.**(bias_bits-1)-1)/(2.**(bias_bits-1)))
 
     return quantize_weight, quantize_bias, clamp_weight, clamp_bias
 
@@ -550,11 +692,24 @@ class QuantizationAwareModule(nn.Module):
         self.bn = bn
         self.pooling = pooling
 
+        self.shift_update_interval = 1
+        self.shift_cache = None
+        self.shift_cache_key = None
+        self.shift_seen_key = None
+        self.shift_skipped = 0
+        self.weight_cache = None
+        self.weight_cache_key = None
+
         self.output_shift = nn.Parameter(torch.tensor([0.]), requires_grad=False)
         self.init_module(weight_bits, bias_bits, quantize_activation, shift_quantile)
 
-    def init_module(self, weight_bits, bias_bits, quantize_activation, shift_quantile):
+    def init_module(self, weight_bits, bias_bits, quantize_activation, shift_quantile,
+                    shift_update_interval=1):
         """Initialize model parameters"""
+        assert shift_update_interval >= 1, \
+            f'Shift update interval cannot be {shift_update_interval}'
+        self.shift_update_interval = shift_update_interval
+
         if weight_bits is None and bias_bits is None and not quantize_activation:
             self.weight_bits = nn.Parameter(torch.tensor([0]), requires_grad=False)
             self.bias_bits = nn.Parameter(torch.tensor([0]), requires_grad=False)
@@ -577,14 +732,15 @@ class QuantizationAwareModule(nn.Module):
     def set_functions(self):
         """Set functions to be used wrt the model parameters"""
         if self.adjust_output_shift.detach():
-            self.calc_out_shift = OutputShift(self.shift_quantile.detach().item())
-            self.calc_weight_scale = WeightScale()
+            self.calc_out_shift = shared_operator(
+                OutputShift, shift_quantile=self.shift_quantile.detach().item())
+            self.calc_weight_scale = shared_operator(WeightScale)
         else:
-            self.calc_out_shift = OutputShiftSqueeze()
-            self.calc_weight_scale = One()
+            self.calc_out_shift = shared_operator(OutputShiftSqueeze)
+            self.calc_weight_scale = shared_operator(One)
 
-        self.scale = Scaler()
-        self.calc_out_scale = OutputScale()
+        self.scale = shared_operator(Scaler)
+        self.calc_out_scale = shared_operator(OutputScale)
 
         self.quantize_weight, self.quantize_bias, self.clamp_weight, self.clamp_bias = \
             quantize_clamp_parameters(self.weight_bits.detach().item(),
@@ -595,43 +751,186 @@ class QuantizationAwareModule(nn.Module):
         self.quantize_pool, self.clamp_pool = \
             quantize_clamp_pool(self.pooling, bool(self.quantize_activation.detach().item()))
 
+        self.reset_shift_cache()
+        self.reset_weight_cache()
+
+    def reset_shift_cache(self):
+        """
+        Discard the cached output shift. This is needed only when the parameters were modified
+        in a way that bypasses the tensor version counter (e.g., in-place through `.data`).
+        """
+        self.shift_cache = None
+        self.shift_cache_key = None
+        self.shift_seen_key = None
+        self.shift_skipped = 0
+
+    def reset_weight_cache(self):
+        """
+        Discard the quantized weights and biases that are cached in evaluation mode.
+        """
+        self.weight_cache = None
+        self.weight_cache_key = None
+
+    def train(self, mode=True):
+        """
+        Set the module in training or evaluation mode. Since the quantized weights and biases
+        are cached while in evaluation mode, switching modes discards the cache.
+        """
+        self.reset_weight_cache()
+        return super().train(mode)
+
+    def _params_key(self):
+        """
+        Return a key that changes whenever the weights, bias or the stored output shift are
+        replaced or modified in-place (for example, by an optimizer step or checkpoint load).
+        """
+        params = (self.op.weight, self.op.bias, self.output_shift)
+        # pylint: disable=protected-access
+        return tuple((p.data_ptr(), p._version, p.device) for p in params if p is not None)
+
+    def calc_output_shift(self):
+        """
+        Return the output shift, the weight scale and the output scale.
+        The output shift is recalculated only after the parameters have changed (during
+        training, only every `shift_update_interval` parameter updates). In evaluation mode,
+        the shift always matches the current parameters and is frozen for as long as they
+        remain unchanged.
+        """
+        key = self._params_key()
+        if key != self.shift_cache_key:
+            if key != self.shift_seen_key:
+                self.shift_seen_key = key
+                self.shift_skipped += 1
+            if self.shift_cache is None or not self.training \
+               or self.shift_skipped >= self.shift_update_interval:
+                if self.op.bias is not None:
+                    bias_r = torch.flatten(self.op.bias.detach())
+                    weight_r = torch.flatten(self.op.weight.detach())
+                    params_r = torch.cat((weight_r, bias_r))
+                else:
+                    params_r = torch.flatten(self.op.weight.detach())
+                out_shift = self.calc_out_shift(params_r, self.output_shift.detach())
+                weight_scale = self.calc_weight_scale(out_shift)
+                out_scale = self.calc_out_scale(out_shift)
+
+                self.output_shift.data = out_shift.unsqueeze(0)
+
+                self.shift_cache = (out_shift, weight_scale, out_scale)
+                self.shift_cache_key = self.shift_seen_key = self._params_key()
+                self.shift_skipped = 0
+
+        return self.shift_cache
+
+    def quantize_params(self, weight_scale):
+        """
+        Return the scaled, quantized and clamped weights and biases (without gradient). In
+        evaluation mode, these are calculated once and reused for as long as the parameters
+        remain unchanged.
+        """
+        key = None
+        if not self.training:
+            key = (self._params_key(), dev.simulate)
+            if key == self.weight_cache_key:
+                return self.weight_cache
+
+        weight = self.clamp_weight(self.quantize_weight(
+            self.op.weight.detach().mul(weight_scale)))
+        bias = None
+        if self.op.bias is not None:
+            bias = self.clamp_bias(self.quantize_bias(self.op.bias.detach().mul(weight_scale)))
+
+        if key is not None:
+            self.weight_cache = (weight, bias)
+            self.weight_cache_key = key
+        return weight, bias
+
+    def op_forward(self, x, weight, bias):
+        """
+        Apply the operator `op` to `x`, using the quantized `weight` and `bias` in place of the
+        operator's parameters. Gradients pass straight through to the parameters.
+        The operator is called functionally, without modifying its parameters. When the operator
+        was replaced or hooked (e.g., by Distiller's summaries, statistics collectors or
+        post-training quantizer), its parameters are temporarily swapped instead.
+        """
+        op = self.op
+        # pylint: disable=protected-access, unidiomatic-typecheck
+        if not op._forward_hooks and not op._forward_pre_hooks \
+           and type(op) in (nn.Conv1d, nn.Conv2d, nn.ConvTranspose2d, nn.Linear):
+            weight = StraightThroughFunction.apply(op.weight, weight)
+            if bias is not None:
+                bias = StraightThroughFunction.apply(op.bias, bias)
+
+            if type(op) is nn.Conv2d:
+                return nn.functional.conv2d(x, weight, bias, op.stride, op.padding,
+                                            op.dilation, op.groups)
+            if type(op) is nn.Conv1d:
+                return nn.functional.conv1d(x, weight, bias, op.stride, op.padding,
+                                            op.dilation, op.groups)
+            if type(op) is nn.ConvTranspose2d:
+                return nn.functional.conv_transpose2d(x, weight, bias, op.stride, op.padding,
+                                                      op.output_padding, op.groups,
+                                                      op.dilation)
+            return nn.functional.linear(x, weight, bias)
+        # pylint: enable=protected-access, unidiomatic-typecheck
+
+        weights = op.weight.data
+        op.weight.data = weight
+        if op.bias is not None:
+            biases = op.bias.data
+            op.bias.data = bias
+
+        x = op(x)
+
+        op.weight.data = weights
+        if op.bias is not None:
+            op.bias.data = biases
+        return x
+
+    def quantize_output(self, x, out_scale):
+        """
+        Apply the output scale (except in wide mode), the activation, quantization and clamp
+        to the operator output `x`. Unless any of these modules were replaced or hooked (e.g.,
+        for ONNX export or by Distiller's statistics collectors), they are fused into a single
+        operation that does not keep intermediate tensors for the backward pass.
+        """
+        modules = (self.scale, self.activate, self.quantize, self.clamp)
+        activations = {nn.ReLU: 'ReLU', Abs: 'Abs', Empty: None}
+        # pylint: disable=protected-access, unidiomatic-typecheck
+        if type(self.scale) is Scaler and type(self.activate) in activations \
+           and type(self.quantize) in (Quantize, Empty) and type(self.clamp) is Clamp \
+           and not any(m._forward_hooks or m._forward_pre_hooks for m in modules):
+            if type(self.quantize) is Quantize:
+                bits = self.quantize.num_bits
+                extra_bit_shift = self.quantize.num_extra_bit_shift
+            else:
+                bits, extra_bit_shift = None, 0
+            # The device does not apply output shift in wide mode
+            args = (out_scale if not self.wide else None, activations[type(self.activate)],
+                    bits, extra_bit_shift, self.clamp.min_val, self.clamp.max_val)
+
+            if torch.is_grad_enabled() and x.requires_grad:
+                return ActivationQuantizationFunction.apply(x, *args)
+            return scale_activate_quantize_clamp(x, *args)[0]
+        # pylint: enable=protected-access, unidiomatic-typecheck
+
+        if not self.wide:
+            # The device does not apply output shift in wide mode
+            x = self.scale(x, out_scale)
+        return self.clamp(self.quantize(self.activate(x)))
+
     def forward(self, x):  # pylint: disable=arguments-differ
         """Forward prop"""
         if self.pool is not None:
             x = self.clamp_pool(self.quantize_pool(self.pool(x)))
         if self.op is not None:
-            if self.op.bias is not None:
-                bias_r = torch.flatten(self.op.bias.detach())
-                weight_r = torch.flatten(self.op.weight.detach())
-                params_r = torch.cat((weight_r, bias_r))
-            else:
-                params_r = torch.flatten(self.op.weight.detach())
-            out_shift = self.calc_out_shift(params_r, self.output_shift.detach())
-            weight_scale = self.calc_weight_scale(out_shift)
-            out_scale = self.calc_out_scale(out_shift)
-
-            self.output_shift.data = out_shift.unsqueeze(0)
-
-            weights = self.op.weight.data
-            self.op.weight.data = \
-                self.clamp_weight(self.quantize_weight(self.op.weight.mul(weight_scale)))
-            if self.op.bias is not None:
-                biases = self.op.bias.data
-                self.op.bias.data = \
-                    self.clamp_bias(self.quantize_bias(self.op.bias.mul(weight_scale)))
-
-            x = self.op(x)
-
-            self.op.weight.data = weights
-            if self.op.bias is not None:
-                self.op.bias.data = biases
+            _, weight_scale, out_scale = self.calc_output_shift()
+            weight, bias = self.quantize_params(weight_scale)
+            # Under autocast, only the operator runs in reduced precision
+            x = self.op_forward(x, weight, bias).to(x.dtype)
 
             if self.bn is not None:
                 x = self.bn(x).div(4.)
-            if not self.wide:
-                # The device does not apply output shift in wide mode
-                x = self.scale(x, out_scale)
-            x = self.clamp(self.quantize(self.activate(x)))
+            x = self.quantize_output(x, out_scale)
         return x
 
 
@@ -1547,6 +1846,9 @@ class DevAI84(Device):
 
         self.WEIGHT_INPUTS = 64
         self.WEIGHT_DEPTH = 128
+        self.PROCESSORS = 64
+        self.BIAS_GROUPS = 4
+        self.BIAS_SIZE = 256
 
         self.MAX_AVG_POOL = 4
 
@@ -1570,6 +1872,9 @@ class DevAI85(Device):
 
         self.WEIGHT_INPUTS = 256
         self.WEIGHT_DEPTH = 768
+        self.PROCESSORS = 64
+        self.BIAS_GROUPS = 4
+        self.BIAS_SIZE = 512
 
         self.MAX_AVG_POOL = 16
 
@@ -1593,6 +1898,9 @@ class DevAI87(Device):
 
         self.WEIGHT_INPUTS = 256
         self.WEIGHT_DEPTH = 5120
+        self.PROCESSORS = 64
+        self.BIAS_GROUPS = 4
+        self.BIAS_SIZE = 2048
 
         self.MAX_AVG_POOL = 16
 
@@ -1644,30 +1952,33 @@ def initiate_qat(m, qat_policy):
     """
     Modify model `m` to start quantization aware training.
     """
-    def _initiate_qat(m):
-        for attr_str in dir(m):
-            target_attr = getattr(m, attr_str)
-            if isinstance(target_attr, QuantizationAwareModule):
-                if 'shift_quantile' in qat_policy:
-                    target_attr.init_module(qat_policy['weight_bits'],
-                                            qat_policy['weight_bits'],
-                                            True, qat_policy['shift_quantile'])
-                else:
-                    target_attr.init_module(qat_policy['weight_bits'],
-                                            qat_policy['weight_bits'], True, 1.0)
-                if 'overrides' in qat_policy:
-                    if attr_str in qat_policy['overrides']:
-                        weight_field = qat_policy['overrides'][attr_str]['weight_bits']
-                        if 'shift_quantile' in qat_policy:
-                            target_attr.init_module(weight_field, weight_field,
-                                                    True, qat_policy['shift_quantile'])
-                        else:
-                            target_attr.init_module(weight_field,
-                                                    weight_field, True, 1.0)
+    shift_quantile = qat_policy.get('shift_quantile', 1.0)
+    shift_update_interval = qat_policy.get('shift_update_interval', 1)
+    overrides = qat_policy.get('overrides') or {}
 
-                setattr(m, attr_str, target_attr)
+    for name, module in list(m.named_modules()):
+        if isinstance(module, QuantizationAwareModule):
+            weight_bits = qat_policy['weight_bits']
+            # Overrides are selected by the attribute name of the layer
+            attr_str = name.rsplit('.', 1)[-1]
+            if attr_str in overrides:
+                weight_bits = overrides[attr_str]['weight_bits']
+            module.init_module(weight_bits, weight_bits, True, shift_quantile,
+                               shift_update_interval)
 
-    m.apply(_initiate_qat)
+
+def set_shift_update_interval(m, interval):
+    """
+    Set the number of parameter updates between output shift recalculations for all
+    quantization-aware layers of model `m`. This is needed when resuming QAT from a checkpoint.
+    """
+    def _set_shift_update_interval(m):
+        if isinstance(m, QuantizationAwareModule):
+            assert interval >= 1, f'Shift update interval cannot be {interval}'
+            m.shift_update_interval = interval
+            m.reset_shift_cache()
+
+    m.apply(_set_shift_update_interval)
 
 
 def update_model(m):
@@ -1675,52 +1986,133 @@ def update_model(m):
     Update model `m` with the current parameters.
     It is used to update model functions after loading a checkpoint file.
     """
-    def _update_model(m):
-        for attr_str in dir(m):
-            target_attr = getattr(m, attr_str)
-            if isinstance(target_attr, QuantizationAwareModule):
-                target_attr.set_functions()
-                setattr(m, attr_str, target_attr)
-
-    m.apply(_update_model)
+    for module in list(m.modules()):
+        if isinstance(module, QuantizationAwareModule):
+            module.set_functions()
 
 
-def fuse_bn_layers(m):
+def fold_batchnorm(weights, biases, running_means, running_vars, bn_weights, bn_biases, eps):
     """
-    Fuse the bn layers before the quantization aware training starts.
+    Fold batch normalization into the `weights` and `biases` of several layers at once.
+    All arguments are lists with one entry per layer; `biases`, `bn_weights` and `bn_biases`
+    entries may be None, and `eps` is a list or a single value. The statistics of all layers
+    on the same device are concatenated so that the scales and shifts are computed with one
+    set of tensor operations. The weights and existing biases are updated in place; the
+    list of biases, with new tensors for missing biases, is returned.
     """
-    def _fuse_bn_layers(m):
-        for attr_str in dir(m):
-            target_attr = getattr(m, attr_str)
-            if isinstance(target_attr, QuantizationAwareModule) \
-               and target_attr.bn is not None:
-                w = target_attr.op.weight.data
-                b = target_attr.op.bias.data
-                device = w.device
+    biases = list(biases)
+    if not isinstance(eps, (list, tuple)):
+        eps = [eps] * len(weights)
 
-                r_mean = target_attr.bn.running_mean
-                r_var = target_attr.bn.running_var
-                r_inv_std = torch.rsqrt(r_var + target_attr.bn.eps)
-                beta = target_attr.bn.weight
-                gamma = target_attr.bn.bias
+    groups = OrderedDict()
+    for i, w in enumerate(weights):
+        groups.setdefault((w.device, w.dtype), []).append(i)
 
-                if beta is None:
-                    beta = torch.ones(w.shape[0]).to(device)
-                if gamma is None:
-                    gamma = torch.zeros(w.shape[0]).to(device)
+    for (device, dtype), layers in groups.items():
+        sizes = [weights[i].shape[0] for i in layers]
 
-                beta = 0.25 * beta
-                gamma = 0.25 * gamma
+        def _cat(values, default, layers=layers, sizes=sizes, device=device, dtype=dtype):
+            return torch.cat([values[i].to(dtype) if values[i] is not None
+                              else torch.full((n, ), default, device=device, dtype=dtype)
+                              for i, n in zip(layers, sizes)])
 
-                w_new = w * (beta * r_inv_std).reshape((w.shape[0],) + (1,) * (len(w.shape) - 1))
-                b_new = (b - r_mean) * r_inv_std * beta + gamma
+        eps_all = torch.cat([torch.full((n, ), eps[i], device=device, dtype=dtype)
+                             for i, n in zip(layers, sizes)])
+        scale = 0.25 * _cat(bn_weights, 1.) * torch.rsqrt(_cat(running_vars, 1.) + eps_all)
+        shift = (_cat(biases, 0.) - _cat(running_means, 0.)) * scale + 0.25 * _cat(bn_biases, 0.)
 
-                target_attr.op.weight.data = w_new
-                target_attr.op.bias.data = b_new
-                target_attr.bn = None
-                setattr(m, attr_str, target_attr)
+        for i, layer_scale, layer_shift in zip(layers, scale.split(sizes), shift.split(sizes)):
+            w = weights[i]
+            w.mul_(layer_scale.reshape((w.shape[0],) + (1,) * (w.dim() - 1)))
+            if biases[i] is None:
+                biases[i] = layer_shift.clone()
+            else:
+                biases[i].copy_(layer_shift)
+
+    return biases
 
-    m.apply(_fuse_bn_layers)
+
+def fuse_bn_layers(m):
+    """
+    Fuse the bn layers before the quantization aware training starts.
+    """
+    modules = [module for module in m.modules()
+               if isinstance(module, QuantizationAwareModule) and module.bn is not None]
+    if not modules:
+        return
+
+    with torch.no_grad():
+        fold_batchnorm(
+            [module.op.weight.data for module in modules],
+            [module.op.bias.data for module in modules],
+            [module.bn.running_mean for module in modules],
+            [module.bn.running_var for module in modules],
+            [module.bn.weight for module in modules],
+            [module.bn.bias for module in modules],
+            [module.bn.eps for module in modules],
+        )
+
+    for module in modules:
+        module.bn = None
+        # The in-place update through `.data` bypasses the tensor version counter
+        module.reset_shift_cache()
+        module.reset_weight_cache()
+
+
+def checkpoint(m, *args, function=None, enabled=True):
+    """
+    Return `function(*args)` (default: `m(*args)`). When `enabled` and gradients are needed,
+    the activations inside `m` are not stored but recomputed in the backward pass (activation
+    checkpointing). `function` may return a tuple of tensors; to save memory, it should cover
+    a whole stage of the model rather than a single layer. BatchNorm running statistics in `m`
+    are not updated by the recomputation.
+    """
+    if function is None:
+        function = m
+    if not enabled or not torch.is_grad_enabled() \
+       or not any(torch.is_tensor(a) and a.requires_grad for a in args) \
+       and not any(p.requires_grad for p in m.parameters()):
+        return function(*args)
+
+    autocast = torch.is_autocast_enabled()
+
+    def _forward(_, *inputs):
+        if not torch.is_grad_enabled():
+            return function(*inputs)
+
+        # Recomputation in the backward pass
+        bns = [module for module in m.modules()
+               if isinstance(module, (nn.BatchNorm1d, nn.BatchNorm2d))
+               and module.track_running_stats and module.running_mean is not None]
+        stats = [(bn.running_mean.clone(), bn.running_var.clone(),
+                  bn.num_batches_tracked.clone()) for bn in bns]
+        try:
+            with torch.cuda.amp.autocast(enabled=autocast):
+                return function(*inputs)
+        finally:
+            with torch.no_grad():
+                for bn, (mean, var, count) in zip(bns, stats):
+                    bn.running_mean.copy_(mean)
+                    bn.running_var.copy_(var)
+                    bn.num_batches_tracked.copy_(count)
+
+    # The recomputation runs only when an input requires gradients, which the model input
+    # usually does not
+    requires_grad = torch.empty(0, requires_grad=True)
+    return torch.utils.checkpoint.checkpoint(_forward, requires_grad, *args)
+
+
+def set_activation_checkpointing(m, enabled):
+    """
+    Enable or disable activation checkpointing in all modules of `m` that support it (modules
+    with a `checkpoint_activations` attribute). Returns the number of these modules.
+    """
+    count = 0
+    for module in m.modules():
+        if hasattr(module, 'checkpoint_activations'):
+            module.checkpoint_activations = enabled
+            count += 1
+    return count
 
 
 def onnx_export_prep(m, simplify=False):
@@ -1759,3 +2151,376 @@ def onnx_export_prep(m, simplify=False):
                 setattr(m, attr_str, ScalerONNX())
 
     m.apply(_onnx_export_prep)
+
+
+def quantize_jit(x, bits: int, extra_bit_shift: int, simulate: bool):
+    """
+    Return the quantized `x` (see QuantizationFunction). TorchScript compatible version without
+    gradient.
+    """
+    if simulate:
+        if bits > 1:
+            return x.div(2.**(bits+extra_bit_shift-1)).add(.5).floor()
+        if bits < 1:
+            return x.mul(2.**(1-bits-extra_bit_shift)).add(.5).floor()
+        return x.add(.5).floor()
+
+    return x.mul(2.**(bits-extra_bit_shift-1)).add(.5).floor().div(2.**(bits-1))
+
+
+def straight_through_jit(x, y):
+    """
+    Return the values of `y` with the gradient passed straight through to `x`.
+    TorchScript compatible version of StraightThroughFunction.
+    """
+    return y + (x - x.detach())
+
+
+def quantize_spec_jit(quantize):
+    """
+    Return (enabled, bits, extra bit shift) for the `quantize` module.
+    """
+    if isinstance(quantize, Quantize):
+        return True, int(quantize.num_bits), int(quantize.num_extra_bit_shift)
+    assert isinstance(quantize, Empty), f'{type(quantize).__name__} is not supported by JIT'
+    return False, 0, 0
+
+
+def clamp_spec_jit(clamp):
+    """
+    Return (enabled, min value, max value) for the `clamp` module.
+    """
+    if isinstance(clamp, Clamp):
+        return True, float(clamp.min_val), float(clamp.max_val)
+    assert isinstance(clamp, Empty), f'{type(clamp).__name__} is not supported by JIT'
+    return False, 0., 0.
+
+
+class QuantizationAwareModuleJIT(nn.Module):
+    """
+    TorchScript compatible version of the QuantizationAwareModule `m`.
+    The operator, batch norm, pooling and all parameters are shared with `m`. The quantization
+    configuration of `m` and the device settings are turned into constants, so a new instance
+    is needed whenever they change.
+    """
+    def __init__(self, m):
+        super().__init__()
+        pool_quantize = {Empty: 0, Round: 1, AvgPoolFloor: 2, RoundQat: 3, FloorQat: 4}
+        activations = {Empty: 0, nn.ReLU: 1, Abs: 2}
+        ops = {nn.Conv2d: 0, nn.Conv1d: 1, nn.ConvTranspose2d: 2, nn.Linear: 3}
+        # pylint: disable=unidiomatic-typecheck
+        assert type(m.quantize_pool) in pool_quantize, \
+            f'{type(m.quantize_pool).__name__} is not supported by JIT'
+        assert type(m.activate) in activations, \
+            f'{type(m.activate).__name__} is not supported by JIT'
+        assert type(m.scale) is Scaler, f'{type(m.scale).__name__} is not supported by JIT'
+        assert m.op is None or type(m.op) in ops, \
+            f'{type(m.op).__name__} is not supported by JIT'
+        # pylint: enable=unidiomatic-typecheck
+
+        self.pool = m.pool
+        self.op = m.op
+        self.bn = m.bn
+
+        # Shared parameters, these keep the state_dict keys of `m`
+        self.output_shift = m.output_shift
+        self.weight_bits = m.weight_bits
+        self.bias_bits = m.bias_bits
+        self.quantize_activation = m.quantize_activation
+        self.adjust_output_shift = m.adjust_output_shift
+        self.shift_quantile = m.shift_quantile
+
+        self.wide = bool(m.wide)
+        self.simulate = bool(dev.simulate)
+
+        self.pool_quantize = pool_quantize[type(m.quantize_pool)]
+        self.pool_factor = float(2**(dev.ACTIVATION_BITS - 1))
+        self.pool_clamp, self.pool_min_val, self.pool_max_val = clamp_spec_jit(m.clamp_pool)
+
+        self.calc_shift = isinstance(m.calc_out_shift, OutputShift)
+        self.quantile = float(m.calc_out_shift.shift_quantile) if self.calc_shift else 1.
+
+        self.weight_quantize, self.weight_num_bits, _ = quantize_spec_jit(m.quantize_weight)
+        self.weight_clamp, self.weight_min_val, self.weight_max_val = \
+            clamp_spec_jit(m.clamp_weight)
+        self.bias_quantize, self.bias_num_bits, _ = quantize_spec_jit(m.quantize_bias)
+        self.bias_clamp, self.bias_min_val, self.bias_max_val = clamp_spec_jit(m.clamp_bias)
+
+        self.activation = activations[type(m.activate)]
+        self.act_quantize, self.act_num_bits, self.act_extra_bit_shift = \
+            quantize_spec_jit(m.quantize)
+        _, self.min_val, self.max_val = clamp_spec_jit(m.clamp)
+
+        # Operator arguments, with placeholders where the operator does not use them
+        self.op_type = ops[type(m.op)] if m.op is not None else -1
+        self.stride = [1]
+        self.padding = [0]
+        self.output_padding = [0]
+        self.dilation = [1]
+        self.groups = 1
+        if isinstance(m.op, (nn.Conv1d, nn.Conv2d, nn.ConvTranspose2d)):
+            assert m.op.padding_mode == 'zeros', \
+                f'Padding mode {m.op.padding_mode} is not supported by JIT'
+            self.stride = list(m.op.stride)
+            self.padding = list(m.op.padding)
+            self.output_padding = list(m.op.output_padding)
+            self.dilation = list(m.op.dilation)
+            self.groups = int(m.op.groups)
+
+    def quantize_param(self, x, weight_scale, quantize: bool, num_bits: int, clamp: bool,
+                       min_val: float, max_val: float):
+        """Return the scaled, quantized and clamped parameter `x` (without gradient)"""
+        x = x.detach().mul(weight_scale)
+        if quantize:
+            x = quantize_jit(x, num_bits, 0, self.simulate)
+        if clamp:
+            x = x.clamp(min=min_val, max=max_val)
+        return x
+
+    def forward(self, x):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        if self.pool is not None:
+            x = self.pool(x)
+            if self.pool_quantize == 1:
+                x = straight_through_jit(x, x.detach().round())
+            elif self.pool_quantize == 2:
+                x = straight_through_jit(x, torch.where(x > 0, torch.floor(x.detach()),
+                                                        torch.ceil(x.detach())))
+            elif self.pool_quantize == 3:
+                x = x.mul(self.pool_factor)
+                x = straight_through_jit(x, x.detach().round()).div(self.pool_factor)
+            elif self.pool_quantize == 4:
+                x = x.mul(self.pool_factor)
+                x = straight_through_jit(x, torch.where(x > 0, torch.floor(x.detach()),
+                                                        torch.ceil(x.detach())))
+                x = x.div(self.pool_factor)
+            if self.pool_clamp:
+                x = x.clamp(min=self.pool_min_val, max=self.pool_max_val)
+
+        if self.op is not None:
+            weight = self.op.weight
+            bias = self.op.bias
+
+            if self.calc_shift:
+                if bias is not None:
+                    params_r = torch.cat((weight.detach().flatten(), bias.detach().flatten()))
+                else:
+                    params_r = weight.detach().flatten()
+                limit = torch.quantile(params_r.abs(), self.quantile)
+                out_shift = -(1./limit).log2().floor().clamp(min=-15., max=15.)
+                self.output_shift.detach().copy_(out_shift.unsqueeze(0))
+                weight_scale = torch.exp2(-out_shift)
+            else:
+                out_shift = self.output_shift.detach().squeeze(0)
+                weight_scale = torch.ones(1, device=out_shift.device)
+            out_scale = torch.exp2(out_shift)
+
+            weight = straight_through_jit(weight, self.quantize_param(
+                weight, weight_scale, self.weight_quantize, self.weight_num_bits,
+                self.weight_clamp, self.weight_min_val, self.weight_max_val))
+            if bias is not None:
+                bias = straight_through_jit(bias, self.quantize_param(
+                    bias, weight_scale, self.bias_quantize, self.bias_num_bits,
+                    self.bias_clamp, self.bias_min_val, self.bias_max_val))
+
+            if self.op_type == 0:
+                x = nn.functional.conv2d(x, weight, bias, self.stride, self.padding,
+                                         self.dilation, self.groups)
+            elif self.op_type == 1:
+                x = nn.functional.conv1d(x, weight, bias, self.stride, self.padding,
+                                         self.dilation, self.groups)
+            elif self.op_type == 2:
+                x = nn.functional.conv_transpose2d(x, weight, bias, self.stride, self.padding,
+                                                   self.output_padding, self.groups,
+                                                   self.dilation)
+            else:
+                x = nn.functional.linear(x, weight, bias)
+
+            if self.bn is not None:
+                x = self.bn(x).div(4.)
+
+            if not self.wide:
+                # The device does not apply output shift in wide mode
+                x = x.mul(out_scale)
+                if self.simulate:
+                    x = straight_through_jit(x, x.detach().floor())
+            if self.activation == 1:
+                x = torch.relu(x)
+            elif self.activation == 2:
+                x = torch.abs(x)
+            if self.act_quantize:
+                x = straight_through_jit(x, quantize_jit(x.detach(), self.act_num_bits,
+                                                         self.act_extra_bit_shift,
+                                                         self.simulate))
+            x = x.clamp(min=self.min_val, max=self.max_val)
+        return x
+
+
+class EltwiseJIT(nn.Module):
+    """
+    TorchScript compatible version of the two-input Eltwise operation `m`
+    """
+    def __init__(self, m):
+        super().__init__()
+        ops = {Add: 0, Sub: 1, BitwiseXor: 2, BitwiseOr: 3}
+        assert type(m) in ops, f'{type(m).__name__} is not supported by JIT'
+        self.op_type = ops[type(m)]
+        _, self.min_val, self.max_val = clamp_spec_jit(m.clamp)
+
+    def forward(self, x, y):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        if self.op_type == 1:
+            x = torch.add(x, torch.neg(y))
+        elif self.op_type == 2 or self.op_type == 3:
+            a = x.add(.5).mul(256.).round().int()
+            b = y.add(.5).mul(256.).round().int()
+            if self.op_type == 2:
+                x = torch.bitwise_xor(a, b).div(256.).sub(.5)
+            else:
+                x = torch.bitwise_or(a, b).div(256.).sub(.5)
+        else:
+            x = torch.add(x, y)
+        return x.clamp(min=self.min_val, max=self.max_val)
+
+
+def jit_script(m):
+    """
+    Return a TorchScript version of model `m`. The scripted model shares all parameters and
+    buffers with `m`, so training either model updates both, and `m` can be used for
+    checkpoints. It must be re-created whenever the quantization configuration of `m` changes
+    (for example, when quantization-aware training starts).
+    """
+    def _jit_replace(m):
+        if isinstance(m, QuantizationAwareModule):
+            return QuantizationAwareModuleJIT(m)
+        if isinstance(m, Eltwise):
+            return EltwiseJIT(m)
+        return None
+
+    return torch.jit.script(copy_replace_modules(m, _jit_replace))
+
+
+def copy_replace_modules(m, replace):
+    """
+    Return a shallow copy of the module tree of model `m` where each module for which
+    `replace(module)` returns a new module is replaced. Parameters and buffers are shared with
+    `m`, and `m` is not modified.
+    """
+    new = replace(m)
+    if new is not None:
+        return new
+    c = copy.copy(m)
+    c.__dict__['_modules'] = OrderedDict(
+        (name, copy_replace_modules(child, replace) if child is not None else None)
+        for name, child in m._modules.items()  # pylint: disable=protected-access
+    )
+    return c
+
+
+class IntegerInferenceModule(nn.Module):
+    """
+    Inference-only version of the QuantizationAwareModule `m` for device simulation
+    (`simulate=True`). The weights and biases are quantized once, and the output shift,
+    activation, quantization and clamp are applied in-place, without any of the bookkeeping
+    needed for training.
+    This is not an integer arithmetic engine: like simulation, the operators run in float32
+    on integer-valued tensors, so the results match simulation bit-for-bit. They are exact as
+    long as the accumulated sums stay below 2**24.
+    """
+    def __init__(self, m):
+        super().__init__()
+        assert dev.simulate, '--integer-inference requires simulate=True'
+        activations = {Empty: None, nn.ReLU: 'ReLU', Abs: 'Abs'}
+        # pylint: disable=unidiomatic-typecheck
+        assert type(m.activate) in activations, \
+            f'{type(m.activate).__name__} is not supported by --integer-inference'
+        assert m.op is None or type(m.op) in (nn.Conv1d, nn.Conv2d, nn.ConvTranspose2d,
+                                              nn.Linear), \
+            f'{type(m.op).__name__} is not supported by --integer-inference'
+        # pylint: enable=unidiomatic-typecheck
+
+        self.wide = m.wide
+        self.pool = m.pool
+        self.pool_round = isinstance(m.quantize_pool, Round)
+        self.pool_trunc = isinstance(m.quantize_pool, AvgPoolFloor)
+        _, self.pool_min_val, self.pool_max_val = clamp_spec_jit(m.clamp_pool)
+        self.pool_clamp = isinstance(m.clamp_pool, Clamp)
+
+        self.op = None
+        self.bn = m.bn
+        if m.op is not None:
+            self.op = copy.copy(m.op)  # Keeps the operator arguments, without the parameters
+            # pylint: disable=protected-access
+            self.op._parameters = OrderedDict()
+            self.op._forward_hooks = OrderedDict()
+            self.op._forward_pre_hooks = OrderedDict()
+            # pylint: enable=protected-access
+
+            training = m.training
+            m.eval()
+            with torch.no_grad():
+                out_shift, weight_scale, _ = m.calc_output_shift()
+                weight, bias = m.quantize_params(weight_scale)
+            m.train(training)
+
+            if weight.min() < -128 or weight.max() > 127:
+                raise ValueError('The weights do not fit into 8 bits, '
+                                 'is the checkpoint quantized?')
+            self.register_buffer('weight', weight.clone())
+            self.register_buffer('bias', bias.clone() if bias is not None else None)
+            self.register_buffer('output_shift', out_shift.detach().clone().unsqueeze(0))
+            # The device does not apply output shift in wide mode
+            self.out_scale = None if m.wide else float(2.**out_shift.item())
+
+        self.activation = activations[type(m.activate)]
+        if isinstance(m.quantize, Quantize):
+            self.bits, self.extra_bit_shift = m.quantize.num_bits, m.quantize.num_extra_bit_shift
+        else:
+            self.bits, self.extra_bit_shift = None, 0
+        _, self.min_val, self.max_val = clamp_spec_jit(m.clamp)
+
+    def forward(self, x):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        if self.pool is not None:
+            x = self.pool(x)
+            if self.pool_round:
+                x = x.round_()
+            elif self.pool_trunc:
+                x = x.trunc_()  # floor for positive, ceil for negative numbers
+            if self.pool_clamp:
+                x = x.clamp_(min=self.pool_min_val, max=self.pool_max_val)
+
+        if self.op is not None:
+            op = self.op
+            if isinstance(op, nn.Conv2d):
+                x = nn.functional.conv2d(x, self.weight, self.bias, op.stride, op.padding,
+                                         op.dilation, op.groups)
+            elif isinstance(op, nn.Conv1d):
+                x = nn.functional.conv1d(x, self.weight, self.bias, op.stride, op.padding,
+                                         op.dilation, op.groups)
+            elif isinstance(op, nn.ConvTranspose2d):
+                x = nn.functional.conv_transpose2d(x, self.weight, self.bias, op.stride,
+                                                   op.padding, op.output_padding, op.groups,
+                                                   op.dilation)
+            else:
+                x = nn.functional.linear(x, self.weight, self.bias)
+
+            if self.bn is not None:
+                x = self.bn(x).div(4.)
+            x = scale_activate_quantize_clamp(x, self.out_scale, self.activation, self.bits,
+                                              self.extra_bit_shift, self.min_val,
+                                              self.max_val)[0]
+        return x
+
+
+def integer_inference_prep(m):
+    """
+    Return an inference-only copy of model `m` for fast evaluation in simulation mode
+    (`simulate=True`), using IntegerInferenceModule layers. The result matches `m` bit-for-bit.
+    """
+    def _integer_replace(m):
+        if isinstance(m, QuantizationAwareModule):
+            return IntegerInferenceModule(m)
+        return None
+
+    return copy_replace_modules(m, _integer_replace).eval()
@@ -188,6 +188,9 @@ class MBConvBlock(nn.Module):
         # Skip connection
         self.resid = ai8x.Add()
 
+        # Recompute the activations in the backward pass (see ai8x.set_activation_checkpointing)
+        self.checkpoint_activations = False
+
     def forward(self, inputs):
         """MBConvBlock's forward function.
 
@@ -196,6 +199,11 @@ class MBConvBlock(nn.Module):
         Returns:
             Output of this block after processing.
         """
+        return ai8x.checkpoint(self, inputs, function=self._forward,
+                               enabled=self.checkpoint_activations)
+
+    def _forward(self, inputs):
+        """Forward prop without activation checkpointing"""
         # Expansion Convolution layer
         x = inputs
         if self.expand_ratio != 1:
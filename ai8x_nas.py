@@ -172,6 +172,7 @@ class OnceForAllModule(nn.Module):
         if self.pool is not None:
             x = self.clamp_pool(self.quantize_pool(self.pool(x)))
         if self.op is not None:
+            dtype = x.dtype
             weight = self.op.weight[:self.out_channels, :self.in_channels]
             bias = self.op.bias
             if bias is not None:
@@ -195,6 +196,8 @@ class OnceForAllModule(nn.Module):
                 pad = int(self.padding_list[k_idx].detach().cpu().item())
                 x = self.func(x, weight, bias, self.op.stride, pad, self.op.dilation,
                               self.op.groups)
+            # Under autocast, only the operator runs in reduced precision
+            x = x.to(dtype)
 
             if self.bn is not None:
                 x = F.batch_norm(x, self.bn.running_mean[:self.out_channels],
@@ -15,71 +15,44 @@ import argparse
 
 import torch
 
+import ai8x
+
 
 def bn_fuser(state_dict):
     """
-    Fuses the BN parameters and returns a new statedict
+    Fuses the BN parameters in place and returns the statedict
     """
-    dict_keys = state_dict.keys()
-    set_convbn_layers = set()
-    for dict_key in dict_keys:
-        if dict_key.endswith('.bn.running_mean'):
-            set_convbn_layers.add(dict_key.rsplit('.', 3)[0])
+    layers = sorted({key.rsplit('.', 3)[0] for key in state_dict
+                     if key.endswith('.bn.running_mean')})
+    if not layers:
+        return state_dict
 
-    for layer in set_convbn_layers:
+    w_keys, b_keys, bn_keys = [], [], []
+    for layer in layers:
         if layer + '.op.weight' in state_dict:
             conv_key = layer + '.op'
         else:
             conv_key = layer + '.conv2d'  # Compatibility with older checkpoints
-        w_key = conv_key + '.weight'
-        b_key = conv_key + '.bias'
-
-        bn_key = layer + '.bn'
-        r_mean_key = bn_key + '.running_mean'
-        r_var_key = bn_key + '.running_var'
-        beta_key = bn_key + '.weight'
-        gamma_key = bn_key + '.bias'
-        batches_key = bn_key + '.num_batches_tracked'
-
-        w = state_dict[w_key]
-        device = state_dict[w_key].device
-        if b_key in state_dict:
-            b = state_dict[b_key]
-        else:
-            b = torch.zeros(w.shape[0]).to(device)
-        if r_mean_key in state_dict:
-            r_mean = state_dict[r_mean_key]
-        if r_var_key in state_dict:
-            r_var = state_dict[r_var_key]
-            r_std = torch.sqrt(r_var + 1e-20)
-        if beta_key in state_dict:
-            beta = state_dict[beta_key]
-        else:
-            beta = torch.ones(w.shape[0]).to(device)
-        if gamma_key in state_dict:
-            gamma = state_dict[gamma_key]
-        else:
-            gamma = torch.zeros(w.shape[0]).to(device)
-
-        beta = 0.25 * beta
-        gamma = 0.25 * gamma
-
-        w_new = w * (beta / r_std).reshape((w.shape[0],) + (1,) * (len(w.shape) - 1))
-        b_new = (b - r_mean)/r_std * beta + gamma
-
-        state_dict[w_key] = w_new
-        state_dict[b_key] = b_new
-
-        if r_mean_key in state_dict:
-            del state_dict[r_mean_key]
-        if r_var_key in state_dict:
-            del state_dict[r_var_key]
-        if beta_key in state_dict:
-            del state_dict[beta_key]
-        if gamma_key in state_dict:
-            del state_dict[gamma_key]
-        if batches_key in state_dict:
-            del state_dict[batches_key]
+        w_keys.append(conv_key + '.weight')
+        b_keys.append(conv_key + '.bias')
+        bn_keys.append(layer + '.bn')
+
+    with torch.no_grad():
+        biases = ai8x.fold_batchnorm(
+            [state_dict[key] for key in w_keys],
+            [state_dict.get(key) for key in b_keys],
+            [state_dict.get(key + '.running_mean') for key in bn_keys],
+            [state_dict.get(key + '.running_var') for key in bn_keys],
+            [state_dict.get(key + '.weight') for key in bn_keys],
+            [state_dict.get(key + '.bias') for key in bn_keys],
+            1e-20,
+        )
+
+    for b_key, bn_key, b in zip(b_keys, bn_keys, biases):
+        state_dict[b_key] = b
+        for suffix in ['.running_mean', '.running_var', '.weight', '.bias',
+                       '.num_batches_tracked']:
+            state_dict.pop(bn_key + suffix, None)
 
     return state_dict
 
@@ -92,7 +65,7 @@ def main(args):
     out_path = args.out_path
     out_arch = args.out_arch
 
-    model_params = torch.load(inp_path)
+    model_params = torch.load(inp_path, map_location='cpu')
     new_state_dict = bn_fuser(model_params['state_dict'])
     model_params['state_dict'] = new_state_dict
     model_params['arch'] = out_arch
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Benchmark of the forward and backward pass of the ai8x layers and of all models on the CPU,
+in floating point mode, in QAT mode, in simulation (-8) mode and with the inference-only
+simulation layers (--integer-inference). The results are saved as JSON and can be compared
+with the results of another commit (--compare).
+"""
+import argparse
+import fnmatch
+import glob
+import inspect
+import os
+import re
+import sys
+from pydoc import locate
+
+import torch
+
+import ai8x
+import devices
+from utils import benchmark, registry
+
+MODES = ['float', 'qat', 'simulate', 'integer']
+QAT_POLICY = {'weight_bits': 8}
+
+
+def training_configurations():
+    """
+    Return the dataset, device, bias and object detection settings that the training scripts
+    use for each model, by model name.
+    """
+    configurations = {}
+    for path in sorted(glob.glob(os.path.join('scripts', '*.sh'))
+                       + glob.glob(os.path.join('nas', 'scripts', '*.sh'))):
+        with open(path, mode='r', encoding='utf-8') as f:
+            for line in f:
+                model = re.search(r'--model\s+(\S+)', line)
+                dataset = re.search(r'--dataset\s+(\S+)', line)
+                if not model or not dataset or model.group(1) in configurations:
+                    continue
+                device = re.search(r'--device\s+(\S+)', line)
+                configurations[model.group(1)] = {
+                    'dataset': dataset.group(1),
+                    'device': devices.device(device.group(1)) if device else None,
+                    'bias': '--use-bias' in line,
+                    'obj_detection': '--obj-detection' in line,
+                }
+    return configurations
+
+
+def layer_cases():
+    """
+    Return (name, constructor, input shapes) for each ai8x layer class.
+    """
+    cases = []
+    for name, cls in inspect.getmembers(ai8x, inspect.isclass):
+        if cls.__module__ != 'ai8x' or name.endswith('JIT') \
+           or cls in (ai8x.QuantizationAwareModule, ai8x.Eltwise):
+            continue
+        if issubclass(cls, ai8x.Eltwise):
+            cases.append((name, lambda cls=cls, **_: cls(), [(16, 32, 32), (16, 32, 32)]))
+        elif name in ('MaxPool2d', 'AvgPool2d'):
+            cases.append((name, lambda cls=cls, **kwargs: cls(2, **kwargs), [(16, 32, 32)]))
+        elif name in ('MaxPool1d', 'AvgPool1d'):
+            cases.append((name, lambda cls=cls, **kwargs: cls(2, **kwargs), [(16, 128)]))
+        elif issubclass(cls, ai8x.QuantizationAwareModule) or name.endswith('Linear') \
+                or name.endswith('LinearReLU'):
+            if 'Linear' in name:
+                args, kwargs, shape = (256, 64), {}, (256, )
+            elif 'ConvTranspose2d' in name:
+                args, kwargs, shape = (16, 16, 3), {'stride': 2, 'padding': 1}, (16, 16, 16)
+            elif 'Depthwise' in name:
+                args, kwargs, shape = (16, 16, 3), {'padding': 1}, (16, 32, 32)
+            elif 'Conv2d' in name:
+                args, kwargs, shape = (16, 32, 3), {'padding': 1}, (16, 32, 32)
+            elif 'Conv1d' in name:
+                args, kwargs, shape = (16, 32, 3), {'padding': 1}, (16, 128)
+            else:
+                continue
+
+            def _create(cls=cls, args=args, kwargs=kwargs, **extra):
+                if not issubclass(cls, ai8x.QuantizationAwareModule):
+                    return cls(*args, bias=True)  # Software (host) layers
+                return cls(*args, bias=True, **kwargs, **extra)
+            cases.append((name, _create, [shape]))
+    return cases
+
+
+def model_cases(names, dataset_overrides):
+    """
+    Return (name, constructor, input shapes, device) for all models whose names match one of
+    the patterns in `names`. The input shape is the shape of the dataset the model is trained
+    on in the training scripts, or given in `dataset_overrides`; otherwise, the default
+    dimensions of the model class are used.
+    """
+    supported_sources = {item['name']: item for item in registry.load_datasets()}
+    configurations = training_configurations()
+    cases = []
+    for module in registry.load_models():
+        name = module['name']
+        if not any(fnmatch.fnmatch(name, pattern) for pattern in names):
+            continue
+        Model = locate(module['module'] + '.' + name)
+        config = configurations.get(name, {})
+        dataset = dataset_overrides.get(name, config.get('dataset'))
+
+        model_args = {'pretrained': False, 'bias': config.get('bias', True)}
+        if dataset is not None:
+            source = supported_sources[dataset]
+            dimensions = tuple(source['input'])
+            model_args['num_classes'] = len(source['output'])
+            if config.get('obj_detection'):
+                model_args['num_classes'] += 1  # Background class
+                model_args['device'] = 'cpu'
+        else:
+            # Use the defaults of the model class
+            parameters = inspect.signature(Model).parameters
+            dims = parameters['dimensions'].default if 'dimensions' in parameters else (32, 32)
+            channels = parameters['num_channels'].default \
+                if 'num_channels' in parameters else 3
+            dimensions = (channels, ) + tuple(dims[:module['dim']])
+        shape = dimensions
+        if len(dimensions) == 2:
+            dimensions += (1, )
+        model_args['num_channels'] = dimensions[0]
+        model_args['dimensions'] = (dimensions[1], dimensions[2])
+        if module['dim'] > 1 and module['min_input'] > dimensions[2]:
+            model_args['padding'] = (module['min_input'] - dimensions[2] + 1) // 2
+
+        def _create(Model=Model, model_args=model_args, **extra):
+            return Model(**model_args, **extra)
+        cases.append((name, _create, [shape], config.get('device')))
+    return cases
+
+
+def _sum(output):
+    """Reduce a (nested tuple or list of) output tensor(s) to a scalar for the backward pass"""
+    if torch.is_tensor(output):
+        return output.float().sum()
+    return sum(_sum(o) for o in output)
+
+
+def run_case(create, shapes, device, mode, batch_size, repeat, warmup):
+    """
+    Benchmark the module returned by `create()` on random inputs of the given `shapes`.
+    Returns the timings of the forward pass, and, except in simulation mode, of the backward
+    pass. In QAT mode, the output shifts are recalculated in every timed run, as in training
+    where each optimizer step changes the weights; the forward pass with the cached output
+    shifts is timed separately ('forward_cached').
+    """
+    simulate = mode in ('simulate', 'integer')
+    ai8x.set_device(device, simulate, False, verbose=False)
+    if simulate:
+        m = create(weight_bits=8, bias_bits=8, quantize_activation=True)
+        m.eval()
+        # Simulation mode operates on 8-bit integer data
+        inputs = [torch.randint(-128, 128, (batch_size, ) + shape).float() for shape in shapes]
+        with torch.no_grad():
+            if mode == 'integer':
+                expected = m(*inputs)
+                m = ai8x.integer_inference_prep(m)
+                output = m(*inputs)
+                result = {'matches_simulate': bool(torch.equal(output, expected))
+                          if torch.is_tensor(output) else None}
+            else:
+                result = {}
+            result['forward'] = benchmark.measure(lambda: m(*inputs), repeat, warmup)
+        return result
+
+    m = create()
+    if mode == 'qat':
+        ai8x.fuse_bn_layers(m)
+        ai8x.initiate_qat(m, QAT_POLICY)
+    m.train()
+    inputs = [torch.rand((batch_size, ) + shape) - .5 for shape in shapes]
+    parameters = [p for p in m.parameters() if p.requires_grad]
+    if not parameters:
+        # Layers without weights (pooling, element-wise): time the gradient of the inputs
+        for x in inputs:
+            x.requires_grad_()
+
+    setup = None
+    if mode == 'qat':
+        qat_modules = [module for module in m.modules()
+                       if isinstance(module, ai8x.QuantizationAwareModule)]
+
+        def _reset_shift_caches():
+            for module in qat_modules:
+                module.reset_shift_cache()
+        setup = _reset_shift_caches
+
+    result = {'forward': benchmark.measure(lambda: m(*inputs), repeat, warmup, setup)}
+    if setup is not None:
+        result['forward_cached'] = benchmark.measure(lambda: m(*inputs), repeat, warmup)
+
+    def _backward():
+        for x in inputs + parameters:
+            x.grad = None
+        _sum(m(*inputs)).backward()
+    # The backward time is the time of the forward and backward pass, less the forward time
+    try:
+        total = benchmark.measure(_backward, repeat, warmup, setup)
+    except RuntimeError as exc:  # Not differentiable (e.g., bitwise operations)
+        result['backward'] = {'error': f'{type(exc).__name__}: {exc}'}
+        return result
+    result['backward'] = {key: max(0., total[key] - result['forward'][key]) if key != 'runs'
+                          else total[key] for key in total if key != 'std'}
+    result['forward_backward'] = total
+    return result
+
+
+def main():
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--layers', action='store_true', default=False,
+                        help='benchmark the ai8x layers (default: layers and models)')
+    parser.add_argument('--models', nargs='*', metavar='PATTERN', default=None,
+                        help='benchmark the models matching the patterns (default: all)')
+    parser.add_argument('--dataset', action='append', default=[], metavar='MODEL=DATASET',
+                        help='use the input shape of DATASET for MODEL')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES,
+                        help='modes to benchmark (default: all)')
+    parser.add_argument('--device', type=devices.device, default=87,
+                        help='device for the layers, and for models that the training '
+                             'scripts do not train for a specific device (default: MAX78002)')
+    parser.add_argument('--batch-size', '-b', type=int, default=16,
+                        help='batch size (default: 16)')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='number of timed runs (default: 10)')
+    parser.add_argument('--warmup', type=int, default=2,
+                        help='number of runs before timing (default: 2)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='number of CPU threads (default: PyTorch default)')
+    parser.add_argument('--out', default='benchmark.json',
+                        help='JSON file for the results (default: benchmark.json)')
+    parser.add_argument('--compare', metavar='BASELINE', default=None,
+                        help='compare the results with a previously saved JSON file, and '
+                             'exit with an error when a benchmark is slower by more than '
+                             '--threshold')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression (default: 0.1)')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    cases = []
+    if args.layers or args.models is None:
+        cases += [(f'layer/{name}', create, shapes, args.device)
+                  for name, create, shapes in layer_cases()]
+    if not args.layers or args.models is not None:
+        dataset_overrides = dict(item.split('=', 1) for item in args.dataset)
+        cases += [(f'model/{name}', create, shapes, device or args.device)
+                  for name, create, shapes, device
+                  in model_cases(args.models or ['*'], dataset_overrides)]
+
+    results = {}
+    for name, create, shapes, device in cases:
+        for mode in args.modes:
+            key = f'{name}/{mode}'
+            try:
+                results[key] = run_case(create, shapes, device, mode, args.batch_size,
+                                        args.repeat, args.warmup)
+            except (AssertionError, RuntimeError, ValueError, TypeError) as exc:
+                results[key] = {'error': f'{type(exc).__name__}: {exc}'}
+                print(f'{key:<60} {results[key]["error"]}')
+                continue
+            line = f'{key:<60} forward {results[key]["forward"]["mean"]:9.3f} ms'
+            if 'forward_cached' in results[key]:
+                line += f' (cached shifts {results[key]["forward_cached"]["mean"]:9.3f} ms)'
+            simulate = results.get(f'{name}/simulate', {}).get('forward')
+            if mode == 'integer' and simulate:
+                speedup = simulate['mean'] / results[key]['forward']['mean']
+                line += f'  speedup over simulate {speedup:5.2f}x'
+                if results[key]['matches_simulate'] is False:
+                    line += '  OUTPUT DIFFERS'
+            if 'mean' in results[key].get('backward', {}):
+                line += f'  backward {results[key]["backward"]["mean"]:9.3f} ms'
+            print(line)
+
+    benchmark.save(args.out, results, batch_size=args.batch_size, repeat=args.repeat,
+                   warmup=args.warmup, device=args.device)
+    print(f'\nSaved results to {args.out}')
+
+    if args.compare:
+        regressions = benchmark.compare(results, args.compare,
+                                        ['forward', 'forward_cached', 'backward'],
+                                        args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} benchmark(s) slower than the baseline by more than '
+                  f'{100. * args.threshold:.0f}%')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
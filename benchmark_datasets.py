@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Benchmark of the generation (build) step and of the data loading throughput of the datasets
+with expensive preprocessing. Small synthetic raw data sets ("fixtures") with the file layout of
+the original downloads are created in a temporary folder, so the real datasets are not needed.
+The results are saved as JSON and can be compared with the results of another commit
+(--compare).
+"""
+import argparse
+import contextlib
+import csv
+import fnmatch
+import json
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import urllib
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+import h5py
+import soundfile as sf
+from PIL import Image
+
+from datasets.aisegment import AISegment
+from datasets.camvid import CamVidDataset
+from datasets.kws20 import KWS
+from datasets.msnoise import MSnoise
+from datasets.speechcom import SpeechCom
+from utils import benchmark, registry
+
+FS = 16000
+MSNOISE_API = 'https://api.github.com/repos/microsoft/MS-SNSD/contents/{}?ref=master'
+MSNOISE_RAW = 'https://raw.githubusercontent.com/microsoft/MS-SNSD/master/{}'
+DEFAULT_DATASETS = ['KWS', 'SpeechCom_20', 'MixedKWS20_10dB', 'AISegment_80', 'AISegment_352',
+                    'SVHN_74', 'CamVid_s80_c33', 'CamVid_s352_c33']
+
+
+@contextlib.contextmanager
+def offline(files):
+    """
+    While in the context, serve the downloads of the URLs in `files` (a dict of URL to local
+    path) from the local files, and fail all other downloads.
+    """
+    def _urlretrieve(url, filename=None, *_args, **_kwargs):
+        if url not in files:
+            raise urllib.error.URLError(f'{url} is not available in the benchmark')
+        if filename is None:
+            return files[url], None
+        shutil.copyfile(files[url], filename)
+        return filename, None
+
+    urlretrieve = urllib.request.urlretrieve
+    urllib.request.urlretrieve = _urlretrieve
+    try:
+        yield
+    finally:
+        urllib.request.urlretrieve = urlretrieve
+
+
+def _makedirs(*paths):
+    path = os.path.join(*paths)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _utterance(rng, seconds=1., bursts=1):
+    """
+    Return `seconds` of 16 kHz audio with `bursts` harmonic tone bursts ("syllables") in faint
+    noise, so that the keyword and silence detection of the datasets find one word per burst.
+    """
+    t = np.arange(int(seconds * FS)) / FS
+    audio = 1e-3 * rng.standard_normal(t.size)
+    slot = seconds / bursts
+    for k in range(bursts):
+        length = rng.uniform(.2, .3)
+        center = k * slot + rng.uniform(.1, slot - .1 - length) + length / 2
+        f0 = rng.uniform(100., 300.)
+        envelope = np.clip(1. - np.abs(t - center) / (length / 2), 0., None)
+        audio += .3 * envelope * sum(np.sin(2 * np.pi * h * f0 * t) / h for h in range(1, 6))
+    return np.clip(audio, -1., 1.).astype(np.float32)
+
+
+def _tar(archive, folder):
+    """Create the .tar.gz `archive` with the contents of `folder`"""
+    with tarfile.open(archive, 'w:gz') as tar:
+        for name in sorted(os.listdir(folder)):
+            tar.add(os.path.join(folder, name), arcname=name)
+
+
+def _speech_commands(archive, keywords, count, rng):
+    """Speech Commands v0.02 archive with `count` one second records per keyword"""
+    with tempfile.TemporaryDirectory(dir=_makedirs(os.path.dirname(archive))) as staging:
+        for keyword in keywords:
+            folder = _makedirs(staging, keyword)
+            for _ in range(count):
+                # The datasets split the records by the hash of their (speaker) names
+                name = f'{int(rng.integers(2 ** 32)):08x}_nohash_0.wav'
+                sf.write(os.path.join(folder, name), _utterance(rng), FS, subtype='PCM_16')
+        sf.write(os.path.join(_makedirs(staging, '_background_noise_'), 'white_noise.wav'),
+                 (.1 * rng.standard_normal(10 * FS)).astype(np.float32), FS, subtype='PCM_16')
+        _tar(archive, staging)
+
+
+def _librispeech(archive, count, rng):
+    """LibriSpeech dev-clean archive with `count` four second .flac files of three words"""
+    with tempfile.TemporaryDirectory(dir=_makedirs(os.path.dirname(archive))) as staging:
+        folder = _makedirs(staging, 'LibriSpeech', 'dev-clean', '84', '121123')
+        for i in range(count):
+            sf.write(os.path.join(folder, f'84-121123-{i:04d}.flac'),
+                     _utterance(rng, seconds=4., bursts=3), FS)
+        _tar(archive, staging)
+
+
+def kws_fixture(root, count, rng):
+    """Speech Commands and LibriSpeech archives in the download folders of KWS"""
+    keywords = [k for k in KWS.class_dict if k != 'librispeech']
+    _speech_commands(os.path.join(root, 'KWS', 'raw', KWS.url_speechcommand.rpartition('/')[2]),
+                     keywords, count, rng)
+    _librispeech(os.path.join(root, 'KWS', 'librispeech', KWS.url_librispeech.rpartition('/')[2]),
+                 count, rng)
+    return {}
+
+
+def speechcom_fixture(root, count, rng):
+    """Speech Commands archive in the download folder of SpeechCom"""
+    _speech_commands(os.path.join(root, 'SpeechCom', 'raw', SpeechCom.url.rpartition('/')[2]),
+                     list(SpeechCom.class_dict), count, rng)
+    return {}
+
+
+def msnoise_fixture(root, count, rng):
+    """
+    MS-SNSD noise records of two seconds, and the GitHub API listings that MSnoise downloads
+    them with. Returns the URLs to serve with offline().
+    """
+    urls = {}
+    for folder in ('noise_train', 'noise_test'):
+        listing = []
+        for noise in MSnoise.class_dict:
+            for i in range(count):
+                path = f'{folder}/{noise}_{i + 1}.wav'
+                file = os.path.join(_makedirs(root, 'MS-SNSD', folder), f'{noise}_{i + 1}.wav')
+                level = rng.uniform(.05, .3) * (1. + np.sin(np.linspace(0., 20., 2 * FS)))
+                sf.write(file, (level * rng.standard_normal(2 * FS)).astype(np.float32), FS,
+                         subtype='PCM_16')
+                listing.append({'name': f'{noise}_{i + 1}.wav', 'path': path,
+                                'download_url': MSNOISE_RAW.format(path)})
+                urls[MSNOISE_RAW.format(path)] = file
+        urls[MSNOISE_API.format(folder)] = os.path.join(root, 'MS-SNSD', folder + '.json')
+        with open(urls[MSNOISE_API.format(folder)], mode='w', encoding='utf-8') as f:
+            json.dump(listing, f)
+    return urls
+
+
+def mixedkws_fixture(root, count, rng):
+    """Raw data of KWS and MSnoise, which MixedKWS mixes"""
+    kws_fixture(root, count, rng)
+    return msnoise_fixture(root, count, rng)
+
+
+def aisegment_fixture(root, count, rng):
+    """AISegment images (.jpg) with an elliptic portrait in the matting files (.png)"""
+    height, width = AISegment.org_img_dim
+    y, x = np.mgrid[:height, :width]
+    img_folder = _makedirs(root, 'AISegment', 'clip_img', '1803010000', 'clip_00000000')
+    matting_folder = _makedirs(root, 'AISegment', 'matting', '1803010000', 'matting_00000000')
+    for i in range(count):
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        portrait = ((y - rng.uniform(.3, .7) * height) / (rng.uniform(.2, .4) * height)) ** 2 \
+            + ((x - rng.uniform(.3, .7) * width) / (rng.uniform(.2, .4) * width)) ** 2 < 1.
+        Image.fromarray(image).save(os.path.join(img_folder, f'1803010000-{i:08d}.jpg'))
+        matting = np.dstack((image, 255 * portrait.astype(np.uint8)))
+        Image.fromarray(matting, mode='RGBA').save(os.path.join(matting_folder,
+                                                                f'1803010000-{i:08d}.png'))
+    return {}
+
+
+def _digit_struct(path, annotations):
+    """
+    Write the `annotations` (a list of image name and list of box dicts) in the MATLAB v7.3
+    (HDF5) format of the SVHN digitStruct.mat files.
+    """
+    with h5py.File(path, 'w') as f:
+        refs = f.create_group('#refs#')
+        names = f.create_dataset('digitStruct/name', (len(annotations), 1), dtype=h5py.ref_dtype)
+        bboxes = f.create_dataset('digitStruct/bbox', (len(annotations), 1), dtype=h5py.ref_dtype)
+        for i, (name, boxes) in enumerate(annotations):
+            names[i, 0] = refs.create_dataset(f'name{i}', data=np.array(
+                [[ord(c)] for c in name], dtype=np.uint16)).ref
+            bbox = refs.create_group(f'bbox{i}')
+            for key in ('height', 'label', 'left', 'top', 'width'):
+                if len(boxes) == 1:
+                    bbox.create_dataset(key, data=np.array([[boxes[0][key]]], dtype=np.float64))
+                    continue
+                values = bbox.create_dataset(key, (len(boxes), 1), dtype=h5py.ref_dtype)
+                for j, box in enumerate(boxes):
+                    values[j, 0] = refs.create_dataset(f'bbox{i}_{key}{j}', data=np.array(
+                        [[box[key]]], dtype=np.float64)).ref
+            bboxes[i, 0] = bbox.ref
+
+
+def svhn_fixture(root, count, rng):
+    """SVHN images with one to three digit boxes, and their digitStruct.mat annotations"""
+    for d_type in ('train', 'test'):
+        folder = _makedirs(root, 'SVHN', d_type)
+        annotations = []
+        for i in range(count):
+            digits = int(rng.integers(1, 4))
+            size = 32 * digits + 40
+            image = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+            boxes = [{'label': int(rng.integers(1, 11)), 'left': 20 + 32 * k, 'top': 20,
+                      'width': 24, 'height': 30} for k in range(digits)]
+            Image.fromarray(image).save(os.path.join(folder, f'{i + 1}.png'))
+            annotations.append((f'{i + 1}.png', boxes))
+        _digit_struct(os.path.join(folder, 'digitStruct.mat'), annotations)
+    return {}
+
+
+def camvid_fixture(root, count, rng):
+    """CamVid images and label images of class color blocks, and class_dict.csv"""
+    colors = {name: (37 * i % 256, 91 * i % 256, 173 * i % 256)
+              for i, name in enumerate(CamVidDataset.class_dict) if name != 'None'}
+    with open(os.path.join(_makedirs(root, 'CamVid'), 'class_dict.csv'), mode='w', newline='',
+              encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'r', 'g', 'b'])
+        for name, color in colors.items():
+            writer.writerow([name, *color])
+    palette = np.array(list(colors.values()), dtype=np.uint8)
+    for d_type in ('train', 'test'):
+        img_folder = _makedirs(root, 'CamVid', d_type)
+        lbl_folder = _makedirs(root, 'CamVid', d_type + '_labels')
+        for i in range(count):
+            image = rng.integers(0, 256, (720, 960, 3), dtype=np.uint8)
+            blocks = rng.integers(0, len(palette), (6, 8))
+            label = palette[blocks.repeat(120, axis=0).repeat(120, axis=1)]
+            Image.fromarray(image).save(os.path.join(img_folder, f'0001TP_{i:06d}.png'))
+            Image.fromarray(label).save(os.path.join(lbl_folder, f'0001TP_{i:06d}_L.png'))
+    return {}
+
+
+# Fixture for the datasets whose names match the pattern
+FIXTURES = [
+    ('KWS*', kws_fixture),
+    ('SpeechCom*', speechcom_fixture),
+    ('MSnoise*', msnoise_fixture),
+    ('MixedKWS*', mixedkws_fixture),
+    ('AISegment*', aisegment_fixture),
+    ('SVHN*', svhn_fixture),
+    ('CamVid*', camvid_fixture),
+]
+
+
+def _epoch(loader):
+    for _ in loader:
+        pass
+
+
+def run_dataset(source, fixture, root, args):
+    """
+    Create the fixtures in `root`, build the dataset `source`, and load it again from the
+    generated files. Returns the results of the build and of the data loading throughput.
+    """
+    loader_args = argparse.Namespace(act_mode_8bit=False, truncate_testset=False)
+    rng = np.random.default_rng(args.seed)
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    start = time.perf_counter()
+    urls = fixture(root, args.samples, rng)
+    results = {'build': {'fixtures': time.perf_counter() - start}}
+    with offline(urls):
+        start = time.perf_counter()
+        source['loader']((root, loader_args))
+        results['build']['build'] = time.perf_counter() - start
+        # The second time, the datasets are loaded from the generated files
+        start = time.perf_counter()
+        splits = source['loader']((root, loader_args))
+        results['build']['load'] = time.perf_counter() - start
+
+    for split, dataset in zip(('train', 'test'), splits):
+        if dataset is None or len(dataset) == 0:
+            continue
+        results['build'][f'{split}_samples'] = len(dataset)
+        for workers in args.workers:
+            loader = DataLoader(dataset, batch_size=args.batch_size, num_workers=workers,
+                                collate_fn=source.get('collate'))
+            try:
+                epoch = benchmark.measure(lambda loader=loader: _epoch(loader), args.repeat,
+                                          args.warmup)
+            except (AttributeError, RuntimeError, TypeError, ValueError) as exc:
+                results[f'{split}/workers{workers}'] = {'error': f'{type(exc).__name__}: {exc}'}
+                continue
+            results[f'{split}/workers{workers}'] = {
+                'epoch': epoch,
+                'samples': len(dataset),
+                'samples_per_second': 1000. * len(dataset) / epoch['mean'],
+            }
+    return results
+
+
+def main():
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--datasets', nargs='+', metavar='PATTERN', default=DEFAULT_DATASETS,
+                        help='benchmark the datasets matching the patterns (default: '
+                             + ' '.join(DEFAULT_DATASETS) + ')')
+    parser.add_argument('--samples', type=int, default=8,
+                        help='number of raw records per keyword or noise type, or of raw images '
+                             'per split, in the fixtures (default: 8)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 4], metavar='N',
+                        help='numbers of data loader workers (default: 0 4)')
+    parser.add_argument('--batch-size', '-b', type=int, default=32,
+                        help='batch size of the data loader (default: 32)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed epochs (default: 3)')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='number of epochs before timing (default: 1)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the fixtures and of the augmentation (default: 0)')
+    parser.add_argument('--root', default=None,
+                        help='folder for the fixtures and generated datasets (default: a '
+                             'temporary folder)')
+    parser.add_argument('--keep', action='store_true', default=False,
+                        help='do not delete the fixtures and generated datasets')
+    parser.add_argument('--out', default='benchmark_datasets.json',
+                        help='JSON file for the results (default: benchmark_datasets.json)')
+    parser.add_argument('--compare', metavar='BASELINE', default=None,
+                        help='compare the results with a previously saved JSON file, and '
+                             'exit with an error when a build is slower or the throughput is '
+                             'lower by more than --threshold')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change reported as a regression (default: 0.1)')
+    args = parser.parse_args()
+
+    supported_sources = {item['name']: item for item in registry.load_datasets()}
+    names = [name for name in supported_sources
+             if any(fnmatch.fnmatch(name, pattern) for pattern in args.datasets)]
+    if not names:
+        raise ValueError(f'ERROR: No dataset matches {" ".join(args.datasets)}')
+
+    results = {}
+    for name in names:
+        fixture = next((f for pattern, f in FIXTURES if fnmatch.fnmatch(name, pattern)), None)
+        if fixture is None:
+            print(f'{name:<50} no fixture, skipped')
+            continue
+        root = tempfile.mkdtemp(prefix=name + '-', dir=args.root)
+        try:
+            entries = run_dataset(supported_sources[name], fixture, root, args)
+        except (AttributeError, KeyError, OSError, RuntimeError, TypeError, ValueError,
+                SystemExit) as exc:  # The datasets call sys.exit() when raw data is missing
+            results[f'{name}/build'] = {'error': f'{type(exc).__name__}: {exc}'}
+            print(f'{name + "/build":<50} {results[f"{name}/build"]["error"]}')
+            continue
+        finally:
+            if not args.keep:
+                shutil.rmtree(root, ignore_errors=True)
+
+        for key, entry in entries.items():
+            results[f'{name}/{key}'] = entry
+            if 'error' in entry:
+                print(f'{name + "/" + key:<50} {entry["error"]}')
+            elif key == 'build':
+                print(f'{name + "/build":<50} build {entry["build"]:9.3f} s  '
+                      f'load {entry["load"]:9.3f} s')
+            else:
+                print(f'{name + "/" + key:<50} {entry["samples_per_second"]:11.1f} samples/s')
+
+    benchmark.save(args.out, results, samples=args.samples, workers=args.workers,
+                   batch_size=args.batch_size, repeat=args.repeat, warmup=args.warmup,
+                   seed=args.seed)
+    print(f'\nSaved results to {args.out}')
+
+    if args.compare:
+        regressions = benchmark.compare(results, args.compare, ['build', 'load'],
+                                        args.threshold)
+        regressions += benchmark.compare(results, args.compare, ['samples_per_second'],
+                                         args.threshold, higher_is_better=True)
+        if regressions:
+            print(f'\n{len(regressions)} benchmark(s) worse than the baseline by more than '
+                  f'{100. * args.threshold:.0f}%')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
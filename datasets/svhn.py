@@ -415,15 +415,11 @@ class SVHN(Dataset):
         if fold_ratio == 1:
             img_folded = img
         else:
-            img_folded = None
-            for i in range(fold_ratio):
-                for j in range(fold_ratio):
-                    if img_folded is not None:
-                        img_folded = \
-                            np.concatenate((img_folded, img[i::fold_ratio,
-                                                            j::fold_ratio, :]), axis=2)
-                    else:
-                        img_folded = img[i::fold_ratio, j::fold_ratio, :]
+            # Channel (i*fold_ratio + j)*c + k holds img[i::fold_ratio, j::fold_ratio, k]
+            h, w, c = img.shape
+            img_folded = img.reshape(h // fold_ratio, fold_ratio, w // fold_ratio, fold_ratio, c) \
+                .transpose(0, 2, 1, 3, 4) \
+                .reshape(h // fold_ratio, w // fold_ratio, fold_ratio * fold_ratio * c)
         return img_folded
 
 
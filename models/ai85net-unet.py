@@ -54,13 +54,26 @@ class AI85UNetSmall(nn.Module):
         self.conv = ai8x.FusedConv2dBN(16, num_classes, 1, stride=1, padding=0,
                                        bias=bias, batchnorm='NoAffine', **kwargs)
 
+        # Recompute the activations of the encoder and decoder stages in the backward pass,
+        # see ai8x.set_activation_checkpointing()
+        self.checkpoint_activations = False
+
     def forward(self, x):  # pylint: disable=arguments-differ
         """Forward prop"""
         # Run CNN
+        ckpt = self.checkpoint_activations
+        enc1, enc2, enc3 = ai8x.checkpoint(self, x, function=self._encode, enabled=ckpt)
+        return ai8x.checkpoint(self, enc1, enc2, enc3, function=self._decode, enabled=ckpt)
+
+    def _encode(self, x):
+        """Encoder stage"""
         enc1 = self.enc1(x)
         enc2 = self.enc2(enc1)
         enc3 = self.enc3(enc2)
+        return enc1, enc2, enc3
 
+    def _decode(self, enc1, enc2, enc3):
+        """Bottleneck and decoder stage"""
         bottleneck = self.bneck(enc3)
 
         dec3 = self.upconv3(bottleneck)
@@ -117,13 +130,26 @@ class AI85UNetMedium(nn.Module):
         self.conv = ai8x.FusedConv2dBN(32, num_classes, 1, stride=1, padding=0,
                                        bias=bias, batchnorm='NoAffine', **kwargs)
 
+        # Recompute the activations of the encoder and decoder stages in the backward pass,
+        # see ai8x.set_activation_checkpointing()
+        self.checkpoint_activations = False
+
     def forward(self, x):  # pylint: disable=arguments-differ
         """Forward prop"""
         # Run CNN
+        ckpt = self.checkpoint_activations
+        enc1, enc2, enc3 = ai8x.checkpoint(self, x, function=self._encode, enabled=ckpt)
+        return ai8x.checkpoint(self, enc1, enc2, enc3, function=self._decode, enabled=ckpt)
+
+    def _encode(self, x):
+        """Encoder stage"""
         enc1 = self.enc1(x)
         enc2 = self.enc2(enc1)
         enc3 = self.enc3(enc2)
+        return enc1, enc2, enc3
 
+    def _decode(self, enc1, enc2, enc3):
+        """Bottleneck and decoder stage"""
         bottleneck = self.bneck(enc3)
 
         dec3 = self.upconv3(bottleneck)
@@ -199,9 +225,19 @@ class AI85UNetLarge(nn.Module):
         self.conv = ai8x.FusedConv2dBN(64, self.num_final_channels, 1, stride=1, padding=0,
                                        bias=bias, batchnorm='NoAffine', **kwargs)
 
+        # Recompute the activations of the encoder and decoder stages in the backward pass,
+        # see ai8x.set_activation_checkpointing()
+        self.checkpoint_activations = False
+
     def forward(self, x):  # pylint: disable=arguments-differ
         """Forward prop"""
         # Run CNN
+        ckpt = self.checkpoint_activations
+        enc1, enc2, enc3 = ai8x.checkpoint(self, x, function=self._encode, enabled=ckpt)
+        return ai8x.checkpoint(self, enc1, enc2, enc3, function=self._decode, enabled=ckpt)
+
+    def _encode(self, x):
+        """Preprocessing and encoder stage"""
         x = self.prep0(x)
         x = self.prep1(x)
         x = self.prep2(x)
@@ -209,7 +245,10 @@ class AI85UNetLarge(nn.Module):
         enc1 = self.enc1(x)                    # 8x(dim1)x(dim2)
         enc2 = self.enc2(enc1)                 # 28x(dim1/2)x(dim2/2)
         enc3 = self.enc3(enc2)                 # 56x(dim1/4)x(dim2/4)
+        return enc1, enc2, enc3
 
+    def _decode(self, enc1, enc2, enc3):
+        """Bottleneck, decoder and postprocessing stage"""
         bottleneck = self.bneck(enc3)          # 112x(dim1/8)x(dim2/8)
 
         dec3 = self.upconv3(bottleneck)        # 56x(dim1/4)x(dim2/4)
@@ -10,11 +10,13 @@
 Evolutionary search for NAS
 """
 
+import copy
 import time
 
 import numpy as np
 
 from nas import nas_utils
+from utils import data_memory, kernel_memory
 
 
 class EvolutionSearch:
@@ -22,19 +24,24 @@ class EvolutionSearch:
     Evolutionary search for NAS
     """
     def __init__(self, population_size=100, prob_mutation=0.1, ratio_mutation=0.5,
-                 ratio_parent=0.25, num_iter=500):
+                 ratio_parent=0.25, num_iter=500, target_latency_us=None,
+                 latency_exponent=-0.07):
         self.population_size = population_size
         self.prob_mutation = prob_mutation
         self.ratio_mutation = ratio_mutation
         self.ratio_parent = ratio_parent
         self.num_iter = num_iter
+        self.target_latency = target_latency_us * 1e-6 if target_latency_us else None
+        self.latency_exponent = latency_exponent
         self.model = None
         self.arch = None
+        self._latency = None
 
     def set_model(self, model):
         """Sets the trained base model"""
         self.model = model
         self.arch = model.get_base_arch()
+        self._latency = None
 
     def set_model_arch(self, arch):
         """Sets the base model architecture"""
@@ -69,6 +76,22 @@ class EvolutionSearch:
 
         return new_sample
 
+    def calc_latency(self, sample):
+        """
+        Estimates the latency of the sub network in seconds. The estimate of the last sample is
+        kept, so the constraint check and the efficiency of a candidate share one estimate.
+        """
+        if self._latency is None or self._latency[0] != sample:
+            self._latency = (copy.deepcopy(sample), nas_utils.calc_latency(sample, self.model))
+        return self._latency[1]
+
+    def calc_efficiency(self, sample):
+        """Calculates the efficiency of the sub network"""
+        if self.model is None or self.target_latency is None:
+            return 1.0
+        return nas_utils.calc_efficiency(sample, self.model, self.target_latency,
+                                         self.latency_exponent, self.calc_latency(sample))
+
     def check_constraint(self, sample, constraint):
         """Checks if the sub network meets the constraints"""
         if 'max_num_weights' in constraint:
@@ -79,6 +102,29 @@ class EvolutionSearch:
             if self.model.__class__.get_num_weights(sample) < constraint['min_num_weights']:
                 return False
 
+        if 'max_latency_us' in constraint:
+            if self.calc_latency(sample) * 1e6 > constraint['max_latency_us']:
+                return False
+
+        if constraint.get('fit_kernel_memory', False):
+            self.model.set_subnet_arch(sample)
+            try:
+                fits = kernel_memory.fits(self.model)
+            finally:
+                self.model.reset_arch()
+            if not fits:
+                return False
+
+        if constraint.get('fit_data_memory', False):
+            self.model.set_subnet_arch(sample)
+            dimensions = (self.model.num_channels, ) + tuple(self.model.dimensions)
+            try:
+                fits = data_memory.fits(self.model, dimensions)
+            finally:
+                self.model.reset_arch()
+            if not fits:
+                return False
+
         if 'width_options' in constraint:
             unique_widths = self.model.__class__.get_unique_widths(sample)
             for width in unique_widths:
@@ -93,8 +139,6 @@ class EvolutionSearch:
         num_parents = int(round(self.population_size * self.ratio_parent))
 
         population = []
-        best_acc = -9999
-        best_arch = None
 
         print(f'Population Init with {self.population_size} Architecture Samples.')
         t1 = time.time()
@@ -104,12 +148,12 @@ class EvolutionSearch:
                 if not nas_utils.check_net_in_population(child_net, population):
                     child_net_acc = nas_utils.calc_accuracy(child_net, self.model, train_loader,
                                                             test_loader, device)
-                    child_net_eff = nas_utils.calc_efficiency(child_net)
+                    child_net_eff = self.calc_efficiency(child_net)
                     break
 
             population.append((child_net, child_net_acc, child_net_eff))
         t2 = time.time()
-        parents = sorted(population, key=lambda x: x[1], reverse=True)[:num_parents]
+        parents = sorted(population, key=lambda x: x[1] * x[2], reverse=True)[:num_parents]
         best_acc = parents[0][1]
         best_arch = parents[0][0]
         print(f'\tBest Accuracy: {(100*best_acc):.2f}%')
@@ -131,7 +175,7 @@ class EvolutionSearch:
                     if not nas_utils.check_net_in_population(child_net, population):
                         child_net_acc = nas_utils.calc_accuracy(child_net, self.model,
                                                                 train_loader, test_loader, device)
-                        child_net_eff = nas_utils.calc_efficiency(child_net)
+                        child_net_eff = self.calc_efficiency(child_net)
                         break
 
                 population.append((child_net, child_net_acc, child_net_eff))
@@ -147,18 +191,17 @@ class EvolutionSearch:
                     if not nas_utils.check_net_in_population(child_net, population):
                         child_net_acc = nas_utils.calc_accuracy(child_net, self.model,
                                                                 train_loader, test_loader, device)
-                        child_net_eff = nas_utils.calc_efficiency(child_net)
+                        child_net_eff = self.calc_efficiency(child_net)
                         break
 
                 population.append((child_net, child_net_acc, child_net_eff))
             t2 = time.time()
             print(f'\tCrossover done in {(t2-t1):.2f}secs.')
 
-            parents = sorted(population, key=lambda x: x[1], reverse=True)[:num_parents]
-            acc = parents[0][1]
-            if acc > best_acc:
-                best_arch = parents[0][0]
-                best_acc = acc
+            parents = sorted(population, key=lambda x: x[1] * x[2], reverse=True)[:num_parents]
+            # The parents are part of the population, so the top score never decreases
+            best_arch = parents[0][0]
+            best_acc = parents[0][1]
             t2_iter = time.time()
             print(f'\tBest Accuracy: {(100*best_acc):.2f}%')
             print(f'\tBest Model: {best_arch}')
@@ -12,6 +12,8 @@ Utility functions for NAS
 
 import torch
 
+from utils import latency
+
 
 def calc_accuracy(child_net_arch, model, train_loader, test_loader, device):
     """Calculates accuracy for the given subnet of the model"""
@@ -53,9 +55,36 @@ def calc_accuracy(child_net_arch, model, train_loader, test_loader, device):
     return val_accuracy
 
 
-def calc_efficiency(child_net_arch):  # pylint: disable=unused-argument
-    """Calculates efficiency for the given subnet of the model"""
-    return 1.0
+def calc_latency(child_net_arch, model):
+    """Estimates the inference latency in seconds for the given subnet of the model"""
+    dimensions = (model.num_channels, ) + tuple(model.dimensions)
+    with torch.no_grad():
+        # Only the layer shapes matter, so the channels are not sorted
+        if child_net_arch is not None:
+            model.set_subnet_arch(child_net_arch, sort_channels=False)
+        try:
+            latency_s, _ = latency.estimate(model, dimensions)
+        finally:
+            if child_net_arch is not None:
+                model.reset_arch(sort_channels=False)
+
+    return latency_s
+
+
+def calc_efficiency(child_net_arch, model=None, target_latency=None, latency_exponent=-0.07,
+                    latency_s=None):
+    """
+    Calculates efficiency for the given subnet of the model. Without a `target_latency` (in
+    seconds), all subnets are equally efficient. Otherwise, the efficiency is
+    (latency / target_latency) ** latency_exponent, which is multiplied with the accuracy
+    to rank the subnets. A `latency_s` that was already estimated for the subnet is reused.
+    """
+    if model is None or target_latency is None:
+        return 1.0
+
+    if latency_s is None:
+        latency_s = calc_latency(child_net_arch, model)
+    return (latency_s / target_latency) ** latency_exponent
 
 
 def check_net_in_population(child_net, population):
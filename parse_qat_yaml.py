@@ -30,5 +30,9 @@ def parse(yaml_file):
         assert False, '`start_epoch` must be defined in QAT policy'
     if policy and 'weight_bits' not in policy:
         assert False, '`weight_bits` must be defined in QAT policy'
+    if policy and 'shift_update_interval' in policy:
+        assert isinstance(policy['shift_update_interval'], int) \
+            and policy['shift_update_interval'] >= 1, \
+            '`shift_update_interval` must be a positive integer'
 
     return policy
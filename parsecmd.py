@@ -37,7 +37,8 @@ from distiller.utils import float_range_argparse_checker as float_range
 from devices import device
 
 SUMMARY_CHOICES = ['sparsity', 'compute', 'model', 'modules', 'png', 'png_w_params', 'onnx',
-                   'onnx_simplified']
+                   'onnx_simplified', 'kernel_memory', 'data_memory',
+                   'latency', 'streaming']
 
 
 def get_parser(model_names, dataset_names):
@@ -50,6 +51,12 @@ def get_parser(model_names, dataset_names):
     parser.add_argument('--8-bit-mode', '-8', dest='act_mode_8bit', action='store_true',
                         default=False,
                         help='simluate device operation (8-bit data)')
+    parser.add_argument('--integer-inference', action='store_true', default=False,
+                        help='with --8-bit-mode and --evaluate, use the inference-only '
+                             'simulation layers')
+    parser.add_argument('--streaming-rows', type=int, default=0, metavar='N',
+                        help='with --evaluate, run fully convolutional models on stripes of N '
+                             'input rows to simulate streaming (default: 0, whole frames)')
     parser.add_argument('--arch', '-a', '--model', metavar='ARCH', required=True,
                         type=lambda s: s.lower(), dest='cnn',
                         choices=model_names,
@@ -76,12 +83,28 @@ def get_parser(model_names, dataset_names):
     parser.add_argument('--avg-pool-rounding', action='store_true', default=False,
                         help='when simulating, use "round()" in AvgPool operations '
                              '(default: use "floor()")')
+    parser.add_argument('--jit', action='store_true', default=False,
+                        help='compile the model with TorchScript for training and evaluation')
+    parser.add_argument('--amp', action='store_true', default=False,
+                        help='train with automatic mixed precision (CUDA only)')
+    parser.add_argument('--accumulate-steps', type=int, default=1, metavar='N',
+                        help='accumulate the gradients of N mini-batches of the given batch size '
+                             'before each optimizer step (default: 1)')
+    parser.add_argument('--activation-checkpointing', action='store_true', default=False,
+                        help='recompute the activations of supported blocks in the backward '
+                             'pass to reduce memory use during training')
 
     qat_args = parser.add_argument_group('Quantization Arguments')
     qat_args.add_argument('--qat-policy', dest='qat_policy',
                           default=os.path.join('policies', 'qat_policy.yaml'),
                           help='path to YAML file that defines the '
                                'QAT (quantization-aware training) policy')
+    qat_args.add_argument('--mixed-precision', metavar='PATH', default=None,
+                          help='select the per-layer weight bits that fit into kernel memory '
+                               'and save the QAT policy with the overrides to PATH')
+    qat_args.add_argument('--mixed-precision-batches', type=int, default=8, metavar='N',
+                          help='number of validation batches used to measure the layer '
+                               'sensitivity for --mixed-precision (default: 8)')
 
     ofa_args = parser.add_argument_group('NAS Training Arguments')
     ofa_args.add_argument('--nas', action='store_true', default=False,
@@ -108,6 +131,11 @@ def get_parser(model_names, dataset_names):
 
     parser.add_argument('--print-freq', '-p', default=10, type=int,
                         metavar='N', help='print frequency (default: 10)')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='record the time spent in each phase of every training epoch '
+                             '(synchronizes the GPU, which slows down training)')
+    parser.add_argument('--profile-trace', type=int, default=0, metavar='N',
+                        help='with --profile, save a torch.profiler trace of N training steps')
 
     load_checkpoint_group = parser.add_argument_group('Resuming Arguments')
     load_checkpoint_group_exc = load_checkpoint_group.add_mutually_exclusive_group()
@@ -179,6 +207,9 @@ def get_parser(model_names, dataset_names):
     parser.add_argument('--name', '-n', metavar='NAME', default=None, help='Experiment name')
     parser.add_argument('--out-dir', '-o', dest='output_dir', default='logs', help='Path to dump '
                         'logs and checkpoints')
+    parser.add_argument('--keep-checkpoints', type=int, default=0, metavar='K',
+                        help='also keep a copy of the last K checkpoints of each name '
+                             '(default: 0, keep only the latest and the best checkpoint)')
     parser.add_argument('--validation-split', '--valid-size', '--vs', dest='validation_split',
                         type=float_range(exc_max=True), default=0.1,
                         help='Portion of training dataset to set aside for validation')
@@ -60,6 +60,7 @@ def get_evo_search_params(nas_policy):
     """Get parameters used for evolutionary search from yaml file"""
     evo_search_params = {'population_size': 100, 'prob_mutation': 0.1, 'ratio_mutation': 0.5,
                          'ratio_parent': 0.25, 'num_iter': 500,
+                         'target_latency_us': None, 'latency_exponent': -0.07,
                          'constraints': {'max_num_weights': 4.5e5}}
 
     if 'evolution_search' in nas_policy:
@@ -255,7 +256,9 @@ def main():
                                  prob_mutation=evo_search_params['prob_mutation'],
                                  ratio_mutation=evo_search_params['ratio_mutation'],
                                  ratio_parent=evo_search_params['ratio_parent'],
-                                 num_iter=evo_search_params['num_iter'])
+                                 num_iter=evo_search_params['num_iter'],
+                                 target_latency_us=evo_search_params['target_latency_us'],
+                                 latency_exponent=evo_search_params['latency_exponent'])
     evo_search.set_model(model)
     arch_list = evo_search.run(evo_search_params['constraints'], train_loader,
                                val_loader, args.device)
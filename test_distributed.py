@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for distributed training, with two CPU processes (gloo backend)
+"""
+import argparse
+import copy
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch import nn
+
+import torchnet.meter as tnt
+
+from utils import distributed
+
+WORLD_SIZE = 2
+NUM_SAMPLES = 7  # Not a multiple of WORLD_SIZE
+
+
+def create_args(rank):
+    '''
+    Returns the arguments that distributed.init() sets
+    '''
+    return argparse.Namespace(distributed=True, rank=rank, local_rank=rank,
+                              world_size=WORLD_SIZE, distributed_seed=0, device='cpu', nas=False)
+
+
+def check_wrap(args):
+    '''
+    The gradients of the wrapped model are the mean of the gradients of the processes
+    '''
+    torch.manual_seed(0)
+    model = nn.Linear(4, 2)
+    reference = copy.deepcopy(model)
+    ddp_model = distributed.wrap(model, args)
+    assert isinstance(ddp_model, nn.parallel.DistributedDataParallel), 'FAIL!!'
+    assert distributed.unwrap(ddp_model) is model, 'FAIL!!'
+
+    inputs = [torch.rand(3, 4, generator=torch.Generator().manual_seed(r))
+              for r in range(WORLD_SIZE)]
+    ddp_model(inputs[args.rank]).sum().backward()
+    for x in inputs:
+        reference(x).sum().backward()
+    assert torch.allclose(model.weight.grad, reference.weight.grad / WORLD_SIZE,
+                          atol=1e-6), 'FAIL!!'
+    assert torch.allclose(model.bias.grad, reference.bias.grad / WORLD_SIZE, atol=1e-6), 'FAIL!!'
+
+
+def check_sampler(args):
+    '''
+    Padded shards have the same length; unpadded shards contain every sample exactly once
+    '''
+    sampler = distributed.ShardedSampler(range(NUM_SAMPLES), args.rank, WORLD_SIZE,
+                                         shuffle=True, seed=0)
+    sampler.set_epoch(1)
+    indices = list(sampler)
+    assert len(indices) == len(sampler) == (NUM_SAMPLES + 1) // WORLD_SIZE, 'FAIL!!'
+
+    sampler = distributed.ShardedSampler(range(NUM_SAMPLES), args.rank, WORLD_SIZE,
+                                         shuffle=False, pad=False)
+    indices = list(sampler)
+    assert len(indices) == len(sampler), 'FAIL!!'
+    gathered = [None] * WORLD_SIZE
+    dist.all_gather_object(gathered, indices)
+    assert sorted(i for shard in gathered for i in shard) == list(range(NUM_SAMPLES)), 'FAIL!!'
+
+
+def check_all_reduce_meters(args):
+    '''
+    The reduced meters of the unpadded shards match the meters of a single process
+    '''
+    generator = torch.Generator().manual_seed(0)
+    output = torch.rand(NUM_SAMPLES, 10, generator=generator)
+    target = torch.randint(10, (NUM_SAMPLES, ), generator=generator)
+    loss = torch.rand(NUM_SAMPLES, generator=generator)
+
+    def _meters(indices):
+        classerr = tnt.ClassErrorMeter(accuracy=True, topk=(1, 5))
+        average = tnt.AverageValueMeter()
+        confusion = tnt.ConfusionMeter(10)
+        for i in indices:
+            classerr.add(output[i:i+1], target[i:i+1])
+            average.add(loss[i].item())
+            confusion.add(output[i:i+1], target[i:i+1])
+        return [classerr, average, confusion]
+
+    expected = _meters(range(NUM_SAMPLES))
+    meters = _meters(distributed.ShardedSampler(range(NUM_SAMPLES), args.rank, WORLD_SIZE,
+                                                shuffle=False, pad=False))
+    distributed.all_reduce_meters(meters, args)
+    assert meters[0].value() == expected[0].value(), 'FAIL!!'
+    assert abs(meters[1].mean - expected[1].mean) < 1e-9, 'FAIL!!'
+    assert (meters[2].value() == expected[2].value()).all(), 'FAIL!!'
+
+
+def run(rank, port):
+    '''
+    Runs the checks in process `rank`
+    '''
+    dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{port}', rank=rank,
+                            world_size=WORLD_SIZE)
+    try:
+        args = create_args(rank)
+        check_wrap(args)
+        check_sampler(args)
+        check_all_reduce_meters(args)
+    finally:
+        dist.destroy_process_group()
+
+
+def test():
+    '''
+    Main program to test distributed training support
+    '''
+    print('Testing distributed training with two CPU processes', end=' ')
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+    mp.spawn(run, args=(port, ), nprocs=WORLD_SIZE, join=True)
+    print('PASS')
+
+
+if __name__ == "__main__":
+    test()
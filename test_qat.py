@@ -11,10 +11,16 @@
 Test routine for QAT
 """
 import copy
+import importlib
+from collections import OrderedDict
 
+import numpy as np
 import torch
 
 import ai8x
+from datasets.svhn import SVHN
+from nas import evo_search, nas_utils
+from utils import data_memory, kernel_memory, latency, mixed_precision, streaming
 
 
 def create_input_data(num_channels):
@@ -136,5 +142,611 @@ def test():
     print('\nSUCCESS!!')
 
 
+def test_output_shift_cache():
+    '''
+    Checks that the cached output shift follows the parameter updates
+    '''
+    inp, _ = create_input_data(16)
+    fp_layer = create_conv2d_layer(16, 16, 3, False, None)
+    q_fp_layer = quantize_fp_layer(fp_layer, False, None, 8)
+
+    print('Testing output shift cache ...', end=' ')
+    q_fp_layer(inp)
+    out_shift = q_fp_layer.output_shift.detach().clone()
+    with torch.no_grad():
+        q_fp_layer.op.weight.mul_(16.)
+    q_fp_layer(inp)
+    assert (q_fp_layer.output_shift == out_shift + 4.).all(), 'FAIL!!'
+
+    ai8x.set_shift_update_interval(q_fp_layer, 2)
+    q_fp_layer(inp)
+    out_shift = q_fp_layer.output_shift.detach().clone()
+    with torch.no_grad():
+        q_fp_layer.op.weight.mul_(16.)
+    q_fp_layer(inp)
+    assert (q_fp_layer.output_shift == out_shift).all(), 'FAIL!!'
+    q_fp_layer.eval()
+    q_fp_layer(inp)
+    assert (q_fp_layer.output_shift == out_shift + 4.).all(), 'FAIL!!'
+    print('PASS')
+
+
+def test_eval_weight_cache():
+    '''
+    Checks that the quantized weights cached in evaluation mode follow the parameter updates
+    '''
+    inp, _ = create_input_data(16)
+    fp_layer = create_conv2d_layer(16, 16, 3, False, 'ReLU')
+    q_fp_layer = quantize_fp_layer(fp_layer, False, 'ReLU', 4)
+
+    print('Testing evaluation weight cache ...', end=' ')
+    q_fp_out = q_fp_layer(inp)
+    q_fp_layer.eval()
+    with torch.no_grad():
+        assert (q_fp_layer(inp) == q_fp_out).all(), 'FAIL!!'
+        assert (q_fp_layer(inp) == q_fp_out).all(), 'FAIL!!'
+        q_fp_layer.op.weight.mul_(-1.)
+        q_fp_eval_out = q_fp_layer(inp)
+    q_fp_layer.train()
+    assert (q_fp_layer(inp) == q_fp_eval_out).all(), 'FAIL!!'
+    print('PASS')
+
+
+def test_functional_forward():
+    '''
+    Checks that the functional forward path matches the parameter swapping path
+    '''
+    inp, _ = create_input_data(16)
+    fp_layer = create_conv2d_layer(16, 16, 3, False, 'ReLU')
+    q_fp_layer = quantize_fp_layer(fp_layer, False, 'ReLU', 2)
+    hooked_layer = copy.deepcopy(q_fp_layer)
+    # Forward hooks on the operator select the parameter swapping path
+    hooked_layer.op.register_forward_hook(lambda *_: None)
+
+    print('Testing functional forward ...', end=' ')
+    q_fp_out = q_fp_layer(inp)
+    q_fp_out.sum().backward()
+    hooked_out = hooked_layer(inp)
+    hooked_out.sum().backward()
+    assert (q_fp_out == hooked_out).all(), 'FAIL!!'
+    assert (q_fp_layer.op.weight.grad == hooked_layer.op.weight.grad).all(), 'FAIL!!'
+    print('PASS')
+
+
+def test_fused_activation():
+    '''
+    Checks that the fused output scale, activation, quantization and clamp match the modules
+    '''
+    inp, _ = create_input_data(16)
+
+    for act in [None, 'ReLU', 'Abs']:
+        for wide in [False, True]:
+            if wide and (act is not None):
+                continue
+
+            print(f'Testing fused activation for wide:{wide}, activation:{act} ...', end=' ')
+            fp_layer = create_conv2d_layer(16, 16, 3, wide, act)
+            q_fp_layer = quantize_fp_layer(fp_layer, wide, act, 8)
+            hooked_layer = copy.deepcopy(q_fp_layer)
+            # Forward hooks on the clamp module select the unfused path
+            hooked_layer.clamp.register_forward_hook(lambda *_: None)
+
+            q_fp_out = q_fp_layer(inp)
+            q_fp_out.sum().backward()
+            hooked_out = hooked_layer(inp)
+            hooked_out.sum().backward()
+            assert (q_fp_out == hooked_out).all(), 'FAIL!!'
+            assert (q_fp_layer.op.weight.grad == hooked_layer.op.weight.grad).all(), 'FAIL!!'
+            print('PASS')
+
+
+def test_jit():
+    '''
+    Checks that the TorchScript version of a layer matches the layer and shares its parameters
+    '''
+    inp, _ = create_input_data(16)
+
+    for act in [None, 'ReLU', 'Abs']:
+        print(f'Testing JIT for activation:{act} ...', end=' ')
+        fp_layer = create_conv2d_layer(16, 16, 3, False, act)
+        q_fp_layer = quantize_fp_layer(fp_layer, False, act, 4)
+        jit_layer = ai8x.jit_script(q_fp_layer)
+
+        q_fp_out = q_fp_layer(inp)
+        q_fp_out.sum().backward()
+        weight_grad = q_fp_layer.op.weight.grad.clone()
+        q_fp_layer.op.weight.grad = None
+
+        jit_out = jit_layer(inp)
+        jit_out.sum().backward()
+        assert (q_fp_out == jit_out).all(), 'FAIL!!'
+        assert torch.allclose(weight_grad, q_fp_layer.op.weight.grad), 'FAIL!!'
+        assert set(jit_layer.state_dict()) == set(q_fp_layer.state_dict()), 'FAIL!!'
+        print('PASS')
+
+
+def test_integer_inference():
+    '''
+    Checks that the inference-only simulation layers match simulation bit-for-bit
+    '''
+    inp, inp_int = create_input_data(16)
+
+    for bit in [8, 4, 2]:
+        for act in [None, 'ReLU']:
+            for wide in [False, True]:
+                if wide and (act is not None):
+                    continue
+
+                print(f'Testing integer inference for bits:{bit}, wide:{wide}, '
+                      f'activation:{act} ...', end=' ')
+                fp_layer = create_conv2d_layer(16, 16, 3, wide, act)
+                q_fp_layer = quantize_fp_layer(fp_layer, wide, act, bit)
+                q_fp_layer(inp)
+                q_int_layer = quantize_layer(q_fp_layer, wide, act, bit)
+
+                ai8x.set_device(device=85, simulate=True, round_avg=False, verbose=False)
+                q_int_layer.eval()
+                with torch.no_grad():
+                    q_int_out = q_int_layer(inp_int)
+                    int_layer = ai8x.integer_inference_prep(q_int_layer)
+                    int_out = int_layer(inp_int)
+                assert (int_layer.weight == int_layer.weight.round()).all(), 'FAIL!!'
+                assert (q_int_out == int_out).all(), 'FAIL!!'
+                print('PASS')
+
+
+def test_integer_inference_model():
+    '''
+    Checks that an inference-only simulation model with pooling, a wide output and a linear
+    layer matches the simulation output bit-for-bit
+    '''
+    print('Testing integer inference for a model ...', end=' ')
+    ai8x.set_device(device=85, simulate=True, round_avg=False, verbose=False)
+    kwargs = {'bias': True, 'weight_bits': 8, 'bias_bits': 8, 'quantize_activation': True}
+    model = torch.nn.Sequential(
+        ai8x.FusedConv2dReLU(4, 8, 3, padding=1, **kwargs),
+        ai8x.FusedMaxPoolConv2dReLU(8, 8, 3, padding=1, **kwargs),
+        ai8x.FusedAvgPoolConv2dReLU(8, 16, 1, padding=0, **kwargs),
+        torch.nn.Flatten(),
+        ai8x.Linear(16 * 2 * 2, 10, wide=True, **kwargs),
+    )
+    generator = torch.Generator().manual_seed(0)
+    for module in model.modules():
+        if isinstance(module, ai8x.QuantizationAwareModule):
+            module.op.weight.data = torch.randint(-128, 128, module.op.weight.shape,
+                                                  generator=generator).float()
+            module.op.bias.data = torch.randint(-2**14, 2**14, module.op.bias.shape,
+                                                generator=generator).float()
+            module.output_shift.data = torch.tensor([-8.])
+    model.eval()
+
+    x = torch.randint(-128, 128, (4, 4, 8, 8), generator=generator).float()
+    with torch.no_grad():
+        expected = model(x)
+        output = ai8x.integer_inference_prep(model)(x)
+    assert (expected != 0).any(), 'FAIL!!'
+    assert torch.equal(output, expected), 'FAIL!!'
+    print('PASS')
+
+
+def test_shared_operators():
+    '''
+    Checks that layers with the same configuration share their quantize and clamp modules
+    only when enabled
+    '''
+    print('Testing shared operators ...', end=' ')
+    fp_layer = create_conv2d_layer(16, 16, 3, False, 'ReLU')
+    q_fp_layer8 = quantize_fp_layer(fp_layer, False, 'ReLU', 8)
+    q_fp_layer2 = quantize_fp_layer(fp_layer, False, 'ReLU', 2)
+    assert q_fp_layer8.clamp is not q_fp_layer2.clamp, 'FAIL!!'
+    assert q_fp_layer8.quantize is not q_fp_layer2.quantize, 'FAIL!!'
+
+    ai8x.set_operator_sharing(True)
+    q_fp_layer8 = quantize_fp_layer(fp_layer, False, 'ReLU', 8)
+    q_fp_layer2 = quantize_fp_layer(fp_layer, False, 'ReLU', 2)
+    assert q_fp_layer8.clamp is q_fp_layer2.clamp, 'FAIL!!'
+    assert q_fp_layer8.quantize is q_fp_layer2.quantize, 'FAIL!!'
+    assert q_fp_layer8.clamp_weight is not q_fp_layer2.clamp_weight, 'FAIL!!'
+
+    ai8x.set_device(device=85, simulate=True, round_avg=False, verbose=False)
+    ai8x.update_model(q_fp_layer8)
+    assert q_fp_layer8.clamp is not q_fp_layer2.clamp, 'FAIL!!'
+    assert q_fp_layer8.clamp.max_val == 127, 'FAIL!!'
+    ai8x.set_operator_sharing(False)
+    print('PASS')
+
+
+def test_fold_batchnorm():
+    '''
+    Checks that batched batchnorm folding matches folding each layer separately
+    '''
+    print('Testing batched batchnorm folding ...', end=' ')
+    shapes = [(8, 4, 3, 3), (16, 8, 1, 1), (10, 20)]
+    weights = [torch.randn(shape) for shape in shapes]
+    biases = [torch.randn(shape[0]) for shape in shapes[:-1]] + [None]
+    means = [torch.randn(shape[0]) for shape in shapes]
+    variances = [torch.rand(shape[0]) + 0.5 for shape in shapes]
+    bn_weights = [torch.randn(shape[0]) for shape in shapes[:-1]] + [None]
+    bn_biases = [torch.randn(shape[0]) for shape in shapes]
+
+    expected = []
+    for w, b, mean, var, beta, gamma in zip(weights, biases, means, variances,
+                                            bn_weights, bn_biases):
+        inv_std = torch.rsqrt(var + 1e-5)
+        beta = 0.25 * (beta if beta is not None else torch.ones(w.shape[0]))
+        b = b if b is not None else torch.zeros(w.shape[0])
+        expected.append((w * (beta * inv_std).reshape((w.shape[0],) + (1,) * (w.dim() - 1)),
+                         (b - mean) * inv_std * beta + 0.25 * gamma))
+
+    folded = ai8x.fold_batchnorm(weights, biases, means, variances, bn_weights, bn_biases, 1e-5)
+    for w, b, (w_expected, b_expected) in zip(weights, folded, expected):
+        assert torch.allclose(w, w_expected, atol=1e-6), 'FAIL!!'
+        assert torch.allclose(b, b_expected, atol=1e-6), 'FAIL!!'
+    print('PASS')
+
+
+def test_fuse_bn_layers():
+    '''
+    Checks that fusing batchnorm into a layer keeps its output and discards its cached output
+    shift and weights
+    '''
+    print('Testing batchnorm fusion ...', end=' ')
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    layer = ai8x.Conv2d(4, 8, 3, padding=1, bias=True, batchnorm='Affine')
+    layer.bn.running_mean.uniform_(-0.1, 0.1)
+    layer.bn.running_var.uniform_(0.5, 1.5)
+    layer.bn.weight.data.uniform_(0.5, 1.5)
+    layer.bn.bias.data.uniform_(-0.1, 0.1)
+    layer.eval()
+
+    x = torch.rand(2, 4, 8, 8) - 0.5
+    with torch.no_grad():
+        expected = layer(x)
+        assert layer.shift_cache is not None and layer.weight_cache is not None, 'FAIL!!'
+        ai8x.fuse_bn_layers(layer)
+        assert layer.bn is None, 'FAIL!!'
+        assert layer.shift_cache is None and layer.weight_cache is None, 'FAIL!!'
+        assert torch.allclose(layer(x), expected, atol=1e-5), 'FAIL!!'
+    print('PASS')
+
+
+def test_float64():
+    '''
+    Checks that layers keep the floating point type of their input
+    '''
+    print('Testing float64 layers ...', end=' ')
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    layer = ai8x.FusedConv2dReLU(4, 8, 3, padding=1, bias=True).double()
+    assert layer(torch.rand(1, 4, 8, 8, dtype=torch.float64)).dtype == torch.float64, 'FAIL!!'
+    print('PASS')
+
+
+def test_streaming():
+    '''
+    Checks that streaming inference on stripes matches whole-frame inference for a
+    convolutional stack with padding, strides and pooling, and that models with Linear layers
+    are rejected
+    '''
+    print('Testing streaming inference ...', end=' ')
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    model = torch.nn.Sequential(
+        ai8x.FusedConv2dReLU(3, 8, 3, padding=1, bias=True),
+        ai8x.FusedConv2dReLU(8, 8, 3, stride=2, padding=1, bias=True),
+        ai8x.FusedMaxPoolConv2dReLU(8, 8, 3, pool_size=2, pool_stride=2, padding=1, bias=True),
+        ai8x.Conv2d(8, 4, 3, padding=1, bias=True),
+    )
+    model.eval()
+    plan = streaming.StreamingPlan(model, (3, 62, 20))
+    assert plan.streamable and plan.alignment == 4, 'FAIL!!'
+
+    x = torch.rand(2, 3, 62, 20) - 0.5
+    with torch.no_grad():
+        expected = model(x)
+        for rows in (4, 8, 13):
+            output = streaming.StreamingModel(model, plan, rows)(x)
+            assert output.shape == expected.shape, 'FAIL!!'
+            assert torch.allclose(output, expected, atol=1e-5), 'FAIL!!'
+
+    model = torch.nn.Sequential(ai8x.FusedConv2dReLU(3, 8, 3, padding=1),
+                                torch.nn.Flatten(), ai8x.Linear(8 * 8 * 8, 10))
+    plan = streaming.StreamingPlan(model, (3, 8, 8))
+    try:
+        streaming.StreamingModel(model, plan, 4)
+        assert False, 'FAIL!!'
+    except ValueError:
+        pass
+    print('PASS')
+
+
+def test_data_memory_concatenation():
+    '''
+    Checks that the data memory plan records concatenations of activations, but not the
+    concatenations of weights and biases inside the layers
+    '''
+    print('Testing data memory plan concatenations ...', end=' ')
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+
+    class Concat(torch.nn.Module):
+        """Skip connection through a concatenation"""
+        def __init__(self):
+            super().__init__()
+            self.conv1 = ai8x.FusedConv2dReLU(4, 8, 3, padding=1, bias=True)
+            self.conv2 = ai8x.FusedConv2dReLU(8, 8, 3, padding=1, bias=True)
+            self.conv3 = ai8x.Conv2d(16, 4, 1, bias=True)
+
+        def forward(self, x):  # pylint: disable=arguments-differ
+            """Forward prop"""
+            y = self.conv1(x)
+            return self.conv3(torch.cat((y, self.conv2(y)), dim=1))
+
+    model = Concat()
+    ai8x.initiate_qat(model, {'weight_bits': 8})
+    plan = data_memory.DataMemoryPlan(model, (4, 8, 8))
+    assert [layer.name for layer in plan.layers] == ['conv1', 'conv2', 'cat', 'conv3'], 'FAIL!!'
+    assert plan.layers[2].input_shapes == [(1, 8, 8, 8), (1, 8, 8, 8)], 'FAIL!!'
+    assert plan.layers[2].output_shape == (1, 16, 8, 8), 'FAIL!!'
+    print('PASS')
+
+
+def test_activation_checkpointing():
+    '''
+    Checks that activation checkpointing does not change outputs, gradients, or batchnorm
+    running statistics
+    '''
+    print('Testing activation checkpointing ...', end=' ')
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    layer = ai8x.FusedConv2dBNReLU(4, 8, 3, padding=1, batchnorm='Affine')
+    layer_ckpt = copy.deepcopy(layer)
+    layer.train()
+    layer_ckpt.train()
+
+    x = torch.randn(2, 4, 8, 8, requires_grad=True)
+    x_ckpt = x.detach().clone().requires_grad_()
+    out = layer(x)
+    out_ckpt = ai8x.checkpoint(layer_ckpt, x_ckpt)
+    assert torch.allclose(out, out_ckpt), 'FAIL!!'
+
+    out.sum().backward()
+    out_ckpt.sum().backward()
+    assert torch.allclose(x.grad, x_ckpt.grad, atol=1e-6), 'FAIL!!'
+    assert torch.allclose(layer.op.weight.grad, layer_ckpt.op.weight.grad, atol=1e-5), 'FAIL!!'
+    assert torch.allclose(layer.bn.running_mean, layer_ckpt.bn.running_mean), 'FAIL!!'
+    assert torch.allclose(layer.bn.running_var, layer_ckpt.bn.running_var), 'FAIL!!'
+    print('PASS')
+
+
+def test_model_activation_checkpointing():
+    '''
+    Checks that checkpointing the encoder and decoder stages of a UNet does not change the
+    outputs or the gradients, and that the recomputation does not update the batchnorm
+    running statistics, including with a cumulative moving average (momentum None)
+    '''
+    print('Testing activation checkpointing of model stages ...', end=' ')
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    unet = importlib.import_module('models.ai85net-unet')
+    model = unet.AI85UNetSmall(num_classes=4, num_channels=3, dimensions=(16, 16))
+    model.enc1.bn.momentum = None
+    model_ckpt = copy.deepcopy(model)
+    assert ai8x.set_activation_checkpointing(model_ckpt, True) == 1, 'FAIL!!'
+    model.train()
+    model_ckpt.train()
+
+    x = torch.rand(2, 3, 16, 16) - 0.5
+    out = model(x)
+    out_ckpt = model_ckpt(x)
+    assert torch.equal(out, out_ckpt), 'FAIL!!'
+
+    out.sum().backward()
+    out_ckpt.sum().backward()
+    for (name, p), p_ckpt in zip(model.named_parameters(), model_ckpt.parameters()):
+        assert p_ckpt.grad is not None, f'FAIL!! {name}'
+        assert torch.allclose(p.grad, p_ckpt.grad, atol=1e-5), f'FAIL!! {name}'
+    for (name, b), b_ckpt in zip(model.named_buffers(), model_ckpt.buffers()):
+        assert torch.equal(b, b_ckpt), f'FAIL!! {name}'
+    print('PASS')
+
+
+def reference_fold(img, fold_ratio):
+    '''
+    Folds a C-H-W image with the original nested loops
+    '''
+    img_folded = None
+    for i in range(fold_ratio):
+        for j in range(fold_ratio):
+            img_subsample = img[:, i::fold_ratio, j::fold_ratio]
+            if img_folded is not None:
+                img_folded = torch.cat((img_folded, img_subsample), dim=0)
+            else:
+                img_folded = img_subsample
+    return img_folded
+
+
+def reference_unfold_batch(img_batch, fold_ratio):
+    '''
+    Unfolds an N-C-H-W batch with the original nested loops
+    '''
+    num_out_channels = img_batch.shape[1] // (fold_ratio*fold_ratio)
+    img_batch_uf = torch.zeros((img_batch.shape[0], num_out_channels,
+                                img_batch.shape[2]*fold_ratio, img_batch.shape[3]*fold_ratio),
+                               dtype=img_batch.dtype)
+    for i in range(fold_ratio):
+        for j in range(fold_ratio):
+            ch_index_start = num_out_channels*(i*fold_ratio + j)
+            ch_index_end = num_out_channels * (i*fold_ratio + j + 1)
+            img_batch_uf[:, :, i::fold_ratio, j::fold_ratio] = \
+                img_batch[:, ch_index_start:ch_index_end, :, :]
+    return img_batch_uf
+
+
+def reference_fold_image(img, fold_ratio):
+    '''
+    Folds an H-W-C numpy image with the original nested loops of SVHN.fold_image()
+    '''
+    img_folded = None
+    for i in range(fold_ratio):
+        for j in range(fold_ratio):
+            if img_folded is not None:
+                img_folded = np.concatenate((img_folded, img[i::fold_ratio, j::fold_ratio, :]),
+                                            axis=2)
+            else:
+                img_folded = img[i::fold_ratio, j::fold_ratio, :]
+    return img_folded
+
+
+def test_fold():
+    '''
+    Checks that folding and unfolding keep the channel order of the original loops
+    '''
+    print('Testing fold and unfold ...', end=' ')
+    for fold_ratio, channels, height, width in [(1, 3, 8, 8), (2, 3, 10, 6), (3, 1, 9, 15),
+                                                (4, 5, 12, 20), (2, 48, 2, 2)]:
+        img = torch.randn(channels, height, width)
+        folded = ai8x.fold(fold_ratio)(img)
+        assert torch.equal(folded, reference_fold(img, fold_ratio)), 'FAIL!!'
+
+        batch = torch.randn(2, channels, height, width)
+        folded_batch = ai8x.fold_batch(batch, fold_ratio)
+        assert torch.equal(folded_batch[1], reference_fold(batch[1], fold_ratio)), 'FAIL!!'
+        assert torch.equal(ai8x.unfold_batch(folded_batch, fold_ratio),
+                           reference_unfold_batch(folded_batch, fold_ratio)), 'FAIL!!'
+        assert torch.equal(ai8x.unfold_batch(folded_batch, fold_ratio), batch), 'FAIL!!'
+
+        image = np.random.randint(0, 256, (height, width, channels), dtype=np.uint8)
+        assert np.array_equal(SVHN.fold_image(image, fold_ratio),
+                              reference_fold_image(image, fold_ratio)), 'FAIL!!'
+    print('PASS')
+
+
+def create_kernel_memory_model():
+    '''
+    Creates a model with 3x3, 1x1, multi-pass and flattened Linear layers
+    '''
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    return torch.nn.Sequential(OrderedDict([
+        ('conv1', ai8x.FusedConv2dReLU(3, 16, 3, padding=1, bias=True)),
+        ('conv2', ai8x.FusedConv2dReLU(16, 32, 1, padding=0, bias=True)),
+        ('conv3', ai8x.FusedMaxPoolConv2dReLU(32, 100, 3, padding=1, bias=True)),
+        ('conv4', ai8x.FusedMaxPoolConv2dReLU(100, 32, 3, padding=1, bias=True)),
+        ('flatten', torch.nn.Flatten()),
+        ('fc', ai8x.Linear(32 * 4 * 4, 10, bias=True)),
+    ]))
+
+
+def test_kernel_memory():
+    '''
+    Checks the kernel memory estimate of a model against the counts of the hardware layout,
+    where each word holds one kernel of an input and output channel pair
+    '''
+    print('Testing kernel memory estimate ...', end=' ')
+    model = create_kernel_memory_model()
+
+    layout = kernel_memory.KernelMemoryLayout(model)
+    # conv1: 3 processors x 16 kernels; conv2: 1x1 kernels use a word each; conv3: 100 kernels;
+    # conv4: 100 input channels need 2 passes of 32 kernels; fc: 32 flattened channels of
+    # 4x4 pixels, 16 weights need 2 words for each of 10 outputs
+    assert [layer.processors for layer in layout.layers] == [3, 16, 32, 64, 32], 'FAIL!!'
+    assert [layer.words for layer in layout.layers] == [16, 32, 100, 64, 20], 'FAIL!!'
+    assert sum(layout.depth) == 3*16 + 16*32 + 32*100 + 64*64 + 32*20, 'FAIL!!'
+    assert sum(layout.bias_used) == 16 + 32 + 100 + 32 + 10, 'FAIL!!'
+    assert layout.fits, 'FAIL!!'
+
+    # With 2-bit weights, the kernels of four output channels share a word
+    policy = {'weight_bits': 8, 'overrides': {'conv2': {'weight_bits': 2}}}
+    layout = kernel_memory.KernelMemoryLayout(model, policy)
+    assert [layer.words for layer in layout.layers] == [16, 8, 100, 64, 20], 'FAIL!!'
+    print('PASS')
+
+
+def test_mixed_precision():
+    '''
+    Checks that the mixed-precision planner reduces the weight bits of the least sensitive
+    layer until the model fits into kernel memory
+    '''
+    print('Testing mixed-precision weight bits selection ...', end=' ')
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    # Each layer needs 512 of the 768 words of all 64 processors with 8-bit weights
+    model = torch.nn.Sequential(OrderedDict([
+        ('conv1', ai8x.FusedConv2dReLU(64, 512, 3, padding=1, bias=False)),
+        ('conv2', ai8x.FusedConv2dReLU(64, 512, 3, padding=1, bias=False)),
+    ]))
+    groups = mixed_precision.layer_groups(model)
+    assert groups == OrderedDict([('conv1', ['conv1']), ('conv2', ['conv2'])]), 'FAIL!!'
+    assert not kernel_memory.fits(model), 'FAIL!!'
+
+    def _sensitivity(sensitive):
+        return {group: {bits: (1. if group == sensitive else .01) * (8 - bits)
+                        for bits in mixed_precision.WEIGHT_BITS} for group in groups}
+
+    selection = mixed_precision.select_weight_bits(model, groups, _sensitivity('conv1'))
+    assert selection == {'conv1': 8, 'conv2': 4}, 'FAIL!!'
+    selection = mixed_precision.select_weight_bits(model, groups, _sensitivity('conv2'))
+    assert selection == {'conv1': 4, 'conv2': 8}, 'FAIL!!'
+    assert kernel_memory.fits(model, mixed_precision.selection_policy(selection)), 'FAIL!!'
+    print('PASS')
+
+
+def test_latency():
+    '''
+    Checks the cycles of a convolution against a hand-computed count, and that the evolutionary
+    search estimates the latency of a candidate once for the constraint and the efficiency
+    '''
+    print('Testing latency estimate ...', end=' ')
+    ai8x.set_device(device=85, simulate=False, round_avg=False, verbose=False)
+    # One pass over 4 processors, 8x8 output pixels and 8 output channels of one 3x3 kernel
+    model = torch.nn.Sequential(ai8x.FusedConv2dReLU(4, 8, 3, padding=1, bias=True))
+    estimate = latency.LatencyEstimate(model, (4, 8, 8))
+    assert len(estimate.layers) == 1, 'FAIL!!'
+    assert estimate.layers[0].passes == 1 and estimate.layers[0].processors == 4, 'FAIL!!'
+    assert estimate.cycles == latency.LAYER_OVERHEAD + 8 * 8 * 8, 'FAIL!!'
+    assert estimate.latency == estimate.cycles / latency.CLOCK[85], 'FAIL!!'
+
+    nasnet = importlib.import_module('models.ai85nasnet-sequential')
+    model = nasnet.OnceForAll2DSequentialModel(num_classes=8, num_channels=1,
+                                               dimensions=(32, 32), bias=True, n_units=6,
+                                               depth_list=[4, 3, 3, 3, 2, 2],
+                                               width_list=[32, 64, 96, 96, 128, 256],
+                                               kernel_list=[3, 3, 3, 3, 3, 3], bn=False)
+    search = evo_search.EvolutionSearch(target_latency_us=1000.)
+    search.set_model(model)
+    sample = search.arch
+    latency_s = nas_utils.calc_latency(sample, model)
+
+    calls = []
+    calc_latency = nas_utils.calc_latency
+
+    def _calc_latency(child_net_arch, model):
+        calls.append(child_net_arch)
+        return calc_latency(child_net_arch, model)
+
+    nas_utils.calc_latency = _calc_latency
+    try:
+        assert search.check_constraint(sample, {'max_latency_us': 1e6 * latency_s}), 'FAIL!!'
+        efficiency = search.calc_efficiency(sample)
+    finally:
+        nas_utils.calc_latency = calc_latency
+    assert len(calls) == 1, 'FAIL!!'
+    assert efficiency == (latency_s / 1e-3) ** search.latency_exponent, 'FAIL!!'
+    print('PASS')
+
+
 if __name__ == "__main__":
     test()
+    test_output_shift_cache()
+    test_eval_weight_cache()
+    test_functional_forward()
+    test_fused_activation()
+    test_jit()
+    test_integer_inference()
+    test_integer_inference_model()
+    test_shared_operators()
+    test_fold_batchnorm()
+    test_fuse_bn_layers()
+    test_float64()
+    test_streaming()
+    test_data_memory_concatenation()
+    test_activation_checkpointing()
+    test_model_activation_checkpointing()
+    test_fold()
+    test_kernel_memory()
+    test_mixed_precision()
+    test_latency()
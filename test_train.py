@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Test routine for the training utilities
+"""
+import argparse
+import copy
+import logging
+import os
+import tempfile
+from collections import OrderedDict, defaultdict, namedtuple
+
+import torch
+from torch import nn
+
+import torchnet.meter as tnt
+
+import train
+from utils import checkpoint_cache, checkpoint_writer, meters, prefetcher, profiling
+
+
+def test_checkpoint_cache():
+    '''
+    Checks that the checkpoint metadata matches the fully loaded checkpoint without tensors,
+    and that derived checkpoints are saved to the cache directory
+    '''
+    print('Testing checkpoint cache ...', end=' ')
+    model = nn.Sequential(nn.Conv2d(3, 4, 3), nn.BatchNorm2d(4))
+    checkpoint = {'epoch': 7, 'arch': 'test', 'state_dict': model.state_dict(),
+                  'optimizer_type': torch.optim.SGD,
+                  'extras': {'best_epoch': 5, 'best_top1': 91.5, 'current_top1': 90.25}}
+    cache_dir = checkpoint_cache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'checkpoint.pth.tar')
+        torch.save(checkpoint, path)
+        metadata = checkpoint_cache.metadata(path)
+        loaded = torch.load(path)
+        for key in ('epoch', 'arch', 'optimizer_type', 'extras'):
+            assert metadata[key] == loaded[key], f'FAIL!! {key}'
+        assert list(metadata['state_dict']) == list(loaded['state_dict']), 'FAIL!!'
+        assert all(v is None for v in metadata['state_dict'].values()), 'FAIL!!'
+
+        legacy_path = os.path.join(tmpdir, 'legacy.pth.tar')
+        torch.save(checkpoint, legacy_path, _use_new_zipfile_serialization=False)
+        legacy = checkpoint_cache.metadata(legacy_path)
+        assert legacy['extras'] == loaded['extras'], 'FAIL!!'
+        assert torch.equal(legacy['state_dict']['0.weight'], model[0].weight), 'FAIL!!'
+
+        checkpoint_cache.CACHE_DIR = os.path.join(tmpdir, 'cache')
+        try:
+            saved_path = checkpoint_cache.save_derived(path, 'test', {'epoch': 8})
+            assert saved_path == checkpoint_cache.derived_path(path, 'test'), 'FAIL!!'
+            assert os.path.dirname(saved_path) == checkpoint_cache.CACHE_DIR, 'FAIL!!'
+            assert torch.load(saved_path) == {'epoch': 8}, 'FAIL!!'
+            assert checkpoint_cache.derived_path(legacy_path, 'test') != saved_path, 'FAIL!!'
+        finally:
+            checkpoint_cache.CACHE_DIR = cache_dir
+    print('PASS')
+
+
+def test_update_old_model_params():
+    '''
+    Checks that missing parameters are added to a copy of an old checkpoint in the cache
+    directory, that the old checkpoint is not modified, and that the copy is reused
+    '''
+    print('Testing old checkpoint migration ...', end=' ')
+    train.msglogger = logging.getLogger()
+    model = nn.Sequential(nn.Conv2d(3, 4, 3), nn.Conv2d(4, 4, 3))
+    old_model = nn.Sequential(nn.Conv2d(3, 4, 3))
+    old_state_dict = {f'module.{k}': v for k, v in old_model.state_dict().items()}
+    cache_dir = checkpoint_cache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as tmpdir:
+        checkpoint_cache.CACHE_DIR = os.path.join(tmpdir, 'cache')
+        try:
+            path = os.path.join(tmpdir, 'old.pth.tar')
+            torch.save({'epoch': 3, 'arch': 'test', 'state_dict': old_state_dict}, path)
+            with open(path, 'rb') as stream:
+                contents = stream.read()
+
+            migrated_path = train.update_old_model_params(path, model)
+            assert os.path.dirname(migrated_path) == checkpoint_cache.CACHE_DIR, 'FAIL!!'
+            with open(path, 'rb') as stream:
+                assert stream.read() == contents, 'FAIL!!'
+            migrated = torch.load(migrated_path)
+            assert migrated['epoch'] == 3, 'FAIL!!'
+            for key, value in model.state_dict().items():
+                expected = old_model.state_dict()[key] if key.startswith('0.') else value
+                assert torch.equal(migrated['state_dict'][key], expected), f'FAIL!! {key}'
+
+            mtime = os.stat(migrated_path).st_mtime_ns
+            assert train.update_old_model_params(path, model) == migrated_path, 'FAIL!!'
+            assert os.stat(migrated_path).st_mtime_ns == mtime, 'FAIL!!'
+
+            path = os.path.join(tmpdir, 'current.pth.tar')
+            torch.save({'epoch': 3, 'arch': 'test', 'state_dict': model.state_dict()}, path)
+            assert train.update_old_model_params(path, model) == path, 'FAIL!!'
+            assert len(os.listdir(checkpoint_cache.CACHE_DIR)) == 1, 'FAIL!!'
+        finally:
+            checkpoint_cache.CACHE_DIR = cache_dir
+    print('PASS')
+
+
+def test_checkpoint_writer():
+    '''
+    Checks that the snapshot keeps the container types and does not change with the model,
+    and that only the last `keep` checkpoints are retained
+    '''
+    print('Testing checkpoint writer ...', end=' ')
+    writer = checkpoint_writer.CheckpointWriter(keep=2)
+
+    Pair = namedtuple('Pair', ['first', 'second'])
+    tensor = torch.ones(3)
+    state = OrderedDict([('pair', Pair(tensor, [tensor, 2])), ('counts', defaultdict(int))])
+    state['counts']['a'] = 1
+    snapshot = writer.snapshot(state)
+    tensor.zero_()
+    assert isinstance(snapshot, OrderedDict), 'FAIL!!'
+    assert isinstance(snapshot['pair'], Pair), 'FAIL!!'
+    assert isinstance(snapshot['pair'].second, list), 'FAIL!!'
+    assert torch.equal(snapshot['pair'].first, torch.ones(3)), 'FAIL!!'
+    assert snapshot['pair'].second[1] == 2, 'FAIL!!'
+    assert isinstance(snapshot['counts'], defaultdict), 'FAIL!!'
+    assert snapshot['counts']['b'] == 0 and snapshot['counts']['a'] == 1, 'FAIL!!'
+
+    model = nn.Linear(4, 2)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for epoch in range(4):
+            model(torch.rand(8, 4)).sum().backward()
+            optimizer.step()
+            writer.save(epoch, 'linear', model, optimizer, is_best=epoch == 1, name='test',
+                        dir=tmpdir)
+        writer.close()
+
+        assert sorted(os.listdir(tmpdir)) == [
+            'test_best.pth.tar', 'test_checkpoint.pth.tar', 'test_checkpoint_epoch0002.pth.tar',
+            'test_checkpoint_epoch0003.pth.tar',
+        ], 'FAIL!!'
+        checkpoint = torch.load(os.path.join(tmpdir, 'test_checkpoint.pth.tar'))
+        best = torch.load(os.path.join(tmpdir, 'test_best.pth.tar'))
+    assert checkpoint['epoch'] == 3 and best['epoch'] == 1, 'FAIL!!'
+    assert checkpoint['arch'] == 'linear', 'FAIL!!'
+    for key, value in model.state_dict().items():
+        assert torch.equal(checkpoint['state_dict'][key], value), f'FAIL!! {key}'
+    assert checkpoint['optimizer_type'] is torch.optim.SGD, 'FAIL!!'
+    assert checkpoint['optimizer_state_dict']['state'], 'FAIL!!'
+    print('PASS')
+
+
+def test_device_prefetcher():
+    '''
+    Checks that the prefetcher returns all batches in order, including a smaller final batch,
+    keeps the batch structure, and on the CPU does not load batches ahead
+    '''
+    print('Testing device prefetcher ...', end=' ')
+    dataset = torch.utils.data.TensorDataset(torch.arange(7.).unsqueeze(1), torch.arange(7))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=3, shuffle=False)
+    batches = list(prefetcher.DevicePrefetcher(loader, 'cpu'))
+    assert len(batches) == 3, 'FAIL!!'
+    for batch, (inputs, target) in zip(batches, loader):
+        assert isinstance(batch, list), 'FAIL!!'
+        assert torch.equal(batch[0], inputs) and torch.equal(batch[1], target), 'FAIL!!'
+    assert batches[-1][1].tolist() == [6], 'FAIL!!'
+
+    Batch = namedtuple('Batch', ['inputs', 'boxes'])
+    loaded = []
+
+    def _loader():
+        for i in range(3):
+            loaded.append(i)
+            yield Batch(torch.full((2, ), i), {'boxes': [torch.zeros(i, 4)]})
+
+    for i, batch in enumerate(prefetcher.DevicePrefetcher(_loader(), 'cpu')):
+        assert loaded == list(range(i + 1)), 'FAIL!!'
+        assert isinstance(batch, Batch), 'FAIL!!'
+        assert batch.inputs.tolist() == [i, i], 'FAIL!!'
+        assert batch.boxes['boxes'][0].shape == (i, 4), 'FAIL!!'
+    assert loaded == [0, 1, 2], 'FAIL!!'
+    print('PASS')
+
+
+def test_meters():
+    '''
+    Checks that the tensor meters match the torchnet meters that they replace
+    '''
+    print('Testing tensor meters ...', end=' ')
+    torch.manual_seed(0)
+    average = meters.TensorAverageMeter()
+    tnt_average = tnt.AverageValueMeter()
+    classerr = meters.TensorClassErrorMeter(topk=(1, 5))
+    tnt_classerr = tnt.ClassErrorMeter(accuracy=True, topk=(1, 5))
+    assert average.mean != average.mean, 'FAIL!!'  # nan without values
+
+    for batch_size in (8, 8, 3):
+        output = torch.randn(batch_size, 10)
+        target = torch.randint(10, (batch_size, ))
+        loss = nn.functional.cross_entropy(output, target)
+        average.add(loss)
+        tnt_average.add(loss.item())
+        classerr.add(output, target)
+        tnt_classerr.add(output, target)
+        assert abs(average.mean - tnt_average.mean) < 1e-6, 'FAIL!!'
+        for k in (1, 5):
+            assert abs(float(classerr.value(k)) - tnt_classerr.value(k)) < 1e-4, 'FAIL!!'
+    assert float(classerr.value()) == float(classerr.value(1)), 'FAIL!!'
+
+    average.reset()
+    classerr.reset()
+    average.add(2.)
+    classerr.add(torch.tensor([0., 1., 0.]), torch.tensor([1]))
+    assert average.mean == 2., 'FAIL!!'
+    assert float(classerr.value(1)) == 100., 'FAIL!!'
+    print('PASS')
+
+
+class RecordingScheduler:
+    '''
+    Compression scheduler that records its calls
+    '''
+    # pylint: disable=unused-argument
+    def __init__(self):
+        self.calls = []
+
+    def on_minibatch_begin(self, epoch, minibatch_id, minibatches_per_epoch, optimizer=None):
+        '''Records the call'''
+        self.calls.append(('begin', minibatch_id, minibatches_per_epoch))
+
+    def before_backward_pass(self, epoch, minibatch_id, minibatches_per_epoch, loss,
+                             optimizer=None, return_loss_components=False):
+        '''Records the call and returns the loss'''
+        self.calls.append(('backward', minibatch_id, minibatches_per_epoch))
+        return argparse.Namespace(overall_loss=loss, loss_components=[])
+
+    def before_parameter_optimization(self, epoch, minibatch_id, minibatches_per_epoch,
+                                      optimizer):
+        '''Records the call'''
+        self.calls.append(('optimize', minibatch_id, minibatches_per_epoch))
+
+    def on_minibatch_end(self, epoch, minibatch_id, minibatches_per_epoch, optimizer):
+        '''Records the call'''
+        self.calls.append(('end', minibatch_id, minibatches_per_epoch))
+
+
+def test_accumulate_steps():
+    '''
+    Checks that accumulating the gradients of several mini-batches steps the optimizer with
+    their mean gradient, including for a smaller last group, and that the scheduler sees one
+    step per group
+    '''
+    print('Testing gradient accumulation ...', end=' ')
+    train.msglogger = logging.getLogger()
+    torch.manual_seed(0)
+    dataset = torch.utils.data.TensorDataset(torch.randn(7, 4), torch.randint(3, (7, )))
+    # Four mini-batches, accumulated in groups of three and one
+    loader = torch.utils.data.DataLoader(dataset, batch_size=2, shuffle=False)
+    criterion = nn.CrossEntropyLoss()
+    model = nn.Linear(4, 3)
+    reference = copy.deepcopy(model)
+
+    args = argparse.Namespace(regression=False, num_classes=3, earlyexit_lossweights=None,
+                              accumulate_steps=3, nas=False, profiler=profiling.Profiler(),
+                              device='cpu', obj_detection=False, distributed=False, amp=False,
+                              out_fold_ratio=1, show_train_accuracy='full', print_freq=10,
+                              log_params_histograms=False)
+    scheduler = RecordingScheduler()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    acc_stats = train.train(loader, model, criterion, optimizer, 0, scheduler, [], args)
+    assert len(acc_stats) == 4, 'FAIL!!'
+
+    optimizer = torch.optim.SGD(reference.parameters(), lr=0.1)
+    batches = list(loader)
+    for group in (batches[:3], batches[3:]):
+        optimizer.zero_grad()
+        loss = sum(criterion(reference(inputs), target) for inputs, target in group)
+        (loss / len(group)).backward()
+        optimizer.step()
+    for p, p_ref in zip(model.parameters(), reference.parameters()):
+        assert torch.allclose(p, p_ref, atol=1e-6), 'FAIL!!'
+
+    assert scheduler.calls == [
+        ('begin', 0, 2), ('backward', 0, 2), ('backward', 0, 2), ('backward', 0, 2),
+        ('optimize', 0, 2), ('end', 0, 2),
+        ('begin', 1, 2), ('backward', 1, 2), ('optimize', 1, 2), ('end', 1, 2),
+    ], 'FAIL!!'
+    print('PASS')
+
+
+def test_profiler():
+    '''
+    Checks the phases that the profiler records, the forward hooks of the model, the report,
+    and that a disabled profiler records nothing
+    '''
+    print('Testing profiler ...', end=' ')
+    model = nn.Sequential(nn.Linear(4, 4), nn.ReLU())
+    x = torch.rand(2, 4)
+
+    profiler = profiling.Profiler()
+    profiler.attach(model)
+    profiler.restart()
+    profiler.lap('data')
+    with profiler.phase('forward'):
+        model(x)
+    assert not profiler.totals and not profiler.hooks, 'FAIL!!'
+    profiler.report(0)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        profiler = profiling.Profiler(enabled=True, logdir=tmpdir)
+        profiler.attach(model)
+        profiler.restart()
+        for _ in range(2):
+            with profiler.phase('data/load'):
+                pass
+            profiler.lap('data')
+            model(x)
+            profiler.lap('forward')
+        profiler.detach()
+        model(x)
+        assert profiler.counts == {'data/load': 2, 'data': 2, 'forward/0': 2, 'forward/1': 2,
+                                   'forward': 2}, 'FAIL!!'
+        assert all(total >= 0. for total in profiler.totals.values()), 'FAIL!!'
+
+        profiler.report(0)
+        assert not profiler.totals, 'FAIL!!'
+        with open(os.path.join(tmpdir, 'profile.txt'), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    assert lines[0] == 'Epoch 0:', 'FAIL!!'
+    phases = [line.split()[0] for line in lines[2:-2] if line]
+    assert phases == ['data', 'load', 'forward', '0', '1', '(other)'], 'FAIL!!'
+    print('PASS')
+
+
+if __name__ == "__main__":
+    test_checkpoint_cache()
+    test_update_old_model_params()
+    test_checkpoint_writer()
+    test_device_prefetcher()
+    test_meters()
+    test_accumulate_steps()
+    test_profiler()
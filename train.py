@@ -53,12 +53,14 @@ train():
         compression_scheduler.on_minibatch_end(epoch)
 """
 
+import atexit
 import copy
-import fnmatch
+import hashlib
 import logging
 import operator
 import os
 import sys
+import tempfile
 import time
 import traceback
 from collections import OrderedDict
@@ -107,7 +109,9 @@ import parsecmd
 import sample
 from losses.multiboxloss import MultiBoxLoss
 from nas import parse_nas_yaml
-from utils import object_detection_utils, parse_obj_detection_yaml
+from utils import (checkpoint_cache, checkpoint_writer, data_memory, distributed, kernel_memory,
+                   latency, meters, mixed_precision, object_detection_utils,
+                   parse_obj_detection_yaml, prefetcher, profiling, registry, streaming)
 
 # from range_linear_ai84 import PostTrainLinearQuantizerAI84
 
@@ -130,41 +134,18 @@ def main():
     script_dir = os.path.dirname(__file__)
     global msglogger  # pylint: disable=global-statement
 
-    supported_models = []
-    supported_sources = []
-    model_names = []
-    dataset_names = []
-
-    # Dynamically load models
-    for _, _, files in sorted(os.walk('models')):
-        for name in sorted(files):
-            if fnmatch.fnmatch(name, '*.py'):
-                fn = 'models.' + name[:-3]
-                m = locate(fn)
-                try:
-                    for i in m.models:
-                        i['module'] = fn
-                    supported_models += m.models
-                    model_names += [item['name'] for item in m.models]
-                except AttributeError:
-                    # Skip files that don't have 'models' or 'models.name'
-                    pass
-
-    # Dynamically load datasets
-    for _, _, files in sorted(os.walk('datasets')):
-        for name in sorted(files):
-            if fnmatch.fnmatch(name, '*.py'):
-                ds = locate('datasets.' + name[:-3])
-                try:
-                    supported_sources += ds.datasets
-                    dataset_names += [item['name'] for item in ds.datasets]
-                except AttributeError:
-                    # Skip files that don't have 'datasets' or 'datasets.name'
-                    pass
+    # Dynamically load models and datasets
+    supported_models = registry.load_models()
+    supported_sources = registry.load_datasets()
+    model_names = [item['name'] for item in supported_models]
+    dataset_names = [item['name'] for item in supported_sources]
 
     # Parse arguments
     args = parsecmd.get_parser(model_names, dataset_names).parse_args()
 
+    # Join the process group when started with torchrun
+    distributed.init(args)
+
     # Set hardware device
     ai8x.set_device(args.device, args.act_mode_8bit, args.avg_pool_rounding)
 
@@ -191,13 +172,17 @@ def main():
         print('WARNING: Cannot save sample in training mode, ignoring --save-sample option. '
               'Use with --evaluate instead.')
 
-    msglogger = apputils.config_pylogger(os.path.join(script_dir, 'logging.conf'), args.name,
-                                         args.output_dir)
+    if distributed.is_main(args):
+        msglogger = apputils.config_pylogger(os.path.join(script_dir, 'logging.conf'),
+                                             args.name, args.output_dir)
 
-    # Log various details about the execution environment.  It is sometimes useful
-    # to refer to past experiment executions and this information may be useful.
-    apputils.log_execution_env_state(args.compress, msglogger.logdir)
-    msglogger.debug("Distiller: %s", distiller.__version__)
+        # Log various details about the execution environment.  It is sometimes useful
+        # to refer to past experiment executions and this information may be useful.
+        apputils.log_execution_env_state(args.compress, msglogger.logdir)
+        msglogger.debug("Distiller: %s", distiller.__version__)
+    else:
+        # Only the main process logs and saves checkpoints
+        msglogger = distributed.quiet_logger(args)
 
     start_epoch = 0
     ending_epoch = args.epochs
@@ -226,7 +211,10 @@ def main():
         args.gpus = -1
     else:
         args.device = 'cuda'
-        if args.gpus is not None:
+        if args.distributed:
+            # Each process uses the GPU selected by its local rank
+            args.gpus = [args.local_rank]
+        elif args.gpus is not None:
             try:
                 args.gpus = [int(s) for s in args.gpus.split(',')]
             except ValueError as exc:
@@ -278,7 +266,38 @@ def main():
         raise ValueError('ERROR: Argument --embedding cannot be used with regression '
                          'or object detection')
 
+    if args.jit and (args.nas or args.obj_detection or args.kd_teacher or args.kernel_stats
+                     or args.activation_stats or args.quantize_eval):
+        raise ValueError('ERROR: Argument --jit cannot be used with NAS, object detection, '
+                         'knowledge distillation, activation or kernel statistics, '
+                         'or --quantize-eval')
+
+    if args.integer_inference and (not args.act_mode_8bit or not args.evaluate
+                                   or args.quantize_eval or args.jit):
+        raise ValueError('ERROR: Argument --integer-inference requires --8-bit-mode and '
+                         '--evaluate, and cannot be used with --quantize-eval or --jit')
+
+    if args.streaming_rows and (not args.evaluate or args.jit or args.obj_detection):
+        raise ValueError('ERROR: Argument --streaming-rows requires --evaluate, and cannot be '
+                         'used with --jit or object detection')
+
+    if args.amp and (args.device != 'cuda' or args.jit):
+        raise ValueError('ERROR: Argument --amp requires CUDA and cannot be used with --jit')
+
+    if args.accumulate_steps < 1:
+        raise ValueError('ERROR: Argument --accumulate-steps must be at least 1')
+
+    if args.activation_checkpointing and args.jit:
+        raise ValueError('ERROR: Argument --activation-checkpointing cannot be used with --jit')
+
+    if args.profile_trace and not args.profile:
+        raise ValueError('ERROR: Argument --profile-trace requires --profile')
+
     model = create_model(supported_models, dimensions, args)
+    if args.activation_checkpointing \
+       and not ai8x.set_activation_checkpointing(model, True):
+        msglogger.warning('WARNING: The model has no blocks that support '
+                          '--activation-checkpointing')
 
     # if args.add_logsoftmax:
     #     model = nn.Sequential(model, nn.LogSoftmax(dim=1))
@@ -290,7 +309,7 @@ def main():
     # that can be read by Google's Tensor Board.  PythonLogger writes to the Python logger.
     pylogger = PythonLogger(msglogger, log_1d=True)
     all_loggers = [pylogger]
-    if args.tblog:
+    if args.tblog and distributed.is_main(args):
         tflogger = TensorBoardLogger(msglogger.logdir, log_1d=True, comment='_'+args.dataset)
 
         tflogger.tblogger.writer.add_text('Command line', str(args))
@@ -326,31 +345,36 @@ def main():
     # We can optionally resume from a checkpoint
     optimizer = None
     if args.resumed_checkpoint_path:
-        update_old_model_params(args.resumed_checkpoint_path, model)
+        checkpoint_path = update_old_model_params(args.resumed_checkpoint_path, model)
         if qat_policy is not None:
-            checkpoint = torch.load(args.resumed_checkpoint_path,
-                                    map_location=lambda storage, loc: storage)
+            checkpoint = checkpoint_cache.metadata(checkpoint_path)
             # pylint: disable=unsubscriptable-object
             if checkpoint.get('epoch', None) >= qat_policy['start_epoch']:
                 ai8x.fuse_bn_layers(model)
             # pylint: enable=unsubscriptable-object
         model, compression_scheduler, optimizer, start_epoch = apputils.load_checkpoint(
-            model, args.resumed_checkpoint_path, model_device=args.device)
+            model, checkpoint_path, model_device=args.device)
         ai8x.update_model(model)
     elif args.load_model_path:
-        update_old_model_params(args.load_model_path, model)
+        checkpoint_path = update_old_model_params(args.load_model_path, model)
         if qat_policy is not None:
-            checkpoint = torch.load(args.load_model_path,
-                                    map_location=lambda storage, loc: storage)
+            checkpoint = checkpoint_cache.metadata(checkpoint_path)
             # pylint: disable=unsubscriptable-object
             if checkpoint.get('epoch', None) >= qat_policy['start_epoch']:
                 ai8x.fuse_bn_layers(model)
             # pylint: enable=unsubscriptable-object
-        model = apputils.load_lean_checkpoint(model, args.load_model_path,
+        model = apputils.load_lean_checkpoint(model, checkpoint_path,
                                               model_device=args.device)
         ai8x.update_model(model)
 
-    if not args.load_serialized and args.gpus != -1 and torch.cuda.device_count() > 1:
+    if qat_policy is not None and 'shift_update_interval' in qat_policy:
+        # The interval is not stored in the checkpoint, so re-apply it when resuming QAT
+        ai8x.set_shift_update_interval(model, qat_policy['shift_update_interval'])
+
+    # In distributed mode, the model is wrapped with DistributedDataParallel when it is prepared
+    # for training (see create_jit_model())
+    if not args.load_serialized and not args.distributed and args.gpus != -1 \
+       and torch.cuda.device_count() > 1:
         model = torch.nn.DataParallel(model, device_ids=args.gpus).to(args.device)
 
     if args.reset_optimizer:
@@ -365,8 +389,7 @@ def main():
 
         # .module is added to model for access in multi GPU environments
         # as https://github.com/pytorch/pytorch/issues/16885 has not been merged yet
-        if isinstance(model, nn.DataParallel):
-            model = model.module
+        model = distributed.unwrap(model)
 
         criterion = MultiBoxLoss(priors_cxcy=model.priors_cxcy,
                                  alpha=obj_detection_params['multi_box_loss']['alpha'],
@@ -391,7 +414,8 @@ def main():
     # This sample application can be invoked to produce various summary reports.
     if args.summary:
         return summarize_model(model, args.dataset, which_summary=args.summary,
-                               filename=args.summary_filename)
+                               filename=args.summary_filename, qat_policy=qat_policy,
+                               dimensions=dimensions)
 
     activations_collectors = create_activation_stats_collectors(model, *args.activation_stats)
 
@@ -403,12 +427,23 @@ def main():
         collate_fn=args.collate_fn, cpu=args.device == 'cpu')
     msglogger.info('Dataset sizes:\n\ttraining=%d\n\tvalidation=%d\n\ttest=%d',
                    len(train_loader.sampler), len(val_loader.sampler), len(test_loader.sampler))
+    train_loader = distributed.shard_loader(train_loader, args, shuffle=True)
+    val_loader = distributed.shard_loader(val_loader, args, shuffle=False, pad=False)
+    test_loader = distributed.shard_loader(test_loader, args, shuffle=False, pad=False)
 
     if args.sensitivity is not None:
         sensitivities = np.arange(args.sensitivity_range[0], args.sensitivity_range[1],
                                   args.sensitivity_range[2])
         return sensitivity_analysis(model, criterion, test_loader, pylogger, args, sensitivities)
 
+    if args.mixed_precision is not None:
+        if qat_policy is None:
+            raise ValueError('ERROR: Argument --mixed-precision requires a QAT policy')
+        if args.obj_detection:
+            raise ValueError('ERROR: Argument --mixed-precision cannot be used with object '
+                             'detection')
+        return mixed_precision.search(model, criterion, val_loader, qat_policy, args)
+
     if args.evaluate:
         return evaluate_model(model, criterion, test_loader, pylogger, activations_collectors,
                               args, compression_scheduler)
@@ -484,6 +519,17 @@ def main():
                                                               args.epochs)
                 create_nas_kd_policy(model, compression_scheduler, start_epoch, kd_end_epoch, args)
 
+    jit_model = create_jit_model(model, args)
+    # The students must run through the (distributed) training model
+    if args.kd_policy is not None:
+        args.kd_policy.student = jit_model
+    if getattr(args, 'nas_kd_policy', None) is not None:
+        args.nas_kd_policy.student = jit_model
+    writer = checkpoint_writer.CheckpointWriter(keep=args.keep_checkpoints)
+    scaler = torch.cuda.amp.GradScaler(enabled=args.amp)
+    args.profiler = profiling.Profiler(args.profile, args.device, logdir=msglogger.logdir,
+                                       trace_steps=args.profile_trace)
+
     vloss = 10**6
     for epoch in range(start_epoch, ending_epoch):
         # pylint: disable=unsubscriptable-object
@@ -497,6 +543,13 @@ def main():
             # Model is re-transferred to GPU in case parameters were added
             model.to(args.device)
 
+            # The TorchScript model depends on the quantization configuration
+            jit_model = create_jit_model(model, args)
+            if args.kd_policy is not None:
+                args.kd_policy.student = jit_model
+            if getattr(args, 'nas_kd_policy', None) is not None:
+                args.nas_kd_policy.student = jit_model
+
             # Empty the performance scores list for QAT operation
             perf_scores_history = []
             if args.name:
@@ -507,13 +560,16 @@ def main():
 
         # This is the main training loop.
         msglogger.info('\n')
+        args.profiler.reset()
         if compression_scheduler:
-            compression_scheduler.on_epoch_begin(epoch, metrics=vloss)
+            with args.profiler.phase('scheduler'):
+                compression_scheduler.on_epoch_begin(epoch, metrics=vloss)
 
         # Train for one epoch
+        distributed.set_epoch(train_loader, epoch)
         with collectors_context(activations_collectors["train"]) as collectors:
-            train(train_loader, model, criterion, optimizer, epoch, compression_scheduler,
-                  loggers=all_loggers, args=args)
+            train(train_loader, jit_model, criterion, optimizer, epoch, compression_scheduler,
+                  loggers=all_loggers, args=args, scaler=scaler)
             # distiller.log_weights_sparsity(model, epoch, loggers=all_loggers)
             distiller.log_activation_statistics(epoch, "train", loggers=all_tbloggers,
                                                 collector=collectors["sparsity"])
@@ -532,15 +588,17 @@ def main():
 
             # run pre validation steps if NAS is running
             if run_nas_validation:
-                update_bn_stats(train_loader, model, args)
+                with args.profiler.phase('nas'):
+                    update_bn_stats(train_loader, model, args)
                 stage, level = get_nas_training_stage(epoch, args.nas_stage_transition_list)
                 if args.name:
                     checkpoint_name = f'{args.name}_nas_stg{stage}_lev{level}'
                 else:
                     checkpoint_name = f'nas_stg{stage}_lev{level}'
 
-            with collectors_context(activations_collectors["valid"]) as collectors:
-                top1, top5, vloss, mAP = validate(val_loader, model, criterion, [pylogger],
+            with collectors_context(activations_collectors["valid"]) as collectors, \
+                    args.profiler.phase('validation'):
+                top1, top5, vloss, mAP = validate(val_loader, jit_model, criterion, [pylogger],
                                                   args, epoch, tflogger)
                 distiller.log_activation_statistics(epoch, "valid", loggers=all_tbloggers,
                                                     collector=collectors["sparsity"])
@@ -578,22 +636,55 @@ def main():
                 checkpoint_extras = {'current_top1': top1,
                                      'current_mAP': mAP}
 
-            apputils.save_checkpoint(epoch, args.cnn, model, optimizer=optimizer,
-                                     scheduler=compression_scheduler, extras=checkpoint_extras,
-                                     is_best=is_best, name=checkpoint_name,
-                                     dir=msglogger.logdir)
+            if distributed.is_main(args):
+                with args.profiler.phase('checkpoint'):
+                    writer.save(epoch, args.cnn, model, optimizer=optimizer,
+                                scheduler=compression_scheduler, extras=checkpoint_extras,
+                                is_best=is_best, name=checkpoint_name, dir=msglogger.logdir)
 
         if compression_scheduler:
-            compression_scheduler.on_epoch_end(epoch, optimizer)
+            with args.profiler.phase('scheduler'):
+                compression_scheduler.on_epoch_end(epoch, optimizer)
+        args.profiler.report(epoch)
+
+    writer.close()
 
     # Finally run results on the test set
-    test(test_loader, model, criterion, [pylogger], activations_collectors, args=args)
+    test(test_loader, jit_model, criterion, [pylogger], activations_collectors, args=args)
     return None
 
 
 OVERALL_LOSS_KEY = 'Overall Loss'
 OBJECTIVE_LOSS_KEY = 'Objective Loss'
 
+# Increment when update_old_model_params() changes, to invalidate migrated checkpoints
+MIGRATION_VERSION = 1
+
+
+def create_jit_model(model, args):
+    """
+    Return the TorchScript version of `model` when --jit is set, otherwise `model`.
+    The scripted model shares the parameters with `model`, which is used for checkpoints.
+    In distributed mode, the result is wrapped with DistributedDataParallel; since the
+    wrapper registers the parameters when it is created, it must be recreated whenever the
+    model's parameters change (e.g., when QAT starts).
+    """
+    if not args.jit:
+        return distributed.wrap(model, args)
+
+    module = model.module if isinstance(model, nn.DataParallel) else model
+    try:
+        jit_model = ai8x.jit_script(module)
+    except (AssertionError, RuntimeError, torch.jit.frontend.NotSupportedError) as exc:
+        msglogger.warning('WARNING: The model cannot be compiled with TorchScript, '
+                          'continuing without --jit:\n%s', exc)
+        return distributed.wrap(model, args)
+    msglogger.info('Compiled the model with TorchScript')
+
+    if isinstance(model, nn.DataParallel):
+        jit_model = nn.DataParallel(jit_model, device_ids=model.device_ids)
+    return distributed.wrap(jit_model, args)
+
 
 def create_model(supported_models, dimensions, args):
     """Create the model"""
@@ -657,7 +748,7 @@ def create_optimizer(model, args):
 
 def create_nas_kd_policy(model, compression_scheduler, epoch, next_state_start_epoch, args):
     """Create knowledge distillation policy for nas"""
-    teacher = copy.deepcopy(model)
+    teacher = copy.deepcopy(distributed.unwrap(model))
     dlw = distiller.DistillationLossWeights(args.nas_kd_params['distill_loss'],
                                             args.nas_kd_params['student_loss'], 0)
     args.nas_kd_policy = distiller.KnowledgeDistillationPolicy(model, teacher,
@@ -674,13 +765,19 @@ def create_nas_kd_policy(model, compression_scheduler, epoch, next_state_start_e
 
 
 def train(train_loader, model, criterion, optimizer, epoch,
-          compression_scheduler, loggers, args):
-    """Training loop for one epoch."""
-    losses = OrderedDict([(OVERALL_LOSS_KEY, tnt.AverageValueMeter()),
-                          (OBJECTIVE_LOSS_KEY, tnt.AverageValueMeter())])
+          compression_scheduler, loggers, args, scaler=None):
+    """Training loop for one epoch. With `args.amp`, the forward pass runs under autocast
+    and `scaler` (a GradScaler) scales the loss. With `args.accumulate_steps` N > 1, the
+    gradients of N mini-batches are accumulated before each optimizer step; the compression
+    scheduler and NAS sampling see one step per N mini-batches."""
+    if scaler is None:
+        scaler = torch.cuda.amp.GradScaler(enabled=False)
+    # Losses and accuracy are accumulated on the device and only read when they are logged
+    losses = OrderedDict([(OVERALL_LOSS_KEY, meters.TensorAverageMeter()),
+                          (OBJECTIVE_LOSS_KEY, meters.TensorAverageMeter())])
 
     if not args.regression:
-        classerr = tnt.ClassErrorMeter(accuracy=True, topk=(1, min(args.num_classes, 5)))
+        classerr = meters.TensorClassErrorMeter(topk=(1, min(args.num_classes, 5)))
     else:
         classerr = tnt.MSEMeter()
     batch_time = tnt.AverageValueMeter()
@@ -700,6 +797,11 @@ def train(train_loader, model, criterion, optimizer, epoch,
     batch_size = train_loader.batch_size
     steps_per_epoch = (total_samples + batch_size - 1) // batch_size
     msglogger.info('Training epoch: %d samples (%d per mini-batch)', total_samples, batch_size)
+    accumulate_steps = args.accumulate_steps
+    optimizer_steps_per_epoch = (steps_per_epoch + accumulate_steps - 1) // accumulate_steps
+    if accumulate_steps > 1:
+        msglogger.info('Accumulating gradients over %d mini-batches (%d samples per step)',
+                       accumulate_steps, accumulate_steps * batch_size)
 
     if args.nas:
         if args.nas_stage_transition_list is not None:
@@ -725,48 +827,68 @@ def train(train_loader, model, criterion, optimizer, epoch,
     # Switch to train mode
     model.train()
     acc_stats = []
+    # With --profile, each phase of the training step is recorded as a lap
+    profiler = args.profiler
+    profiler.attach(model)
+    profiler.restart()
     end = time.time()
-    for train_step, (inputs, target) in enumerate(train_loader):
-        # Measure data loading time
+    # The prefetcher copies the next batch to the device while the current one is processed
+    for train_step, (inputs, target) in enumerate(
+            prefetcher.DevicePrefetcher(train_loader, args.device, profiler)):
+        # Measure the data loading time that was not hidden by prefetching
         data_time.add(time.time() - end)
+        profiler.lap('data')
 
         if args.obj_detection:
             boxes_list = [elem[0] for elem in target]
             labels_list = [elem[1] for elem in target]
-
-            inputs = inputs.to(args.device)
-            boxes_list = [boxes.to(args.device) for boxes in boxes_list]
-            labels_list = [labels.to(args.device) for labels in labels_list]
-
             target = (boxes_list, labels_list)
-        else:
-            inputs, target = inputs.to(args.device), target.to(args.device)
 
-        # Set nas parameters if necessary
-        if args.nas:
-            if stage == 1:
-                ai8x_nas.sample_subnet_kernel(model, level)
-            elif stage == 2:
-                ai8x_nas.sample_subnet_depth(model, level)
-            elif stage == 3:
-                ai8x_nas.sample_subnet_width(model, level)
+        # Gradient accumulation: the optimizer steps after the last mini-batch of each group
+        optimizer_step = train_step // accumulate_steps
+        first_in_step = train_step % accumulate_steps == 0
+        group_size = min(accumulate_steps, steps_per_epoch - optimizer_step * accumulate_steps)
+        last_in_step = train_step % accumulate_steps == group_size - 1
+        # Only all-reduce the gradients in the backward pass of the last mini-batch
+        distributed.set_grad_sync(model, last_in_step)
+
+        if first_in_step:
+            # Set nas parameters if necessary (one sub-network per optimizer step)
+            if args.nas:
+                if args.distributed:
+                    # All processes must sample the same sub-network
+                    distributed.sync_random(args, epoch, optimizer_step)
+                if stage == 1:
+                    ai8x_nas.sample_subnet_kernel(model, level)
+                elif stage == 2:
+                    ai8x_nas.sample_subnet_depth(model, level)
+                elif stage == 3:
+                    ai8x_nas.sample_subnet_width(model, level)
+                profiler.lap('nas')
+
+            if compression_scheduler:
+                compression_scheduler.on_minibatch_begin(epoch, optimizer_step,
+                                                         optimizer_steps_per_epoch, optimizer)
+                profiler.lap('scheduler')
 
         # Execute the forward phase, compute the output and measure loss
-        if compression_scheduler:
-            compression_scheduler.on_minibatch_begin(epoch, train_step, steps_per_epoch, optimizer)
 
-        if not hasattr(args, 'kd_policy') or args.kd_policy is None:
-            if not hasattr(args, 'nas_kd_policy') or args.nas_kd_policy is None:
-                output = model(inputs)
+        # ai8x layers keep quantization, output shift and clamping in fp32 under autocast
+        with torch.cuda.amp.autocast(enabled=args.amp):
+            if not hasattr(args, 'kd_policy') or args.kd_policy is None:
+                if not hasattr(args, 'nas_kd_policy') or args.nas_kd_policy is None:
+                    output = model(inputs)
+                else:
+                    output = args.nas_kd_policy.forward(inputs)
             else:
-                output = args.nas_kd_policy.forward(inputs)
-        else:
-            output = args.kd_policy.forward(inputs)
+                output = args.kd_policy.forward(inputs)
 
-        if args.out_fold_ratio != 1:
-            output = ai8x.unfold_batch(output, args.out_fold_ratio)
+            if args.out_fold_ratio != 1:
+                output = ai8x.unfold_batch(output, args.out_fold_ratio)
+            profiler.lap('forward')
 
-        loss = criterion(output, target)
+            loss = criterion(output, target)
+        profiler.lap('loss')
         # TODO Early exit mechanism for Object Detection case is NOT implemented yet
         if not args.obj_detection:
             if not args.earlyexit_lossweights:
@@ -790,45 +912,61 @@ def train(train_loader, model, criterion, optimizer, epoch,
             else:
                 # Measure accuracy and record loss
                 loss = earlyexit_loss(output, target, criterion, args)
+        profiler.lap('metrics')
 
         # Record loss
-        losses[OBJECTIVE_LOSS_KEY].add(loss.item())
+        losses[OBJECTIVE_LOSS_KEY].add(loss)
 
         if compression_scheduler:
             # Before running the backward phase, we allow the scheduler to modify the loss
             # (e.g. add regularization loss)
-            agg_loss = compression_scheduler.before_backward_pass(epoch, train_step,
-                                                                  steps_per_epoch, loss,
-                                                                  optimizer=optimizer,
+            agg_loss = compression_scheduler.before_backward_pass(epoch, optimizer_step,
+                                                                  optimizer_steps_per_epoch,
+                                                                  loss, optimizer=optimizer,
                                                                   return_loss_components=True)
             loss = agg_loss.overall_loss
-            losses[OVERALL_LOSS_KEY].add(loss.item())
+            losses[OVERALL_LOSS_KEY].add(loss)
 
             for lc in agg_loss.loss_components:
                 if lc.name not in losses:
-                    losses[lc.name] = tnt.AverageValueMeter()
-                losses[lc.name].add(lc.value.item())
+                    losses[lc.name] = meters.TensorAverageMeter()
+                losses[lc.name].add(lc.value)
+            profiler.lap('scheduler')
         else:
-            losses[OVERALL_LOSS_KEY].add(loss.item())
+            losses[OVERALL_LOSS_KEY].add(loss)
+            profiler.lap('metrics')
 
         # Compute the gradient and do SGD step
-        optimizer.zero_grad()
-        loss.backward()
-        if compression_scheduler:
-            compression_scheduler.before_parameter_optimization(epoch, train_step,
-                                                                steps_per_epoch, optimizer)
-        optimizer.step()
-        if compression_scheduler:
-            compression_scheduler.on_minibatch_end(epoch, train_step, steps_per_epoch, optimizer)
-
-        # Reset elastic sampling wrt NAS stage if necessary
-        if args.nas:
-            if stage == 1:
-                ai8x_nas.reset_kernel_sampling(model)
-            elif stage == 2:
-                ai8x_nas.reset_depth_sampling(model)
-            elif stage == 3:
-                ai8x_nas.reset_width_sampling(model)
+        if first_in_step:
+            optimizer.zero_grad()
+        # The accumulated gradient is the mean over the mini-batches of the optimizer step
+        scaler.scale(loss / group_size if group_size > 1 else loss).backward()
+        profiler.lap('backward')
+        if last_in_step:
+            if compression_scheduler:
+                # The scheduler (e.g., pruning masks) operates on the unscaled gradients
+                scaler.unscale_(optimizer)
+                compression_scheduler.before_parameter_optimization(epoch, optimizer_step,
+                                                                    optimizer_steps_per_epoch,
+                                                                    optimizer)
+                profiler.lap('scheduler')
+            scaler.step(optimizer)
+            scaler.update()
+            profiler.lap('optimizer')
+            if compression_scheduler:
+                compression_scheduler.on_minibatch_end(epoch, optimizer_step,
+                                                       optimizer_steps_per_epoch, optimizer)
+                profiler.lap('scheduler')
+
+            # Reset elastic sampling wrt NAS stage if necessary
+            if args.nas:
+                if stage == 1:
+                    ai8x_nas.reset_kernel_sampling(model)
+                elif stage == 2:
+                    ai8x_nas.reset_depth_sampling(model)
+                elif stage == 3:
+                    ai8x_nas.reset_width_sampling(model)
+                profiler.lap('nas')
 
         # measure elapsed time
         batch_time.add(time.time() - end)
@@ -840,15 +978,15 @@ def train(train_loader, model, criterion, optimizer, epoch,
             if not args.earlyexit_lossweights:
                 if not args.regression:
                     if classerr.n != 0:
-                        errs['Top1'] = classerr.value(1)
+                        errs['Top1'] = float(classerr.value(1))
                         if args.num_classes > 5:
-                            errs['Top5'] = classerr.value(5)
+                            errs['Top5'] = float(classerr.value(5))
                     else:
                         errs['Top1'] = None
                         errs['Top5'] = None
                 else:
                     if classerr.n != 0:
-                        errs['MSE'] = classerr.value()
+                        errs['MSE'] = float(classerr.value())
                     else:
                         errs['MSE'] = None
             else:
@@ -871,6 +1009,7 @@ def train(train_loader, model, criterion, optimizer, epoch,
                     stats_dict['NAS-Level'] = level
             stats_dict['LR'] = optimizer.param_groups[0]['lr']
             stats_dict['Time'] = batch_time.mean
+            stats_dict['Data'] = data_time.mean
             stats = ('Performance/Training/', stats_dict)
 
             params = model.named_parameters() if args.log_params_histograms else None
@@ -879,8 +1018,11 @@ def train(train_loader, model, criterion, optimizer, epoch,
                                             epoch, steps_completed,
                                             steps_per_epoch, args.print_freq,
                                             loggers)
+        profiler.lap('logging')
+        profiler.step()
         end = time.time()
-    return acc_stats
+    profiler.detach()
+    return [[float(value) for value in values] for values in acc_stats]
 
 
 def update_bn_stats(train_loader, model, args):
@@ -1018,6 +1160,7 @@ def _validate(data_loader, model, criterion, loggers, args, epoch=-1, tflogger=N
     msglogger.info('%d samples (%d per mini-batch)', total_samples, batch_size)
 
     # Switch to evaluation mode
+    model = distributed.evaluation_model(model, args)
     model.eval()
 
     end = time.time()
@@ -1029,7 +1172,8 @@ def _validate(data_loader, model, criterion, loggers, args, epoch=-1, tflogger=N
     obj_detection_params = parse_obj_detection_yaml.parse(args.obj_detection_params) \
         if args.obj_detection_params else None
 
-    for validation_step, (inputs, target) in enumerate(data_loader):
+    for validation_step, (inputs, target) in enumerate(prefetcher.DevicePrefetcher(data_loader,
+                                                                                   args.device)):
 
         with torch.no_grad():
 
@@ -1046,11 +1190,6 @@ def _validate(data_loader, model, criterion, loggers, args, epoch=-1, tflogger=N
                 for label_objects in labels_list:
                     difficulties.append(torch.zeros_like(label_objects))
 
-                inputs = inputs.to(args.device)
-                boxes_list = [boxes.to(args.device) for boxes in boxes_list]
-                labels_list = [labels.to(args.device) for labels in labels_list]
-                difficulties = [d.to(args.device) for d in difficulties]
-
                 target = (boxes_list, labels_list)
 
                 # compute output from model
@@ -1070,8 +1209,7 @@ def _validate(data_loader, model, criterion, loggers, args, epoch=-1, tflogger=N
 
                 # .module is added to model for access in multi GPU environments
                 # as https://github.com/pytorch/pytorch/issues/16885 has not been merged yet
-                if isinstance(model, nn.DataParallel):
-                    model = model.module
+                model = distributed.unwrap(model)
 
                 det_boxes_batch, det_labels_batch, det_scores_batch = \
                     model.detect_objects(output_boxes, output_conf,
@@ -1087,7 +1225,6 @@ def _validate(data_loader, model, criterion, loggers, args, epoch=-1, tflogger=N
                     detection_metrics['mAP'].add(mAP)
 
             else:
-                inputs, target = inputs.to(args.device), target.to(args.device)
                 # compute output from model
                 output = model(inputs)
                 if args.out_fold_ratio != 1:
@@ -1228,6 +1365,15 @@ def _validate(data_loader, model, criterion, loggers, args, epoch=-1, tflogger=N
         f_x.close()
 
     if not args.earlyexit_thresholds:
+        # Combine the results of all processes
+        reduced_meters = [losses['objective_loss']]
+        if args.obj_detection:
+            reduced_meters.append(detection_metrics['mAP'])
+        else:
+            reduced_meters.append(classerr)
+            if args.display_confusion:
+                reduced_meters.append(confusion)
+        distributed.all_reduce_meters(reduced_meters, args)
 
         if args.obj_detection:
 
@@ -1456,8 +1602,16 @@ def evaluate_model(model, criterion, test_loader, loggers, activations_collector
         quantizer.prepare_model()
         model.to(args.device)
 
-    top1, _, _, mAP = test(test_loader, model, criterion, loggers, activations_collectors,
-                           args=args)
+    if args.integer_inference:
+        model = ai8x.integer_inference_prep(model)
+
+    if args.streaming_rows:
+        plan = streaming.StreamingPlan(model, args.dimensions)
+        msglogger.info('Streaming plan:\n%s', plan)
+        model = streaming.StreamingModel(model, plan, args.streaming_rows)
+
+    top1, _, _, mAP = test(test_loader, create_jit_model(model, args), criterion, loggers,
+                           activations_collectors, args=args)
 
     if args.shap > 0:
         matplotlib.use('TkAgg')
@@ -1498,9 +1652,18 @@ def evaluate_model(model, criterion, test_loader, loggers, activations_collector
                                  dir=msglogger.logdir, extras=extras)
 
 
-def summarize_model(model, dataset, which_summary, filename='model'):
+def summarize_model(model, dataset, which_summary, filename='model', qat_policy=None,
+                    dimensions=None):
     """summarize_model"""
-    if which_summary.startswith('png'):
+    if which_summary == 'kernel_memory':
+        print(kernel_memory.KernelMemoryLayout(model, qat_policy))
+    elif which_summary == 'data_memory':
+        print(data_memory.DataMemoryPlan(model, dimensions))
+    elif which_summary == 'latency':
+        print(latency.LatencyEstimate(model, dimensions))
+    elif which_summary == 'streaming':
+        print(streaming.StreamingPlan(model, dimensions))
+    elif which_summary.startswith('png'):
         model_summaries.draw_img_classifier_to_file(model, filename + '.png', dataset,
                                                     which_summary == 'png_w_params')
     elif which_summary in ['onnx', 'onnx_simplified']:
@@ -1673,34 +1836,49 @@ def check_pytorch_version():
 
 
 def update_old_model_params(model_path, model_new):
-    """Adds missing model parameters added with default values.
+    """Adds missing model parameters with default values.
     This is mainly due to the saved checkpoint is from previous versions of the repo.
-    New model is saved to `model_path` and the old model copied into the same file_path with
-    `__obsolete__` prefix."""
-    is_model_old = False
-    model_old = torch.load(model_path,
-                           map_location=lambda storage, loc: storage)
+    Returns the path of the checkpoint to load: `model_path` when no parameters are missing
+    (this is checked without loading the tensors), otherwise the patched checkpoint, saved to
+    the checkpoint cache directory (keyed by the checkpoint hash and the migration version,
+    so that later runs skip the migration) or to a temporary file. The file at `model_path`
+    is never modified."""
+    new_state_dict = model_new.state_dict()
+    old_keys = {k[7:] if k.startswith('module.') else k
+                for k in checkpoint_cache.metadata(model_path)['state_dict']}
+    if all(k in old_keys or 'bn' in k for k in new_state_dict):
+        return model_path
+
+    tag = f'migrated{MIGRATION_VERSION}-' + \
+        hashlib.sha256('\n'.join(new_state_dict).encode()).hexdigest()[:16]
+    migrated_path = checkpoint_cache.derived_path(model_path, tag)
+    if os.path.isfile(migrated_path):
+        msglogger.info('Model `%s` is old. Using the migrated checkpoint `%s`',
+                       model_path, migrated_path)
+        return migrated_path
+
+    model_old = torch.load(model_path, map_location=lambda storage, loc: storage)
     # Fix up any instances of DataParallel
     old_dict = model_old['state_dict'].copy()
     for k in old_dict:
         if k.startswith('module.'):
             model_old['state_dict'][k[7:]] = old_dict[k]
-    for new_key, new_val in model_new.state_dict().items():
+    for new_key, new_val in new_state_dict.items():
         if new_key not in model_old['state_dict'] and 'bn' not in new_key:
-            is_model_old = True
-            model_old['state_dict'][new_key] = new_val
+            model_old['state_dict'][new_key] = new_val.detach().cpu()
             if 'compression_sched' in model_old:
                 if 'masks_dict' in model_old['compression_sched']:
                     model_old['compression_sched']['masks_dict'][new_key] = None
 
-    if is_model_old:
-        dir_path, file_name = os.path.split(model_path)
-        new_file_name = '__obsolete__' + file_name
-        old_model_path = os.path.join(dir_path, new_file_name)
-        os.rename(model_path, old_model_path)
-        torch.save(model_old, model_path)
-        msglogger.info('Model `%s` is old. Missing parameters added with default values!',
-                       model_path)
+    saved_path = checkpoint_cache.save_derived(model_path, tag, model_old)
+    if saved_path is None:
+        handle, saved_path = tempfile.mkstemp(suffix='.pth.tar')
+        os.close(handle)
+        atexit.register(os.remove, saved_path)
+        torch.save(model_old, saved_path)
+    msglogger.info('Model `%s` is old. Missing parameters added with default values '
+                   '(saved to `%s`)', model_path, saved_path)
+    return saved_path
 
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Timing, JSON storage and regression comparison for the benchmark scripts
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import torch
+
+
+def measure(function, repeat=10, warmup=2, setup=None):
+    """
+    Call `function` `warmup` times, then time `repeat` calls. When given, `setup` is called
+    before each call, outside of the timing. Returns the statistics in milliseconds.
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        function()
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(1000. * (time.perf_counter() - start))
+    return statistics(times)
+
+
+def statistics(times):
+    """
+    Return the mean, standard deviation, minimum and median of the list `times`.
+    """
+    mean = sum(times) / len(times)
+    ordered = sorted(times)
+    return {
+        'mean': mean,
+        'std': math.sqrt(sum((t - mean) ** 2 for t in times) / len(times)),
+        'min': ordered[0],
+        'median': ordered[len(ordered) // 2],
+        'runs': len(times),
+    }
+
+
+def environment():
+    """
+    Return a description of the code version and the machine, stored with the results.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, check=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'threads': torch.get_num_threads(),
+    }
+
+
+def save(path, results, **settings):
+    """
+    Save `results` (a dict of dicts), the `settings` and the environment to `path`.
+    """
+    with open(path, mode='w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'settings': settings, 'results': results},
+                  f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline_path, metrics, threshold=0.1, higher_is_better=False):
+    """
+    Compare the `metrics` (keys of the result entries, whose values are numbers or dicts
+    with a 'mean') of `results` with the results saved at `baseline_path`. Prints a table
+    and returns the list of (name, metric, change) where the result is worse than the
+    baseline by more than `threshold` (a fraction).
+    """
+    with open(baseline_path, mode='r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+
+    def _value(entry, metric):
+        value = entry.get(metric)
+        if isinstance(value, dict):
+            value = value.get('mean')
+        return value
+
+    regressions = []
+    print(f'\n{"Benchmark":<60} {"Metric":<14} {"Baseline":>10} {"Current":>10} {"Change":>8}')
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for metric in metrics:
+            old, new = _value(baseline[name], metric), _value(results[name], metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = ' !' if worse > threshold else ''
+            print(f'{name:<60} {metric:<14} {old:>10.3f} {new:>10.3f} '
+                  f'{100. * change:>+7.1f}%{flag}')
+            if worse > threshold:
+                regressions.append((name, metric, change))
+    return regressions
@@ -0,0 +1,101 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Read checkpoint metadata without loading tensors, and cache checkpoints derived from a file
+"""
+import hashlib
+import os
+import pickle
+import zipfile
+
+import torch
+
+# Directory for derived (for example, migrated) checkpoints, keyed by content hash
+CACHE_DIR = os.environ.get('AI8X_CHECKPOINT_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'ai8x-training',
+                                        'checkpoints'))
+
+_hashes = {}
+
+
+def _key(path):
+    """
+    Return the cache key of the checkpoint file `path`. The key changes when the file does.
+    """
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_mtime_ns, stat.st_size
+
+
+def file_hash(path):
+    """
+    Return the SHA-256 hex digest of the file at `path`. Digests are remembered until the
+    file changes.
+    """
+    key = _key(path)
+    if key not in _hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as stream:
+            for chunk in iter(lambda: stream.read(1 << 20), b''):
+                digest.update(chunk)
+        _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+
+def derived_path(path, tag):
+    """
+    Return the path in CACHE_DIR for a checkpoint derived from the file at `path`, where
+    `tag` identifies the derivation (for example, the migration code version).
+    """
+    return os.path.join(CACHE_DIR, f'{file_hash(path)[:32]}-{tag}.pth.tar')
+
+
+def save_derived(path, tag, checkpoint):
+    """
+    Save `checkpoint`, derived from the file at `path`, to derived_path(path, tag). The file
+    is written to a temporary name and renamed, so that concurrent runs never see a partial
+    file. Returns the path, or None when the cache directory is not writable.
+    """
+    target = derived_path(path, tag)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temp = f'{target}.{os.getpid()}.tmp'
+        torch.save(checkpoint, temp)
+        os.replace(temp, target)
+    except OSError:
+        return None
+    return target
+
+
+class _MetadataUnpickler(pickle.Unpickler):
+    """
+    Unpickler for the data.pkl record of a zip checkpoint that replaces all tensors with None
+    and never reads tensor storage.
+    """
+    def find_class(self, module, name):
+        if module == 'torch._utils' and name.startswith('_rebuild'):
+            return lambda *args, **kwargs: None
+        return super().find_class(module, name)
+
+    def persistent_load(self, pid):
+        return None
+
+
+def metadata(path):
+    """
+    Return the checkpoint at `path` with all tensors replaced by None, for reading keys such
+    as 'epoch', 'arch', 'extras' or the names in 'state_dict'. Only the object record of the
+    file is read. Checkpoints in the legacy (non-zip) format are loaded fully.
+    """
+    if not zipfile.is_zipfile(path):
+        return torch.load(path, map_location='cpu')
+
+    with zipfile.ZipFile(path) as archive:
+        record = next(name for name in archive.namelist() if name.endswith('/data.pkl'))
+        with archive.open(record) as stream:
+            return _MetadataUnpickler(stream).load()
@@ -0,0 +1,158 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Background checkpoint writer for the training loop
+"""
+import copy
+import glob
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+msglogger = logging.getLogger()
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints in the same format as distiller's apputils.save_checkpoint() on a
+    background thread. save() snapshots the model, optimizer and scheduler state to (pinned)
+    CPU memory and returns immediately; the file is written to a temporary name and renamed.
+    When `keep` is positive, a copy of the last `keep` checkpoints of each name is retained as
+    `<name>_checkpoint_epoch<N>.pth.tar`, in addition to the latest and the best checkpoint.
+    """
+    def __init__(self, keep=0):
+        self.keep = keep
+        self.pinned = torch.cuda.is_available()
+        self.buffers = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def snapshot(self, value, key=''):
+        """
+        Return a CPU copy of `value`, a tensor or a (nested) dict, list or tuple of tensors.
+        Containers keep their type, including OrderedDict, defaultdict and namedtuple.
+        Pinned buffers are reused between calls for state with the same `key`.
+        """
+        if torch.is_tensor(value):
+            if not self.pinned or value.device.type != 'cuda':
+                return value.detach().to('cpu', copy=True)
+            buffer = self.buffers.get(key)
+            if buffer is None or buffer.shape != value.shape or buffer.dtype != value.dtype:
+                buffer = torch.empty(value.shape, dtype=value.dtype, pin_memory=True)
+                self.buffers[key] = buffer
+            return buffer.copy_(value.detach(), non_blocking=True)
+        if isinstance(value, dict):
+            # A shallow copy keeps the dict type and attributes such as the default_factory
+            result = copy.copy(value)
+            for k, v in value.items():
+                result[k] = self.snapshot(v, f'{key}.{k}')
+            return result
+        if isinstance(value, (list, tuple)):
+            items = [self.snapshot(v, f'{key}.{i}') for i, v in enumerate(value)]
+            if isinstance(value, list):
+                return items
+            if hasattr(value, '_fields'):
+                return type(value)(*items)
+            return tuple(items)
+        return value
+
+    def save(self, epoch, arch, model, optimizer=None, scheduler=None, extras=None,
+             is_best=False, name=None, dir='.'):  # pylint: disable=redefined-builtin
+        """
+        Save a checkpoint, see distiller's apputils.save_checkpoint().
+        """
+        if not os.path.isdir(dir):
+            raise IOError(f'Checkpoint directory does not exist at {os.path.abspath(dir)}')
+        if extras is None:
+            extras = {}
+        if not isinstance(extras, dict):
+            raise TypeError('extras must be either a dict or None')
+
+        # The pinned buffers of the previous snapshot must not be overwritten before it is saved
+        self.flush()
+
+        prefix = 'checkpoint' if name is None else name + '_checkpoint'
+        fullpath = os.path.join(dir, prefix + '.pth.tar')
+        fullpath_best = os.path.join(dir, 'best.pth.tar' if name is None
+                                     else name + '_best.pth.tar')
+        msglogger.info('Saving checkpoint to: %s', fullpath)
+
+        checkpoint = {'epoch': epoch, 'state_dict': self.snapshot(model.state_dict(), 'model'),
+                      'arch': arch}
+        try:
+            checkpoint['is_parallel'] = model.is_parallel
+            checkpoint['dataset'] = model.dataset
+            if not arch:
+                checkpoint['arch'] = model.arch
+        except AttributeError:
+            pass
+        if optimizer is not None:
+            checkpoint['optimizer_state_dict'] = self.snapshot(optimizer.state_dict(), 'opt')
+            checkpoint['optimizer_type'] = type(optimizer)
+        if scheduler is not None:
+            checkpoint['compression_sched'] = self.snapshot(scheduler.state_dict(), 'sched')
+        if hasattr(model, 'thinning_recipes'):
+            checkpoint['thinning_recipes'] = model.thinning_recipes
+        if hasattr(model, 'quantizer_metadata'):
+            checkpoint['quantizer_metadata'] = model.quantizer_metadata
+        checkpoint['extras'] = extras
+
+        event = None
+        if self.pinned:
+            event = torch.cuda.Event()
+            event.record()
+
+        history = os.path.join(dir, f'{prefix}_epoch{epoch:04}.pth.tar') if self.keep > 0 \
+            else None
+        self.pending = self.executor.submit(self._write, checkpoint, event, fullpath,
+                                            fullpath_best if is_best else None, history)
+
+    @staticmethod
+    def _replace(source, target):
+        """
+        Copy `source` to `target` atomically.
+        """
+        temp = f'{target}.tmp'
+        shutil.copyfile(source, temp)
+        os.replace(temp, target)
+
+    def _write(self, checkpoint, event, fullpath, fullpath_best, history):
+        """
+        Write `checkpoint` to `fullpath`, and copy it to `fullpath_best` and `history`.
+        """
+        if event is not None:
+            event.synchronize()
+        temp = f'{fullpath}.tmp'
+        torch.save(checkpoint, temp)
+        os.replace(temp, fullpath)
+        if fullpath_best is not None:
+            self._replace(fullpath, fullpath_best)
+        if history is not None:
+            self._replace(fullpath, history)
+            pattern = history.rsplit('_epoch', 1)[0] + '_epoch[0-9]*.pth.tar'
+            for old in sorted(glob.glob(pattern))[:-self.keep]:
+                os.remove(old)
+
+    def flush(self):
+        """
+        Wait until the last checkpoint is written. Errors of the writer are raised here.
+        """
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        """
+        Flush the last checkpoint and stop the writer thread.
+        """
+        self.flush()
+        self.executor.shutdown()
@@ -0,0 +1,194 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Data memory (activation memory) estimates for models built from ai8x layers
+"""
+from collections import namedtuple
+
+import torch
+from torch import nn
+
+import ai8x
+import ai8x_nas
+
+# Data memory per processor, in bytes
+PROCESSOR_DATA_SIZE = {
+    84: 2 * 1024,
+    85: 8 * 1024,
+    87: 20 * 1024,
+}
+
+DataMemoryLayer = namedtuple('DataMemoryLayer', ['name', 'input_shapes', 'output_shape',
+                                                 'output_bytes', 'live', 'live_bytes'])
+
+
+def input_shape(dimensions):
+    """
+    Return the shape of a single sample with `dimensions` (channels, dim1, dim2), where
+    dim2 == 1 selects a 1D input (see train.py).
+    """
+    dimensions = tuple(dimensions)
+    if len(dimensions) == 2:
+        dimensions += (1, )
+    if dimensions[2] > 1:
+        return (1, ) + dimensions
+    return (1, ) + dimensions[:-1]
+
+
+def tensor_bytes(shape, element_bytes=1, layout='hwc'):
+    """
+    Return the data memory bytes per processor used by a tensor of `shape` (including the
+    batch dimension) with `element_bytes` per element. Channels are spread across the
+    processors, and more than `dev.PROCESSORS` channels are stored in multiple passes.
+    In HWC layout, each pixel takes one byte per channel; in CHW layout, each channel is
+    stored separately with four pixels per 32-bit word.
+    """
+    channels = shape[1] if len(shape) > 1 else 1
+    pixels = 1
+    for d in shape[2:]:
+        pixels *= d
+    passes = -(-channels // ai8x.dev.PROCESSORS)
+    if layout == 'chw':
+        return passes * -(-pixels * element_bytes // 4) * 4
+    return -(-passes * pixels * element_bytes // 4) * 4
+
+
+def _element_bytes(module):
+    """
+    Return the number of bytes per output element of `module`.
+    """
+    return 4 if getattr(module, 'wide', False) else 1
+
+
+class DataMemoryPlan:
+    """
+    Static estimate of the data memory used by `model` on the current device for a single
+    sample with `dimensions`. One forward pass with an all-zero input records the tensors
+    produced and consumed by each ai8x layer, elementwise operation and torch.cat()
+    concatenation of activations. A tensor stays live from the layer that produces it to the
+    last layer that reads it, so residual and skip connection buffers count until they are
+    consumed.
+    Concatenations are found through the activations themselves (a tensor subclass that
+    overrides __torch_function__), so that concatenations of parameters inside the layers
+    are not counted.
+    """
+    def __init__(self, model, dimensions, layout='hwc'):
+        if isinstance(model, nn.DataParallel):
+            model = model.module
+
+        self.layout = layout
+        self.layers = []
+        self.peak_bytes = 0
+        self.peak_layer = None
+
+        nodes = []
+        tensors = {}  # storage pointer -> [tensor, shape, element bytes, producer, last use]
+
+        def _key(t):
+            return t.storage().data_ptr()
+
+        def _use(t):
+            key = _key(t)
+            if key not in tensors:
+                # Produced by an operation that is not tracked, such as a view or functional op
+                tensors[key] = [t, tuple(t.shape), 1, len(nodes) - 1, len(nodes)]
+            tensors[key][4] = len(nodes)
+            return tensors[key][1]
+
+        def _record(name, inputs, output, element_bytes):
+            input_shapes = [_use(t) for t in inputs if torch.is_tensor(t)]
+            if torch.is_tensor(output):
+                tensors[_key(output)] = [output, tuple(output.shape), element_bytes,
+                                         len(nodes), len(nodes)]
+                nodes.append((name, input_shapes, tuple(output.shape), element_bytes))
+            else:
+                nodes.append((name, input_shapes, None, element_bytes))
+
+        class _Activation(torch.Tensor):
+            """Tensor type of the activations, which records their concatenations"""
+            @classmethod
+            def __torch_function__(cls, func, types, args=(), kwargs=None):
+                output = super().__torch_function__(func, types, args, kwargs)
+                if func is torch.cat:
+                    _record('cat', args[0] if args else kwargs['tensors'], output, 1)
+                return output
+
+        def _hook(name):
+            def _forward_hook(module, inputs, output):
+                _record(name, inputs, output, _element_bytes(module))
+                if torch.is_tensor(output) and not isinstance(output, _Activation):
+                    # Outputs of custom autograd functions lose the tensor type
+                    return output.as_subclass(_Activation)
+                return None
+            return _forward_hook
+
+        handles = []
+        for name, module in model.named_modules():
+            if isinstance(module, (ai8x.QuantizationAwareModule, ai8x.Eltwise,
+                                   ai8x_nas.OnceForAllModule)):
+                handles.append(module.register_forward_hook(_hook(name)))
+
+        training = model.training
+        model.eval()
+        try:
+            device = next(model.parameters()).device
+        except StopIteration:
+            device = 'cpu'
+        x = torch.zeros(input_shape(dimensions), device=device).as_subclass(_Activation)
+        tensors[_key(x)] = [x, tuple(x.shape), 1, -1, -1]
+        try:
+            with torch.no_grad():
+                y = model(x)
+        finally:
+            for handle in handles:
+                handle.remove()
+            model.train(training)
+
+        for output in y if isinstance(y, (tuple, list)) else (y, ):
+            if torch.is_tensor(output) and _key(output) in tensors:
+                tensors[_key(output)][4] = len(nodes) - 1
+
+        for step, (name, input_shapes, output_shape, element_bytes) in enumerate(nodes):
+            live = [(shape, b) for _, shape, b, first, last in tensors.values()
+                    if first <= step <= last]
+            live_bytes = sum(tensor_bytes(shape, b, layout) for shape, b in live)
+            output_bytes = tensor_bytes(output_shape, element_bytes, layout) \
+                if output_shape is not None else 0
+            self.layers.append(DataMemoryLayer(name, input_shapes, output_shape, output_bytes,
+                                               len(live), live_bytes))
+            if live_bytes > self.peak_bytes:
+                self.peak_bytes = live_bytes
+                self.peak_layer = name
+
+        self.size = PROCESSOR_DATA_SIZE[ai8x.dev.device]
+        self.fits = self.peak_bytes <= self.size
+        self.utilization = self.peak_bytes / self.size
+
+    def __str__(self):
+        lines = [f'{"Layer":<30} {"Input":<24} {"Output":<18} {"Bytes":>7} {"Live":>4} '
+                 f'{"Live bytes":>10}']
+        for layer in self.layers:
+            inputs = ', '.join('x'.join(str(d) for d in shape[1:])
+                               for shape in layer.input_shapes)
+            output = 'x'.join(str(d) for d in layer.output_shape[1:]) \
+                if layer.output_shape is not None else '-'
+            lines.append(f'{layer.name:<30} {inputs:<24} {output:<18} {layer.output_bytes:>7} '
+                         f'{layer.live:>4} {layer.live_bytes:>10}')
+        lines.append(f'Peak data memory ({self.layout.upper()}): {self.peak_bytes} of '
+                     f'{self.size} bytes per processor ({100. * self.utilization:.1f}%) '
+                     f'at layer {self.peak_layer}')
+        lines.append(f'The activations {"fit" if self.fits else "do NOT fit"} into {ai8x.dev}')
+        return '\n'.join(lines)
+
+
+def fits(model, dimensions, layout='hwc'):
+    """
+    Return True when the activations of `model` fit into the data memory of the device.
+    """
+    return DataMemoryPlan(model, dimensions, layout).fits
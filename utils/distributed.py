@@ -0,0 +1,229 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+DistributedDataParallel support for train.py.
+The process group is configured from the environment variables set by `torchrun` (or
+`python -m torch.distributed.launch --use_env`): RANK, LOCAL_RANK and WORLD_SIZE.
+"""
+import logging
+import math
+import os
+import random
+import tempfile
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch import nn
+from torch.utils.data import DataLoader, Sampler
+
+import torchnet.meter as tnt
+
+
+def init(args):
+    """
+    Initialize the process group when the script was started with more than one process, and
+    set `args.distributed`, `args.rank`, `args.local_rank` and `args.world_size`. The NCCL
+    backend is used for CUDA, and gloo for CPU-only (`--cpu`) runs.
+    """
+    args.world_size = int(os.environ.get('WORLD_SIZE', 1))
+    args.rank = int(os.environ.get('RANK', 0))
+    args.local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    args.distributed = args.world_size > 1
+    if not args.distributed:
+        return
+
+    use_cuda = not args.cpu and torch.cuda.is_available()
+    if use_cuda:
+        torch.cuda.set_device(args.local_rank)
+    dist.init_process_group('nccl' if use_cuda else 'gloo', init_method='env://')
+
+    # Common seed for random choices that must match across processes (e.g., NAS sampling)
+    seed = torch.randint(2**31 - 1, (1, ), device='cuda' if use_cuda else 'cpu')
+    dist.broadcast(seed, 0)
+    args.distributed_seed = int(seed.item())
+
+
+def is_main(args):
+    """
+    Return True in the process that logs and saves checkpoints.
+    """
+    return not getattr(args, 'distributed', False) or args.rank == 0
+
+
+def quiet_logger(args):
+    """
+    Return the logger for processes other than the main process. It only shows warnings and
+    errors, and its `logdir` is a private temporary directory.
+    """
+    logging.basicConfig(level=logging.WARNING,
+                        format=f'[rank {args.rank}] %(levelname)s %(message)s')
+    logger = logging.getLogger()
+    logger.setLevel(logging.WARNING)
+    logger.logdir = tempfile.mkdtemp(prefix=f'ai8x-rank{args.rank}-')
+    return logger
+
+
+def wrap(model, args):
+    """
+    Wrap `model` with DistributedDataParallel in distributed mode. Unused parameters are
+    expected during NAS, where only a sampled sub-network runs.
+    """
+    if not getattr(args, 'distributed', False):
+        return model
+    device_ids = [args.local_rank] if args.device == 'cuda' else None
+    return nn.parallel.DistributedDataParallel(model, device_ids=device_ids,
+                                               find_unused_parameters=bool(args.nas))
+
+
+def unwrap(model):
+    """
+    Return the module inside a DataParallel or DistributedDataParallel wrapper.
+    """
+    if isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
+        return model.module
+    return model
+
+
+def set_grad_sync(model, enabled):
+    """
+    Enable or disable the gradient all-reduce in the next backward pass of a
+    DistributedDataParallel `model` (see DistributedDataParallel.no_sync()). Must be called
+    before the forward pass.
+    """
+    if isinstance(model, nn.parallel.DistributedDataParallel):
+        model.require_backward_grad_sync = enabled
+
+
+def sync_random(args, epoch, step):
+    """
+    Seed Python's and NumPy's random generators identically in all processes, so that random
+    choices such as NAS sub-network sampling match.
+    """
+    seed = (args.distributed_seed + epoch * 1000003 + step) % 2**32
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+class ShardedSampler(Sampler):
+    """
+    Splits the indices produced by `sampler` (for example, distiller's SubsetRandomSampler)
+    across the processes. When `shuffle` is set, the indices are shuffled with a seed that
+    changes with set_epoch() and is the same in all processes. When `pad` is set, the index
+    list is padded by repeating indices so that every process gets the same number of samples
+    (and runs the same number of training steps). Evaluation shards are not padded, so that
+    every sample is counted exactly once when the metrics are combined.
+    """
+    def __init__(self, sampler, rank, world_size, shuffle, seed=0, pad=True):
+        super().__init__(None)
+        self.indices = sorted(sampler)
+        self.rank = rank
+        self.world_size = world_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.pad = pad
+        self.epoch = 0
+        if pad:
+            self.num_samples = math.ceil(len(self.indices) / world_size)
+        else:
+            self.num_samples = len(range(rank, len(self.indices), world_size))
+
+    def set_epoch(self, epoch):
+        """Select the shuffle order for `epoch`"""
+        self.epoch = epoch
+
+    def __iter__(self):
+        indices = self.indices
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            indices = [indices[i] for i in torch.randperm(len(indices), generator=generator)]
+        if self.pad:
+            indices = indices + indices[:self.num_samples * self.world_size - len(indices)]
+        return iter(indices[self.rank::self.world_size])
+
+    def __len__(self):
+        return self.num_samples
+
+
+def shard_loader(loader, args, shuffle, pad=True):
+    """
+    Return a data loader that reads this process's share of the samples of `loader` (see
+    ShardedSampler for `shuffle` and `pad`).
+    """
+    if not getattr(args, 'distributed', False):
+        return loader
+    sampler = ShardedSampler(loader.sampler, args.rank, args.world_size, shuffle,
+                             args.distributed_seed, pad)
+    return DataLoader(loader.dataset, batch_size=loader.batch_size, sampler=sampler,
+                      num_workers=loader.num_workers, collate_fn=loader.collate_fn,
+                      pin_memory=loader.pin_memory, drop_last=loader.drop_last,
+                      worker_init_fn=loader.worker_init_fn)
+
+
+def evaluation_model(model, args):
+    """
+    Return the model to evaluate unpadded shards with. Since the processes may run different
+    numbers of evaluation steps, the DistributedDataParallel wrapper, whose forward pass
+    broadcasts the buffers, is removed; instead, the buffers (e.g., batch norm statistics) of
+    the main process are broadcast once.
+    """
+    if not getattr(args, 'distributed', False):
+        return model
+    model = unwrap(model)
+    for buffer in model.buffers():
+        dist.broadcast(buffer, 0)
+    return model
+
+
+def set_epoch(loader, epoch):
+    """
+    Select the shuffle order of a sharded `loader` for `epoch`.
+    """
+    if isinstance(loader.sampler, ShardedSampler):
+        loader.sampler.set_epoch(epoch)
+
+
+def all_reduce_meters(meters, args):
+    """
+    Sum the statistics of the torchnet `meters` over all processes, so that every process
+    reports the metrics of the complete data set.
+    """
+    if not getattr(args, 'distributed', False):
+        return
+    device = 'cuda' if args.device == 'cuda' else 'cpu'
+    for meter in meters:
+        if isinstance(meter, tnt.ClassErrorMeter):
+            keys = sorted(meter.sum)
+            values = [meter.sum[k] for k in keys] + [meter.n]
+        elif isinstance(meter, tnt.MSEMeter):
+            values = [meter.sesum, meter.n]
+        elif isinstance(meter, tnt.AverageValueMeter):
+            values = [meter.sum, meter.n]
+        elif isinstance(meter, tnt.ConfusionMeter):
+            conf = torch.from_numpy(meter.conf).to(device)
+            dist.all_reduce(conf)
+            meter.conf[:] = conf.cpu().numpy()
+            continue
+        else:
+            raise TypeError(f'Cannot reduce {type(meter).__name__}')
+
+        reduced = torch.tensor([float(v) for v in values], dtype=torch.float64, device=device)
+        dist.all_reduce(reduced)
+        reduced = reduced.tolist()
+
+        if isinstance(meter, tnt.ClassErrorMeter):
+            for k, v in zip(keys, reduced):
+                meter.sum[k] = v
+            meter.n = int(reduced[-1])
+        elif isinstance(meter, tnt.MSEMeter):
+            meter.sesum, meter.n = reduced[0], int(reduced[1])
+        else:
+            meter.sum, meter.n = reduced[0], int(reduced[1])
+            meter.mean = meter.sum / meter.n if meter.n else math.nan
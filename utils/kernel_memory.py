@@ -0,0 +1,225 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Kernel memory estimates for models built from ai8x layers
+"""
+from collections import namedtuple
+
+from torch import nn
+
+import ai8x
+import ai8x_nas
+
+# Weights per kernel memory word (one 3x3 kernel). Each word holds the kernel of one input and
+# output channel pair, regardless of the kernel size; with fewer than 8 bits per weight, the
+# kernels of several output channels share a word.
+WORD_WEIGHTS = 9
+
+KernelMemoryLayer = namedtuple('KernelMemoryLayer', ['name', 'weight_bits', 'in_channels',
+                                                     'out_channels', 'kernel_size', 'processors',
+                                                     'offset', 'words', 'bias', 'bias_group'])
+
+
+def layer_kernels(module):
+    """
+    Return (input channels, kernels per input channel, weights per kernel) of the
+    QuantizationAwareModule or OnceForAllModule `module`, or None when the layer has no weights.
+    For OnceForAll layers, the currently selected sub-network is used.
+    """
+    op = module.op
+    if op is None:
+        return None
+    if isinstance(module, ai8x_nas.OnceForAllModule):
+        kernel_size = module.kernel_size ** (op.weight.dim() - 2)
+        groups = op.groups if op.groups == 1 else module.in_channels
+        return module.in_channels, module.out_channels // groups, kernel_size
+    if isinstance(op, nn.Linear):
+        return op.in_features, op.out_features, 1
+    if isinstance(op, nn.ConvTranspose2d):
+        in_channels, out_per_group = op.weight.shape[:2]
+        return in_channels, out_per_group, op.weight[0, 0].numel()
+    out_channels = op.weight.shape[0]
+    return op.in_channels, out_channels // op.groups, op.weight[0, 0].numel()
+
+
+def layer_out_channels(module):
+    """
+    Return the number of output channels of the layer `module` (see layer_kernels()).
+    """
+    op = module.op
+    if isinstance(module, ai8x_nas.OnceForAllModule):
+        return module.out_channels
+    if isinstance(op, nn.Linear):
+        return op.out_features
+    if isinstance(op, nn.ConvTranspose2d):
+        return op.weight.shape[1] * op.groups
+    return op.weight.shape[0]
+
+
+def kernels_per_word(weight_bits):
+    """
+    Return the number of kernels (of up to WORD_WEIGHTS weights) of `weight_bits` each that are
+    packed into one kernel memory word.
+    """
+    return max(1, 8 // weight_bits)
+
+
+def layer_kernel_memory(module, weight_bits, flatten_channels=None):
+    """
+    Return (processors, words per processor) used by the layer `module` when its weights are
+    quantized to `weight_bits`. Input channels are spread across the processors; more than
+    `dev.PROCESSORS` input channels need multiple passes that store their kernels in the same
+    processors. A Linear layer whose input is the flattened output of a layer with
+    `flatten_channels` channels uses one processor per channel, and the weights of up to
+    WORD_WEIGHTS input pixels of each channel share a word.
+    """
+    kernels = layer_kernels(module)
+    if kernels is None:
+        return 0, 0
+    in_channels, kernels_per_channel, kernel_size = kernels
+    pixels = 1
+    if isinstance(module.op, nn.Linear) and flatten_channels \
+       and in_channels > flatten_channels and in_channels % flatten_channels == 0:
+        in_channels, pixels = flatten_channels, in_channels // flatten_channels
+
+    processors = min(in_channels, ai8x.dev.PROCESSORS)
+    passes = -(-in_channels // ai8x.dev.PROCESSORS)
+    if pixels > 1:
+        words = kernels_per_channel * -(-pixels * weight_bits // (8 * WORD_WEIGHTS))
+    else:
+        words = -(-kernel_size // WORD_WEIGHTS) \
+            * -(-kernels_per_channel // kernels_per_word(weight_bits))
+    return processors, passes * words
+
+
+def preceding_channels(model):
+    """
+    Return, for the name of each layer with weights of `model`, the number of output channels
+    of the preceding layer with weights (in model order), or None for the first layer.
+    """
+    channels = {}
+    previous = None
+    for name, module in weight_layers(model):
+        channels[name] = previous
+        previous = layer_out_channels(module)
+    return channels
+
+
+def layer_weight_bits(name, module, qat_policy=None):
+    """
+    Return the weight bits of layer `name`. When a `qat_policy` is given, its `weight_bits`
+    and `overrides` are used in the same way as in ai8x.initiate_qat(). Otherwise, the bits of
+    a quantized layer, or the device weight bits for an unquantized layer, are returned.
+    """
+    if qat_policy is not None:
+        overrides = qat_policy.get('overrides') or {}
+        attr_str = name.rsplit('.', 1)[-1]
+        if attr_str in overrides:
+            return overrides[attr_str]['weight_bits']
+        return qat_policy['weight_bits']
+    if isinstance(module, ai8x.QuantizationAwareModule):
+        weight_bits = int(module.weight_bits.detach().item())
+        if weight_bits > 0:
+            return weight_bits
+    return ai8x.dev.WEIGHT_BITS
+
+
+def weight_layers(model):
+    """
+    Yield the name and module of the layers with weights of `model`, in model order. Layers
+    beyond the selected depth of OnceForAll units are skipped.
+    """
+    inactive = set()
+    for name, module in model.named_modules():
+        if isinstance(module, ai8x_nas.OnceForAllUnit) and hasattr(module, 'layers'):
+            for layer in module.layers[module.depth:]:
+                inactive.update(id(m) for m in layer.modules())
+        if id(module) in inactive:
+            continue
+        if isinstance(module, (ai8x.QuantizationAwareModule, ai8x_nas.OnceForAllModule)) \
+           and module.op is not None:
+            yield name, module
+
+
+class KernelMemoryLayout:
+    """
+    Static estimate of the kernel and bias memory layout of `model` on the current device.
+    Each layer is placed on the range of processors where it adds the least depth, and each
+    bias is placed into the bias memory group with the least remaining space that holds it.
+    Weight bits are selected as described in layer_weight_bits().
+    """
+    def __init__(self, model, qat_policy=None):
+        if isinstance(model, nn.DataParallel):
+            model = model.module
+
+        self.depth = [0] * ai8x.dev.PROCESSORS
+        self.bias_used = [0] * ai8x.dev.BIAS_GROUPS
+        self.layers = []
+        self.bias_fits = True
+
+        previous = preceding_channels(model)
+        for name, module in weight_layers(model):
+            weight_bits = layer_weight_bits(name, module, qat_policy)
+            in_channels, _, kernel_size = layer_kernels(module)
+            processors, words = layer_kernel_memory(module, weight_bits, previous[name])
+
+            offset = min(range(ai8x.dev.PROCESSORS - processors + 1),
+                         key=lambda o, p=processors: max(self.depth[o:o + p]))
+            for p in range(offset, offset + processors):
+                self.depth[p] += words
+
+            out_channels = layer_out_channels(module)
+            bias = 0
+            bias_group = None
+            if module.op.bias is not None:
+                bias = out_channels
+                free = [(ai8x.dev.BIAS_SIZE - used, group)
+                        for group, used in enumerate(self.bias_used)
+                        if ai8x.dev.BIAS_SIZE - used >= bias]
+                if free:
+                    bias_group = min(free)[1]
+                    self.bias_used[bias_group] += bias
+                else:
+                    self.bias_fits = False
+
+            self.layers.append(KernelMemoryLayer(name, weight_bits, in_channels, out_channels,
+                                                 kernel_size, processors, offset, words, bias,
+                                                 bias_group))
+
+        self.kernel_fits = max(self.depth) <= ai8x.dev.WEIGHT_DEPTH
+        self.fits = self.kernel_fits and self.bias_fits
+        self.utilization = sum(self.depth) / (ai8x.dev.PROCESSORS * ai8x.dev.WEIGHT_DEPTH)
+        self.bias_utilization = sum(self.bias_used) \
+            / (ai8x.dev.BIAS_GROUPS * ai8x.dev.BIAS_SIZE)
+
+    def __str__(self):
+        lines = [f'{"Layer":<30} {"Bits":>4} {"In":>5} {"Out":>5} {"Kernel":>6} '
+                 f'{"Processors":>10} {"Words":>6} {"Bias":>5} {"Group":>5}']
+        for layer in self.layers:
+            processors = f'{layer.offset}-{layer.offset + layer.processors - 1}'
+            group = layer.bias_group if layer.bias_group is not None else '-'
+            lines.append(f'{layer.name:<30} {layer.weight_bits:>4} {layer.in_channels:>5} '
+                         f'{layer.out_channels:>5} {layer.kernel_size:>6} {processors:>10} '
+                         f'{layer.words:>6} {layer.bias:>5} {group:>5}')
+        lines.append(f'Kernel memory: {sum(self.depth)} of '
+                     f'{ai8x.dev.PROCESSORS * ai8x.dev.WEIGHT_DEPTH} words '
+                     f'({100. * self.utilization:.1f}%), maximum processor depth '
+                     f'{max(self.depth)} of {ai8x.dev.WEIGHT_DEPTH}')
+        lines.append(f'Bias memory: {sum(self.bias_used)} of '
+                     f'{ai8x.dev.BIAS_GROUPS * ai8x.dev.BIAS_SIZE} bytes '
+                     f'({100. * self.bias_utilization:.1f}%)')
+        lines.append(f'The model {"fits" if self.fits else "does NOT fit"} into {ai8x.dev}')
+        return '\n'.join(lines)
+
+
+def fits(model, qat_policy=None):
+    """
+    Return True when the kernels and biases of `model` fit into the memory of the device.
+    """
+    return KernelMemoryLayout(model, qat_policy).fits
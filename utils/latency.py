@@ -0,0 +1,185 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Analytical latency and energy estimates for models built from ai8x layers
+"""
+from collections import namedtuple
+
+import torch
+from torch import nn
+
+import ai8x
+import ai8x_nas
+from utils import data_memory
+
+# Accelerator clock, in Hz
+CLOCK = {
+    84: 50e6,
+    85: 50e6,
+    87: 100e6,
+}
+
+# Energy per active processor per cycle, and per cycle for the rest of the accelerator, in J
+PROCESSOR_ENERGY = {
+    84: 5e-12,
+    85: 5e-12,
+    87: 4e-12,
+}
+STATIC_ENERGY = {
+    84: 1e-10,
+    85: 1e-10,
+    87: 1.5e-10,
+}
+
+# Cycles to configure and start each layer
+LAYER_OVERHEAD = 64
+
+# Weights read per processor and cycle (one 3x3 kernel)
+KERNEL_WEIGHTS_PER_CYCLE = 9
+
+LatencyLayer = namedtuple('LatencyLayer', ['name', 'input_shape', 'output_shape', 'passes',
+                                           'processors', 'cycles', 'latency', 'energy'])
+
+
+def _pixels(shape):
+    """
+    Return the number of pixels of a tensor with `shape` (including the batch dimension).
+    """
+    pixels = 1
+    for d in shape[2:]:
+        pixels *= d
+    return pixels
+
+
+def _kernel_elements(kernel_size):
+    """
+    Return the number of elements of a pooling or convolution `kernel_size`.
+    """
+    if isinstance(kernel_size, int):
+        return kernel_size
+    elements = 1
+    for d in kernel_size:
+        elements *= d
+    return elements
+
+
+def layer_cycles(module, input_shape, output_shape):
+    """
+    Return (passes, processors, cycles) for the ai8x layer `module` with `input_shape` and
+    `output_shape`. Input channels are processed in parallel by up to `dev.PROCESSORS`
+    processors, and more input channels require multiple passes. For each pass, every
+    output pixel takes one cycle per output channel and 3x3 kernel (one output channel for
+    depthwise convolutions), and pooling takes one cycle per pooling window element.
+    """
+    in_channels = input_shape[1] if len(input_shape) > 1 else 1
+    passes = -(-in_channels // ai8x.dev.PROCESSORS)
+    processors = min(in_channels, ai8x.dev.PROCESSORS)
+
+    if isinstance(module, ai8x.Eltwise):
+        return passes, processors, LAYER_OVERHEAD + passes * _pixels(output_shape)
+
+    op = module.op
+    pool = module.pool
+    pool_cycles = 0
+    pooled_pixels = _pixels(input_shape)
+    if pool is not None:
+        if op is None:
+            pooled_pixels = _pixels(output_shape)
+        else:
+            pooled_pixels = _pixels(pool(torch.zeros((1, ) + tuple(input_shape[1:]))).shape)
+        pool_cycles = passes * pooled_pixels * _kernel_elements(pool.kernel_size)
+    if op is None:
+        return passes, processors, LAYER_OVERHEAD + pool_cycles
+
+    if isinstance(op, nn.Linear):
+        outputs, kernel_cycles, out_pixels = op.out_features, 1, 1
+    else:
+        kernel_cycles = -(-op.weight[0, 0].numel() // KERNEL_WEIGHTS_PER_CYCLE)
+        out_pixels = _pixels(output_shape)
+        groups = op.groups
+        if isinstance(module, ai8x_nas.OnceForAllModule) and groups != 1:
+            groups = in_channels
+        outputs = output_shape[1] // groups
+    return passes, processors, \
+        LAYER_OVERHEAD + pool_cycles + passes * out_pixels * outputs * kernel_cycles
+
+
+class LatencyEstimate:
+    """
+    Analytical estimate of the inference latency and energy of `model` on the current device
+    for a single sample with `dimensions`. The layer shapes are recorded in one forward pass
+    with an all-zero input; layers run one after the other. See layer_cycles() for the
+    per-layer model.
+    """
+    def __init__(self, model, dimensions):
+        if isinstance(model, nn.DataParallel):
+            model = model.module
+
+        device = ai8x.dev.device
+        self.layers = []
+        shapes = []
+
+        def _hook(name):
+            def _forward_hook(module, inputs, output):
+                if torch.is_tensor(output) and inputs and torch.is_tensor(inputs[0]):
+                    shapes.append((name, module, tuple(inputs[0].shape), tuple(output.shape)))
+            return _forward_hook
+
+        handles = []
+        for name, module in model.named_modules():
+            if isinstance(module, (ai8x.QuantizationAwareModule, ai8x.Eltwise,
+                                   ai8x_nas.OnceForAllModule)):
+                handles.append(module.register_forward_hook(_hook(name)))
+
+        training = model.training
+        model.eval()
+        try:
+            param_device = next(model.parameters()).device
+        except StopIteration:
+            param_device = 'cpu'
+        try:
+            with torch.no_grad():
+                model(torch.zeros(data_memory.input_shape(dimensions), device=param_device))
+        finally:
+            for handle in handles:
+                handle.remove()
+            model.train(training)
+
+        with torch.no_grad():
+            for name, module, input_shape, output_shape in shapes:
+                passes, processors, cycles = layer_cycles(module, input_shape, output_shape)
+                energy = cycles * (processors * PROCESSOR_ENERGY[device] + STATIC_ENERGY[device])
+                self.layers.append(LatencyLayer(name, input_shape, output_shape, passes,
+                                                processors, cycles, cycles / CLOCK[device],
+                                                energy))
+
+        self.cycles = sum(layer.cycles for layer in self.layers)
+        self.latency = self.cycles / CLOCK[device]
+        self.energy = sum(layer.energy for layer in self.layers)
+
+    def __str__(self):
+        lines = [f'{"Layer":<30} {"Input":<16} {"Output":<16} {"Passes":>6} {"Procs":>5} '
+                 f'{"Cycles":>10} {"Time [us]":>10} {"Energy [uJ]":>11}']
+        for layer in self.layers:
+            input_shape = 'x'.join(str(d) for d in layer.input_shape[1:])
+            output_shape = 'x'.join(str(d) for d in layer.output_shape[1:])
+            lines.append(f'{layer.name:<30} {input_shape:<16} {output_shape:<16} '
+                         f'{layer.passes:>6} {layer.processors:>5} {layer.cycles:>10} '
+                         f'{1e6 * layer.latency:>10.1f} {1e6 * layer.energy:>11.3f}')
+        lines.append(f'Estimated inference on {ai8x.dev}: {self.cycles} cycles, '
+                     f'{1e6 * self.latency:.1f} us, {1e6 * self.energy:.2f} uJ')
+        return '\n'.join(lines)
+
+
+def estimate(model, dimensions):
+    """
+    Return (latency in seconds, energy in J) of `model` for a single sample with `dimensions`.
+    """
+    result = LatencyEstimate(model, dimensions)
+    return result.latency, result.energy
@@ -0,0 +1,77 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Meters that accumulate on the device of their inputs. Unlike the torchnet meters, adding a
+value does not copy it to the host, so the training loop only synchronizes with the GPU when
+a result is read.
+"""
+import torch
+
+
+class TensorAverageMeter:
+    """
+    Running mean of scalar tensors (or numbers). Reading `mean` synchronizes.
+    """
+    def __init__(self):
+        self.sum = 0.
+        self.n = 0
+
+    def reset(self):
+        """Reset the meter"""
+        self.sum = 0.
+        self.n = 0
+
+    def add(self, value, n=1):
+        """Add `value`, weighted by `n`"""
+        if torch.is_tensor(value):
+            value = value.detach()
+        self.sum = self.sum + value * n
+        self.n += n
+
+    @property
+    def mean(self):
+        """The mean of all values added, as a float"""
+        if self.n == 0:
+            return float('nan')
+        return float(self.sum) / self.n
+
+
+class TensorClassErrorMeter:
+    """
+    Top-k accuracy in percent (see torchnet's ClassErrorMeter with `accuracy=True`). value()
+    returns a tensor on the device of the outputs; convert it with float() to read it.
+    """
+    def __init__(self, topk=(1, )):
+        self.topk = sorted(set(topk))
+        self.correct = {}
+        self.n = 0
+        self.reset()
+
+    def reset(self):
+        """Reset the meter"""
+        self.correct = {k: 0 for k in self.topk}
+        self.n = 0
+
+    def add(self, output, target):
+        """Add a batch of `output` scores and `target` class indices"""
+        output = output.detach()
+        if output.dim() == 1:
+            output = output.unsqueeze(0)
+        maxk = min(self.topk[-1], output.shape[1])
+        pred = output.topk(maxk, 1, True, True)[1]
+        correct = pred == target.detach().view(-1, 1)
+        for k in self.topk:
+            self.correct[k] = self.correct[k] + correct[:, :k].sum()
+        self.n += output.shape[0]
+
+    def value(self, k=None):
+        """The top-`k` accuracy (default: the smallest k) in percent, as a tensor"""
+        if k is None:
+            k = self.topk[0]
+        return self.correct[k] * (100. / self.n)
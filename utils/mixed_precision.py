@@ -0,0 +1,190 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Mixed-precision planner for quantization-aware training.
+Measures the sensitivity of each layer to weight quantization on a calibration subset and
+selects per-layer weight bits that fit into the kernel memory of the selected device.
+"""
+import copy
+import logging
+from collections import OrderedDict
+
+import torch
+from torch import nn
+
+import yaml
+
+import ai8x
+from utils import kernel_memory
+
+WEIGHT_BITS = [8, 4, 2, 1]
+
+msglogger = logging.getLogger()
+
+
+def layer_groups(model):
+    """
+    Return the quantization-aware layers with weights of `model`, grouped by attribute name.
+    QAT policy overrides select layers by attribute name, so all layers in a group use the
+    same weight bits.
+    """
+    groups = OrderedDict()
+    for name, module in model.named_modules():
+        if isinstance(module, ai8x.QuantizationAwareModule) and module.op is not None:
+            groups.setdefault(name.rsplit('.', 1)[-1], []).append(name)
+    return groups
+
+
+def group_kernel_memory(model, names, weight_bits):
+    """
+    Return (total kernel memory words, maximum words per processor) of the layers `names`
+    of `model` with `weight_bits` weights.
+    """
+    modules = dict(model.named_modules())
+    previous = kernel_memory.preceding_channels(model)
+    total = depth = 0
+    for name in names:
+        processors, words = kernel_memory.layer_kernel_memory(modules[name], weight_bits,
+                                                              previous.get(name))
+        total += processors * words
+        depth = max(depth, words)
+    return total, depth
+
+
+def calibration_loss(model, batches, criterion, args):
+    """
+    Return the mean loss of `model` on the calibration `batches`.
+    """
+    model.eval()
+    loss = 0.
+    with torch.no_grad():
+        for inputs, target in batches:
+            output = model(inputs)
+            if args.out_fold_ratio != 1:
+                output = ai8x.unfold_batch(output, args.out_fold_ratio)
+            loss += criterion(output, target).item()
+    return loss / len(batches)
+
+
+def measure_sensitivity(model, groups, batches, criterion, shift_quantile, args):
+    """
+    Return the calibration loss of `model` and, for each layer group and weight bits, the
+    loss increase when only the layers in the group are quantized.
+    """
+    base_loss = calibration_loss(model, batches, criterion, args)
+    sensitivity = OrderedDict()
+    for group, names in groups.items():
+        sensitivity[group] = {}
+        for bits in WEIGHT_BITS:
+            probe = copy.deepcopy(model)
+            modules = dict(probe.named_modules())
+            for name in names:
+                modules[name].init_module(bits, bits, True, shift_quantile)
+            sensitivity[group][bits] = calibration_loss(probe, batches, criterion, args) \
+                - base_loss
+        msglogger.info('%s: %s', group, ', '.join(f'{bits}-bit: {loss:+.5f}'
+                                                  for bits, loss in sensitivity[group].items()))
+    return base_loss, sensitivity
+
+
+def selection_policy(selection):
+    """
+    Return a QAT policy fragment with the per-group weight bits in `selection`.
+    """
+    return {'weight_bits': WEIGHT_BITS[0],
+            'overrides': {group: {'weight_bits': bits} for group, bits in selection.items()}}
+
+
+def select_weight_bits(model, groups, sensitivity):
+    """
+    Return the weight bits for each layer group so that the layers fit into kernel memory.
+    Starting from 8-bit weights, the group that adds the least loss per kernel memory word
+    saved is reduced until the kernel memory layout fits. Returns None when the model does not
+    fit even with 1-bit weights.
+    """
+    budget = ai8x.dev.PROCESSORS * ai8x.dev.WEIGHT_DEPTH
+    memory = {group: {bits: group_kernel_memory(model, names, bits) for bits in WEIGHT_BITS}
+              for group, names in groups.items()}
+    selection = {group: WEIGHT_BITS[0] for group in groups}
+
+    def _total():
+        return sum(memory[group][bits][0] for group, bits in selection.items())
+
+    while True:
+        too_deep = [group for group, bits in selection.items()
+                    if memory[group][bits][1] > ai8x.dev.WEIGHT_DEPTH]
+        if not too_deep and _total() <= budget \
+           and kernel_memory.KernelMemoryLayout(model, selection_policy(selection)).kernel_fits:
+            return selection
+
+        best, best_score = None, None
+        for group in too_deep or selection:
+            bits = selection[group]
+            if bits == WEIGHT_BITS[-1]:
+                continue
+            lower = WEIGHT_BITS[WEIGHT_BITS.index(bits) + 1]
+            saved = memory[group][bits][0] - memory[group][lower][0]
+            if saved <= 0:
+                continue
+            score = max(0., sensitivity[group][lower] - sensitivity[group][bits]) / saved
+            if best is None or score < best_score:
+                best, best_score = group, score
+        if best is None:
+            return None
+        selection[best] = WEIGHT_BITS[WEIGHT_BITS.index(selection[best]) + 1]
+
+
+def search(model, criterion, data_loader, qat_policy, args):
+    """
+    Run the mixed-precision search for `model` on the first `args.mixed_precision_batches`
+    batches of `data_loader` and save the resulting QAT policy, including the per-layer
+    `overrides`, to `args.mixed_precision`.
+    """
+    if isinstance(model, nn.DataParallel):
+        model = model.module
+    model = copy.deepcopy(model)
+    ai8x.fuse_bn_layers(model)
+
+    batches = []
+    for inputs, target in data_loader:
+        batches.append((inputs.to(args.device), target.to(args.device)))
+        if len(batches) >= args.mixed_precision_batches:
+            break
+
+    msglogger.info('Measuring the weight quantization sensitivity on %d batches',
+                   len(batches))
+    groups = layer_groups(model)
+    base_loss, sensitivity = measure_sensitivity(model, groups, batches, criterion,
+                                                 qat_policy.get('shift_quantile', 1.0), args)
+    msglogger.info('Calibration loss: %.5f', base_loss)
+
+    selection = select_weight_bits(model, groups, sensitivity)
+    if selection is None:
+        raise ValueError('The model does not fit into the kernel memory of '
+                         f'{ai8x.dev}, even with 1-bit weights')
+
+    policy = OrderedDict((key, value) for key, value in qat_policy.items()
+                         if key != 'overrides')
+    policy['weight_bits'] = max(WEIGHT_BITS, key=list(selection.values()).count)
+    overrides = {group: {'weight_bits': bits} for group, bits in selection.items()
+                 if bits != policy['weight_bits']}
+    if overrides:
+        policy['overrides'] = overrides
+
+    total = sum(group_kernel_memory(model, groups[group], bits)[0]
+                for group, bits in selection.items())
+    msglogger.info('Selected weight bits: %s', ', '.join(f'{group}: {bits}'
+                                                          for group, bits in selection.items()))
+    msglogger.info('Kernel memory: %d of %d words (%.1f%%)', total,
+                   ai8x.dev.PROCESSORS * ai8x.dev.WEIGHT_DEPTH,
+                   100. * total / (ai8x.dev.PROCESSORS * ai8x.dev.WEIGHT_DEPTH))
+
+    with open(args.mixed_precision, mode='w', encoding='utf-8') as stream:
+        yaml.safe_dump(dict(policy), stream, explicit_start=True, sort_keys=False)
+    msglogger.info('Saved the QAT policy to %s', args.mixed_precision)
@@ -0,0 +1,106 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Data loader wrapper that moves the next batch to the device while the current one is used
+"""
+import contextlib
+
+import torch
+
+
+class DevicePrefetcher:
+    """
+    Iterates over `loader` and returns batches that are already on `device`. Tensors may be
+    nested in lists, tuples and dicts (e.g., the box and label lists of the object detection
+    collate functions). On CUDA, the next batch is copied from pinned memory with non-blocking
+    copies on a side stream, so that the copy overlaps with the computation on the current
+    batch. Without CUDA, the batches are loaded when they are requested.
+    Other attributes (such as `sampler` or `batch_size`) are those of `loader`.
+    When a `profiler` (utils.profiling.Profiler) is given, loading and copying are timed as
+    'data/load' and 'data/h2d_copy'.
+    """
+    def __init__(self, loader, device, profiler=None):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.stream = torch.cuda.Stream() if self.device.type == 'cuda' else None
+        self.profiler = profiler
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def _phase(self, name):
+        """Time phase `name` with the profiler, if any"""
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.phase(name)
+
+    def _to_device(self, batch):
+        """Start copying all tensors in `batch` to the device"""
+        if torch.is_tensor(batch):
+            if self.stream is None:
+                return batch.to(self.device)
+            if not batch.is_pinned():
+                batch = batch.pin_memory()
+            return batch.to(self.device, non_blocking=True)
+        if isinstance(batch, dict):
+            return {k: self._to_device(v) for k, v in batch.items()}
+        if isinstance(batch, (list, tuple)):
+            items = [self._to_device(v) for v in batch]
+            if isinstance(batch, list):
+                return items
+            if hasattr(batch, '_fields'):
+                return type(batch)(*items)
+            return tuple(items)
+        return batch
+
+    def _record_stream(self, batch):
+        """Mark the tensors in `batch` as used by the current stream"""
+        if torch.is_tensor(batch):
+            batch.record_stream(torch.cuda.current_stream())
+        elif isinstance(batch, dict):
+            for v in batch.values():
+                self._record_stream(v)
+        elif isinstance(batch, (list, tuple)):
+            for v in batch:
+                self._record_stream(v)
+
+    def __iter__(self):
+        iterator = iter(self.loader)
+
+        def _load():
+            try:
+                with self._phase('data/load'):
+                    batch = next(iterator)
+            except StopIteration:
+                return None
+            with self._phase('data/h2d_copy'):
+                if self.stream is None:
+                    return self._to_device(batch)
+                with torch.cuda.stream(self.stream):
+                    return self._to_device(batch)
+
+        if self.stream is None:
+            # Without a side stream, the copy cannot overlap with the computation
+            batch = _load()
+            while batch is not None:
+                yield batch
+                batch = _load()
+            return
+
+        batch = _load()
+        while batch is not None:
+            torch.cuda.current_stream().wait_stream(self.stream)
+            self._record_stream(batch)
+            # Start loading and copying the next batch before the current one is used
+            next_batch = _load()
+            yield batch
+            batch = next_batch
@@ -0,0 +1,198 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Per-phase timing of train.py (--profile)
+"""
+import contextlib
+import functools
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import torch
+from torch import nn
+
+msglogger = logging.getLogger()
+
+
+class Profiler:
+    """
+    Records the wall-clock time of the phases of each training epoch. Phases are either
+    timed as laps (lap() records the time since the previous lap) or with the phase() context
+    manager; names containing '/' are parts of the phase named by the prefix. On CUDA, the
+    device is synchronized at every phase boundary so that GPU work is attributed to the
+    phase that issued it, which slows down training.
+    When `trace_steps` is positive, the `trace_steps` training steps after the first
+    `trace_wait` steps are recorded with torch.profiler, and a Chrome trace is written to
+    `logdir`. When the profiler is not `enabled`, all methods do nothing.
+    """
+    def __init__(self, enabled=False, device='cpu', logdir=None, trace_steps=0, trace_wait=5):
+        self.enabled = enabled
+        self.cuda = enabled and torch.device(device).type == 'cuda'
+        self.logdir = logdir
+        self.trace_steps = trace_steps if enabled else 0
+        self.trace_wait = trace_wait
+        self.trace = None
+        self.steps = 0
+        self.totals = OrderedDict()
+        self.counts = {}
+        self.last = None
+        self.wall_start = None
+        self.module_start = {}
+        self.hooks = []
+        self.reset()
+
+    def _now(self):
+        """Return the current time after the device finished all queued work"""
+        if self.cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def reset(self):
+        """Clear all timings"""
+        self.totals.clear()
+        self.counts.clear()
+        self.last = None
+        if self.enabled:
+            self.wall_start = self._now()
+
+    def add(self, name, seconds):
+        """Add `seconds` to phase `name`"""
+        if name not in self.totals:
+            self.totals[name] = 0.
+            self.counts[name] = 0
+        self.totals[name] += seconds
+        self.counts[name] += 1
+
+    def restart(self):
+        """Start the first lap"""
+        if self.enabled:
+            self.last = self._now()
+
+    def lap(self, name):
+        """Record the time since the last lap (or restart()) as phase `name`"""
+        if not self.enabled:
+            return
+        now = self._now()
+        if self.last is not None:
+            self.add(name, now - self.last)
+        self.last = now
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Record the time spent in the context as phase `name`"""
+        if not self.enabled:
+            yield
+            return
+        start = self._now()
+        try:
+            yield
+        finally:
+            self.add(name, self._now() - start)
+
+    def _start_module(self, module, _inputs):
+        self.module_start[id(module)] = self._now()
+
+    def _stop_module(self, name, module, _inputs, _output):
+        start = self.module_start.pop(id(module), None)
+        if start is not None:
+            self.add(name, self._now() - start)
+
+    def attach(self, model):
+        """
+        Record the forward pass of each top-level module of `model` as 'forward/<name>'.
+        TorchScript models do not support hooks and are only timed as a whole.
+        """
+        self.detach()
+        if not self.enabled:
+            return
+        while isinstance(model, (nn.DataParallel, nn.parallel.DistributedDataParallel)):
+            model = model.module
+        if isinstance(model, torch.jit.ScriptModule):
+            return
+        for name, module in model.named_children():
+            self.hooks.append(module.register_forward_pre_hook(self._start_module))
+            self.hooks.append(module.register_forward_hook(
+                functools.partial(self._stop_module, f'forward/{name}')))
+
+    def detach(self):
+        """Remove the hooks added by attach()"""
+        for hook in self.hooks:
+            hook.remove()
+        self.hooks = []
+        self.module_start.clear()
+
+    def step(self):
+        """Mark the end of a training step, and start or stop the torch.profiler trace"""
+        if self.trace_steps <= 0:
+            return
+        self.steps += 1
+        if self.trace is None and self.steps == self.trace_wait:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.trace = torch.profiler.profile(activities=activities)
+            self.trace.__enter__()
+        elif self.trace is not None and self.steps == self.trace_wait + self.trace_steps:
+            self.trace.__exit__(None, None, None)
+            self._write_trace()
+            self.trace = None
+            self.trace_steps = 0
+
+    def _write_trace(self):
+        """Write the Chrome trace and the operator summary of the torch.profiler trace"""
+        if self.logdir is None:
+            return
+        path = os.path.join(self.logdir, 'trace.json')
+        self.trace.export_chrome_trace(path)
+        sort_by = 'self_cuda_time_total' if self.cuda else 'self_cpu_time_total'
+        with open(os.path.join(self.logdir, 'profile.txt'), mode='a', encoding='utf-8') as f:
+            f.write(f'torch.profiler summary of {self.trace_steps} training steps:\n')
+            f.write(self.trace.key_averages().table(sort_by=sort_by, row_limit=30))
+            f.write('\n\n')
+        msglogger.info('Saved torch.profiler trace of %d training steps to %s',
+                       self.trace_steps, path)
+
+    def summary(self):
+        """Return a table of all phases, with the share of the wall time since reset()"""
+        wall = self._now() - self.wall_start
+        lines = [f'{"Phase":<40} {"Calls":>8} {"Total [s]":>10} {"Mean [ms]":>10} '
+                 f'{"Share":>7}']
+        recorded = 0.
+        for name, total in self.totals.items():
+            if '/' not in name:
+                recorded += total
+            label = '  ' + name.split('/', 1)[1] if '/' in name else name
+            lines.append(f'{label:<40} {self.counts[name]:>8} {total:>10.3f} '
+                         f'{1000. * total / self.counts[name]:>10.3f} '
+                         f'{100. * total / wall:>6.1f}%')
+        lines.append(f'{"(other)":<40} {"":>8} {wall - recorded:>10.3f} {"":>10} '
+                     f'{100. * (wall - recorded) / wall:>6.1f}%')
+        lines.append(f'{"Wall time":<40} {"":>8} {wall:>10.3f}')
+        return '\n'.join(lines)
+
+    def report(self, epoch):
+        """Log the timings of `epoch`, append them to profile.txt in `logdir`, and reset"""
+        if not self.enabled:
+            return
+        # List the phases in the order of their first use, each followed by its parts
+        order = {}
+        for name in self.totals:
+            order.setdefault(name.split('/')[0], len(order))
+        self.totals = OrderedDict(sorted(self.totals.items(),
+                                         key=lambda item: (order[item[0].split('/')[0]],
+                                                           '/' in item[0])))
+        table = self.summary()
+        msglogger.info('Profile of epoch %d:\n%s', epoch, table)
+        if self.logdir is not None:
+            with open(os.path.join(self.logdir, 'profile.txt'), mode='a',
+                      encoding='utf-8') as f:
+                f.write(f'Epoch {epoch}:\n{table}\n\n')
+        self.reset()
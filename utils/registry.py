@@ -0,0 +1,52 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Dynamic discovery of the models and datasets
+"""
+import fnmatch
+import os
+from pydoc import locate
+
+
+def load_models():
+    """
+    Return the entries of the `models` lists of all modules in the models directory. The
+    name of the defining module is added to each entry as 'module'.
+    """
+    supported_models = []
+    for _, _, files in sorted(os.walk('models')):
+        for name in sorted(files):
+            if fnmatch.fnmatch(name, '*.py'):
+                fn = 'models.' + name[:-3]
+                m = locate(fn)
+                try:
+                    for i in m.models:
+                        i['module'] = fn
+                    supported_models += m.models
+                except AttributeError:
+                    # Skip files that don't have 'models' or 'models.name'
+                    pass
+    return supported_models
+
+
+def load_datasets():
+    """
+    Return the entries of the `datasets` lists of all modules in the datasets directory.
+    """
+    supported_sources = []
+    for _, _, files in sorted(os.walk('datasets')):
+        for name in sorted(files):
+            if fnmatch.fnmatch(name, '*.py'):
+                ds = locate('datasets.' + name[:-3])
+                try:
+                    supported_sources += ds.datasets
+                except AttributeError:
+                    # Skip files that don't have 'datasets' or 'datasets.name'
+                    pass
+    return supported_sources
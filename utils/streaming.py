@@ -0,0 +1,166 @@
+###################################################################################################
+#
+# Copyright (C) 2023 Maxim Integrated Products, Inc. All Rights Reserved.
+#
+# Maxim Integrated Products, Inc. Default Copyright Notice:
+# https://www.maximintegrated.com/en/aboutus/legal/copyrights.html
+#
+###################################################################################################
+"""
+Streaming (row-by-row) simulation for fully convolutional models built from ai8x layers
+"""
+from collections import namedtuple
+
+import torch
+from torch import nn
+
+import ai8x
+import ai8x_nas
+from utils import data_memory
+
+StreamingLayer = namedtuple('StreamingLayer', ['name', 'input_shape', 'output_shape', 'rows',
+                                               'buffer_bytes'])
+
+
+def _first(value):
+    """
+    Return the first element of a kernel size, stride or dilation `value`.
+    """
+    return value[0] if isinstance(value, (tuple, list)) else value
+
+
+class StreamingPlan:
+    """
+    Row streaming requirements of `model` for a single sample with `dimensions`. One forward
+    pass with an all-zero input records the layers in execution order. For each layer, the
+    plan holds the number of input rows that must be buffered before the layer can produce
+    an output row (the line buffer). It also holds the alignment of stripe boundaries
+    (the total downsampling) and the halo rows needed so that stripes produce the same
+    output as whole frames. The halo is a conservative bound, since layers on parallel
+    paths (residual and skip connections) are added up. `scale` is the number of input rows
+    per output row of the model.
+    """
+    def __init__(self, model, dimensions):
+        if isinstance(model, nn.DataParallel):
+            model = model.module
+
+        self.layers = []
+        traced = []
+
+        def _hook(name):
+            def _forward_hook(module, inputs, output):
+                if torch.is_tensor(output) and inputs and torch.is_tensor(inputs[0]):
+                    traced.append((name, module, tuple(inputs[0].shape), tuple(output.shape)))
+            return _forward_hook
+
+        handles = []
+        for name, module in model.named_modules():
+            if isinstance(module, (ai8x.QuantizationAwareModule, ai8x.Eltwise,
+                                   ai8x_nas.OnceForAllModule)):
+                handles.append(module.register_forward_hook(_hook(name)))
+
+        training = model.training
+        model.eval()
+        try:
+            device = next(model.parameters()).device
+        except StopIteration:
+            device = 'cpu'
+        try:
+            with torch.no_grad():
+                model(torch.zeros(data_memory.input_shape(dimensions), device=device))
+        finally:
+            for handle in handles:
+                handle.remove()
+            model.train(training)
+
+        self.streamable = True
+        scale = 1.  # Input rows per row at the current layer
+        self.alignment = 1
+        halo = 0.
+        for name, module, input_shape, output_shape in traced:
+            if len(input_shape) < 3 or len(output_shape) < 3:
+                self.streamable = False
+            rows = 1
+            op = getattr(module, 'op', None)
+            pool = getattr(module, 'pool', None)
+            if pool is not None:
+                kernel, stride = _first(pool.kernel_size), _first(pool.stride)
+                halo += (kernel - 1) * scale
+                scale *= stride
+                rows = kernel
+            if op is not None:
+                if isinstance(op, nn.Linear):
+                    self.streamable = False
+                else:
+                    kernel = _first(op.kernel_size)
+                    if isinstance(module, ai8x_nas.OnceForAllModule):
+                        kernel = module.kernel_size
+                    dilation, stride = _first(op.dilation), _first(op.stride)
+                    span = (kernel - 1) * dilation + 1
+                    if isinstance(op, nn.ConvTranspose2d):
+                        scale /= stride
+                        halo += (span - 1) * scale
+                    else:
+                        halo += (span - 1) * scale
+                        scale *= stride
+                    rows = span if pool is None else (span - 1) * _first(pool.stride) + rows
+            self.alignment = max(self.alignment, int(round(scale)))
+
+            row_bytes = 1
+            for d in input_shape[1:2] + input_shape[3:]:
+                row_bytes *= d
+            self.layers.append(StreamingLayer(name, input_shape, output_shape, rows,
+                                              rows * row_bytes))
+
+        self.scale = scale
+        self.halo = -(-int(halo + 0.5) // self.alignment) * self.alignment
+        self.buffer_bytes = sum(layer.buffer_bytes for layer in self.layers)
+
+    def __str__(self):
+        lines = [f'{"Layer":<30} {"Input":<16} {"Output":<16} {"Rows":>5} {"Buffer":>8}']
+        for layer in self.layers:
+            input_shape = 'x'.join(str(d) for d in layer.input_shape[1:])
+            output_shape = 'x'.join(str(d) for d in layer.output_shape[1:])
+            lines.append(f'{layer.name:<30} {input_shape:<16} {output_shape:<16} '
+                         f'{layer.rows:>5} {layer.buffer_bytes:>8}')
+        lines.append(f'Minimum line buffers: {self.buffer_bytes} bytes')
+        if self.streamable:
+            lines.append(f'Stripe alignment: {self.alignment} rows, halo: {self.halo} rows')
+        else:
+            lines.append('The model is not fully convolutional and cannot be streamed')
+        return '\n'.join(lines)
+
+
+class StreamingModel(nn.Module):
+    """
+    Runs the fully convolutional `model` on horizontal stripes of `rows` input rows (dimension
+    2 of the input, the length for 1D models) plus the halo rows of the StreamingPlan `plan`,
+    and concatenates the cropped outputs. The result matches whole-frame inference, while
+    only one stripe of activations is held in memory at a time.
+    """
+    def __init__(self, model, plan, rows):
+        super().__init__()
+        if not plan.streamable:
+            raise ValueError('ERROR: The model is not fully convolutional (for example, it '
+                             'contains Linear layers) and cannot be streamed')
+        if rows <= 0:
+            raise ValueError('ERROR: The number of streaming rows must be positive')
+        self.model = model
+        self.halo = plan.halo
+        self.scale = plan.scale
+        self.rows = -(-rows // plan.alignment) * plan.alignment
+
+    def forward(self, x):  # pylint: disable=arguments-differ
+        """Forward prop"""
+        height = x.shape[2]
+        outputs = []
+        for top in range(0, height, self.rows):
+            bottom = min(top + self.rows, height)
+            lo, hi = max(0, top - self.halo), min(height, bottom + self.halo)
+            y = self.model(x[:, :, lo:hi])
+            # The stripes start at multiples of the alignment, so only the last one can
+            # have a partial output row
+            start = int(round((top - lo) / self.scale))
+            end = y.shape[2] if hi == height else int(round((bottom - lo) / self.scale))
+            outputs.append(y[:, :, start:end])
+        return torch.cat(outputs, dim=2)